@@ -0,0 +1,295 @@
+"""Bulk API key operations.
+
+Items are read from a JSON array or a streamed NDJSON body, validated one by
+one, and applied in batches with one transaction per batch. Every item gets
+a result line in the NDJSON response (``{"index": ..., "ok": ...}``) as soon
+as its batch is committed, followed by a summary line, so arbitrarily large
+migrations run in constant memory on both sides.
+"""
+import json
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from shared import crud
+from shared.database import SessionLocal
+from .invalidation import publish_key_changes
+
+OPERATIONS = ("create", "import", "tier", "deactivate", "rotate")
+CHANGES_EXISTING = ("tier", "deactivate", "rotate")  # Operations gateways must be told about
+TIERS = ("free", "standard", "premium")
+
+Item = Tuple[int, dict]  # (index in the input, item)
+
+
+class ItemError(ValueError):
+    """An input item that cannot be applied."""
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    Streaming response whose body iterator may still be reading the request.
+
+    StreamingResponse listens for client disconnects by consuming receive(),
+    which would swallow request body chunks of a streamed NDJSON upload.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def read_items(request: Request) -> AsyncIterator[dict]:
+    """
+    Items of a bulk request body.
+
+    ``application/x-ndjson`` bodies are parsed line by line while they
+    stream in; anything else is parsed as a JSON array or {"items": [...]}.
+    Lines that are not valid JSON are yielded as ItemError instances so they
+    get a per-item error result.
+    """
+    if request.headers.get("Content-Type", "").startswith("application/x-ndjson"):
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield _parse_line(line)
+        if buffer.strip():
+            yield _parse_line(buffer)
+        return
+
+    body = await request.json()
+    items = body.get("items", []) if isinstance(body, dict) else body
+    if not isinstance(items, list):
+        raise ItemError("Body must be a JSON array of items or {\"items\": [...]}")
+    for item in items:
+        yield item
+
+
+def _parse_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ItemError(f"Invalid JSON: {e}")
+
+
+def _tier(item: dict, default: Optional[str] = None) -> str:
+    tier = item.get("tier", default)
+    if tier not in TIERS:
+        raise ItemError("Invalid tier. Must be free, standard, or premium")
+    return tier
+
+
+def _key_id(item: dict) -> int:
+    key_id = item.get("id")
+    if not isinstance(key_id, int):
+        raise ItemError("id must be an integer")
+    return key_id
+
+
+def _user_id(item: dict) -> str:
+    user_id = item.get("user_id")
+    if not isinstance(user_id, str) or not user_id.strip():
+        raise ItemError("user_id is required")
+    return user_id.strip()
+
+
+def _expires_at(item: dict) -> Optional[datetime]:
+    if item.get("expires_in_days"):
+        try:
+            return datetime.utcnow() + timedelta(days=int(item["expires_in_days"]))
+        except (TypeError, ValueError):
+            raise ItemError("expires_in_days must be an integer")
+    if item.get("expires_at"):
+        try:
+            return datetime.fromisoformat(str(item["expires_at"]).replace("Z", ""))
+        except ValueError:
+            raise ItemError("expires_at must be an ISO 8601 datetime")
+    return None
+
+
+def _create(db, items: List[Item], admin_username: str) -> Dict[int, dict]:
+    rows, indexes, results = [], [], {}
+    for index, item in items:
+        try:
+            rows.append({
+                "key": crud.generate_api_key(),
+                "user_id": _user_id(item),
+                "tier": _tier(item, "standard"),
+                "description": item.get("description"),
+                "expires_at": _expires_at(item),
+                "created_by": admin_username,
+            })
+            indexes.append(index)
+        except ItemError as e:
+            results[index] = {"ok": False, "error": str(e)}
+    ids = crud.bulk_create_api_keys(db, rows) if rows else []
+    for index, row, key_id in zip(indexes, rows, ids):
+        results[index] = {"ok": True, "id": key_id, "user_id": row["user_id"], "key": row["key"]}
+    return results
+
+
+def _import(db, items: List[Item], admin_username: str) -> Dict[int, dict]:
+    rows, indexes, results = [], [], {}
+    keys = [item.get("key") for _, item in items if isinstance(item.get("key"), str)]
+    taken = crud.find_existing_keys(db, keys) if keys else set()
+    for index, item in items:
+        try:
+            key = item.get("key")
+            if not isinstance(key, str) or not 20 <= len(key) <= 100:
+                raise ItemError("key must be a string of 20 to 100 characters")
+            if key in taken:
+                raise ItemError("key already exists")
+            rows.append({
+                "key": key,
+                "user_id": _user_id(item),
+                "tier": _tier(item, "standard"),
+                "is_active": bool(item.get("is_active", True)),
+                "description": item.get("description"),
+                "expires_at": _expires_at(item),
+                "created_by": item.get("created_by") or admin_username,
+            })
+            taken.add(key)
+            indexes.append(index)
+        except ItemError as e:
+            results[index] = {"ok": False, "error": str(e)}
+    ids = crud.bulk_create_api_keys(db, rows) if rows else []
+    for index, row, key_id in zip(indexes, rows, ids):
+        results[index] = {"ok": True, "id": key_id, "user_id": row["user_id"]}
+    return results
+
+
+def _update(db, items: List[Item], values_for) -> Dict[int, dict]:
+    results, updates, valid = {}, {}, []
+    for index, item in items:
+        try:
+            valid.append((index, _key_id(item), values_for(item)))
+        except ItemError as e:
+            results[index] = {"ok": False, "error": str(e)}
+    existing = crud.get_api_keys_by_ids(db, [key_id for _, key_id, _ in valid])
+    for index, key_id, values in valid:
+        if key_id not in existing:
+            results[index] = {"ok": False, "id": key_id, "error": "API key not found"}
+            continue
+        updates.setdefault(key_id, {}).update(values)
+        results[index] = {"ok": True, "id": key_id, **values}
+    crud.bulk_update_api_keys(db, updates)
+    return results
+
+
+def _tier_change(db, items: List[Item], admin_username: str) -> Dict[int, dict]:
+    return _update(db, items, lambda item: {"tier": _tier(item)})
+
+
+def _deactivate(db, items: List[Item], admin_username: str) -> Dict[int, dict]:
+    return _update(db, items, lambda item: {"is_active": False})
+
+
+def _rotate(db, items: List[Item], admin_username: str, grace_minutes: int = 0) -> Dict[int, dict]:
+    results, valid = {}, []
+    for index, item in items:
+        try:
+            valid.append((index, _key_id(item)))
+        except ItemError as e:
+            results[index] = {"ok": False, "error": str(e)}
+    existing = crud.get_api_keys_by_ids(db, [key_id for _, key_id in valid])
+    rotating, indexes, seen = [], [], set()
+    for index, key_id in valid:
+        old = existing.get(key_id)
+        if old is None or not old.is_active:
+            results[index] = {"ok": False, "id": key_id, "error": "API key not found or inactive"}
+        elif key_id in seen:
+            results[index] = {"ok": False, "id": key_id, "error": "Duplicate id in batch"}
+        else:
+            seen.add(key_id)
+            rotating.append(old)
+            indexes.append(index)
+    if rotating:
+        new_keys = [crud.generate_api_key() for _ in rotating]
+        old_expires_at = datetime.utcnow() + timedelta(minutes=grace_minutes) if grace_minutes > 0 else None
+        user_ids = [old.user_id for old in rotating]
+        ids = crud.bulk_rotate_api_keys(db, rotating, new_keys, admin_username, old_expires_at)
+        for index, old_id, user_id, new_id, new_key in zip(
+            indexes, [old.id for old in rotating], user_ids, ids, new_keys
+        ):
+            results[index] = {"ok": True, "id": new_id, "replaces": old_id, "user_id": user_id, "key": new_key}
+    return results
+
+
+HANDLERS = {
+    "create": _create,
+    "import": _import,
+    "tier": _tier_change,
+    "deactivate": _deactivate,
+    "rotate": _rotate,
+}
+
+
+def apply_batch(operation: str, items: List[Item], admin_username: str, **options) -> Dict[int, dict]:
+    """Apply one batch of items in a single transaction; results by item index."""
+    results = {index: {"ok": False, "error": str(item)} for index, item in items if isinstance(item, ItemError)}
+    items = [(index, item) for index, item in items if index not in results]
+    for index, item in items:
+        if not isinstance(item, dict):
+            results[index] = {"ok": False, "error": "Item must be a JSON object"}
+    items = [(index, item) for index, item in items if index not in results]
+
+    db = SessionLocal()
+    try:
+        results.update(HANDLERS[operation](db, items, admin_username, **options))
+    except Exception as e:
+        db.rollback()
+        for index, _ in items:
+            results[index] = {"ok": False, "error": f"Batch failed: {e}"}
+    finally:
+        db.close()
+    return results
+
+
+async def bulk_results(
+    operation: str,
+    items: AsyncIterator[dict],
+    admin_username: str,
+    batch_size: int,
+    **options,
+) -> AsyncIterator[bytes]:
+    """NDJSON result lines, one per item in input order, then a summary line."""
+    ok = failed = 0
+    batch: List[Item] = []
+    index = 0
+
+    async def flush():
+        nonlocal ok, failed
+        results = await run_in_threadpool(apply_batch, operation, batch, admin_username, **options)
+        if operation in CHANGES_EXISTING:
+            await publish_key_changes([
+                result.get("replaces", result.get("id")) for result in results.values() if result["ok"]
+            ])
+        lines = []
+        for i, _ in batch:
+            result = results[i]
+            ok += result["ok"]
+            failed += not result["ok"]
+            lines.append(json.dumps({"index": i, **result}, default=str) + "\n")
+        batch.clear()
+        return "".join(lines).encode()
+
+    try:
+        async for item in items:
+            batch.append((index, item))
+            index += 1
+            if len(batch) >= batch_size:
+                yield await flush()
+    except (ItemError, ValueError) as e:
+        if batch:
+            yield await flush()
+        yield (json.dumps({"error": f"Could not read items: {e}"}) + "\n").encode()
+    if batch:
+        yield await flush()
+    yield (json.dumps({"summary": {"operation": operation, "ok": ok, "failed": failed}}) + "\n").encode()
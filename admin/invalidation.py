@@ -0,0 +1,39 @@
+"""Push API key changes to the gateways' key caches.
+
+Every key change is also recorded in the config change feed, which gateways
+poll, so a push that fails (gateway restarting, network blip) only delays
+the eviction until the next poll.
+"""
+import asyncio
+import json
+import urllib.request
+from typing import List
+
+from shared.config import settings
+
+PUSH_TIMEOUT_SECONDS = 1.0
+
+
+def _post(url: str, body: bytes) -> None:
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/internal/invalidate",
+        data=body,
+        headers={"Content-Type": "application/json", "X-Internal-Token": settings.internal_api_token},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=PUSH_TIMEOUT_SECONDS) as response:
+        response.read()
+
+
+async def publish_key_changes(key_ids: List[int]) -> None:
+    """Ask every gateway in GATEWAY_INTERNAL_URLS to evict these keys (needs INTERNAL_API_TOKEN)."""
+    if not key_ids or not settings.gateway_internal_urls or not settings.internal_api_token:
+        return
+    body = json.dumps({"key_ids": key_ids}).encode()
+    results = await asyncio.gather(
+        *(asyncio.to_thread(_post, url, body) for url in settings.gateway_internal_urls),
+        return_exceptions=True,
+    )
+    for url, result in zip(settings.gateway_internal_urls, results):
+        if isinstance(result, Exception):
+            print(f"Key invalidation push to {url} failed: {result}")
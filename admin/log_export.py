@@ -0,0 +1,95 @@
+"""Streaming encoders for request log exports.
+
+Each encoder turns an iterator of row batches (see
+``shared.log_partitions.iter_log_batches``) into an iterator of byte chunks,
+one chunk per batch, so an export of any size is served with constant memory.
+"""
+import csv
+import io
+import json
+from typing import Dict, Iterator, List
+
+from shared.log_partitions import arrow_schema, arrow_table, require_pyarrow
+from shared.models import RequestLog
+
+COLUMNS = [c.name for c in RequestLog.__table__.columns]
+
+MEDIA_TYPES = {
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _json_default(value):
+    return value.isoformat()
+
+
+def jsonl_chunks(batches: Iterator[List[Dict]]) -> Iterator[bytes]:
+    """One JSON object per line."""
+    for rows in batches:
+        yield "".join(json.dumps(row, default=_json_default) + "\n" for row in rows).encode()
+
+
+def csv_chunks(batches: Iterator[List[Dict]]) -> Iterator[bytes]:
+    """CSV with a header row."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose written bytes are drained after every row group."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def parquet_chunks(batches: Iterator[List[Dict]]) -> Iterator[bytes]:
+    """zstd-compressed Parquet, one row group per batch."""
+    require_pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows in batches:
+            writer.write_table(arrow_table(rows, schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {
+    "jsonl": jsonl_chunks,
+    "csv": csv_chunks,
+    "parquet": parquet_chunks,
+}
@@ -6,25 +6,33 @@ from pathlib import Path
 # Add parent directory to path for shared imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-import secrets
+import asyncio
+import time
 from datetime import datetime, timedelta
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException, Depends, status
+from typing import Dict, List, Optional
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from jose import JWTError, jwt
+from jose import jwt
 
-from shared.database import get_db, init_db
+from shared.database import SessionLocal, engine, get_db, get_read_db, init_db, pool_stats, read_engine
 from shared.models import APIKey, RequestLog
-from shared import crud
+from shared import crud, log_partitions, quotas, usage_rollups
 from shared.config import settings
-from shared.email_service import get_email_service
+from shared.email_service import EmailQueue, EmailQueueFull, get_email_service
+from shared.sketches import DDSketch
+from shared.verification_store import create_verification_store
 import random
 
+from .bulk_keys import OPERATIONS, DuplexStreamingResponse, bulk_results, read_items
+from .invalidation import publish_key_changes
+from .log_export import ENCODERS, MEDIA_TYPES
+from .security import admin_from_token, authenticate_admin, password_executor, token_cache
+
 app = FastAPI(title="LLM API Admin Service", version="1.0.0")
 
 # CORS
@@ -34,6 +42,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
 security = HTTPBearer()
@@ -55,7 +64,8 @@ class APIKeyUpdate(BaseModel):
 
 class APIKeyResponse(BaseModel):
     id: int
-    key: str
+    key_prefix: str
+    key: Optional[str] = None  # Raw key, only returned when the key is created
     user_id: str
     tier: str
     is_active: bool
@@ -90,16 +100,75 @@ class VerifyCodeRequest(BaseModel):
 
 
 class APIKeySuccessResponse(BaseModel):
-    api_key: str
+    api_key: Optional[str] = None  # Raw key, only returned when the key is created
+    key_prefix: str
     message: str
 
 
+class LatencyPercentiles(BaseModel):
+    user_id: Optional[str] = None
+    model: Optional[str] = None
+    hour: Optional[datetime] = None
+    count: int
+    mean_ms: Optional[float]
+    min_ms: Optional[float]
+    max_ms: Optional[float]
+    percentiles: Dict[str, Optional[float]]
+
+
+class LogPartitionInfo(BaseModel):
+    name: str
+    start: datetime
+    end: datetime
+    archived: bool
+
+
 class UsageStats(BaseModel):
     date: str
     requests: int
     total_tokens: int
     prompt_tokens: int
     completion_tokens: int
+    errors: int = 0
+    avg_duration_ms: float = 0.0
+    model: Optional[str] = None
+
+
+class TeamCreate(BaseModel):
+    name: str
+    organization: Optional[str] = None
+
+
+class TeamMembersUpdate(BaseModel):
+    user_ids: List[str]
+
+
+class TeamResponse(BaseModel):
+    id: int
+    name: str
+    organization: Optional[str]
+    members: List[str]
+
+
+class QuotaSet(BaseModel):
+    scope: str  # organization, team, user, key
+    subject: str  # Organization / team name, user ID or key ID
+    window: str  # day, month
+    max_requests: Optional[int] = None
+    max_tokens: Optional[int] = None
+
+
+class QuotaStatus(BaseModel):
+    id: int
+    scope: str
+    subject: str
+    window: str
+    max_requests: Optional[int]
+    max_tokens: Optional[int]
+    period_start: datetime
+    period_end: datetime
+    requests_used: int
+    tokens_used: int
 
 
 # Authentication
@@ -116,25 +185,91 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def verify_admin_token(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db),
-):
-    """Verify admin JWT token."""
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, settings.admin_secret_key, algorithms=[settings.admin_algorithm])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-
-        admin = crud.get_admin_user(db, username)
-        if admin is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-
-        return admin
-    except JWTError:
+async def verify_admin_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Verify admin JWT token (admins are cached for ADMIN_TOKEN_CACHE_TTL_SECONDS)."""
+    admin = await admin_from_token(credentials.credentials)
+    if admin is None:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    return admin
+
+
+def compact_usage_rollups() -> int:
+    """Fold new request logs into the usage rollups and prune old fine-grained rollups."""
+    db = SessionLocal()
+    try:
+        count = usage_rollups.compact_usage(
+            db,
+            batch_size=settings.usage_rollup_batch_size,
+            settle_seconds=settings.usage_rollup_settle_seconds,
+        )
+        usage_rollups.prune_rollups(db, {
+            "minute": settings.usage_rollup_minute_retention_days,
+            "hour": settings.usage_rollup_hour_retention_days,
+        })
+        return count
+    finally:
+        db.close()
+
+
+def prune_config_changes() -> int:
+    """Drop config changes older than CONFIG_CHANGE_RETENTION_HOURS."""
+    db = SessionLocal()
+    try:
+        return crud.prune_config_changes(
+            db, datetime.utcnow() - timedelta(hours=settings.config_change_retention_hours)
+        )
+    finally:
+        db.close()
+
+
+def prune_quota_usage() -> int:
+    """Drop quota usage older than the previous month."""
+    db = SessionLocal()
+    try:
+        this_month = quotas.period_start("month", datetime.utcnow())
+        return quotas.prune_usage(db, quotas.period_start("month", this_month - timedelta(days=1)))
+    finally:
+        db.close()
+
+
+def apply_log_retention() -> int:
+    """Drop (optionally archiving) request log partitions older than LOG_RETENTION_DAYS."""
+    dropped = log_partitions.apply_retention(
+        engine, settings.log_retention_days, archive_dir=settings.log_archive_dir or None
+    )
+    if dropped:
+        print(f"Dropped expired request log partitions: {', '.join(dropped)}")
+    return len(dropped)
+
+
+# Run by the maintenance worker every USAGE_ROLLUP_INTERVAL_SECONDS, each on its own
+MAINTENANCE_TASKS = (
+    ("Usage rollup compaction", compact_usage_rollups),
+    ("Config change pruning", prune_config_changes),
+    ("Quota usage pruning", prune_quota_usage),
+    ("Log partition retention", apply_log_retention),
+)
+
+
+async def maintenance_worker():
+    """Background worker keeping the usage rollups up to date and pruning old data."""
+    while True:
+        for name, task in MAINTENANCE_TASKS:
+            try:
+                await asyncio.to_thread(task)
+            except Exception as e:
+                print(f"{name} failed: {e}")
+        await asyncio.sleep(settings.usage_rollup_interval_seconds)
+
+
+async def verification_code_sweeper():
+    """Periodically drop expired verification codes."""
+    while True:
+        await asyncio.sleep(settings.verification_sweep_seconds)
+        try:
+            await asyncio.to_thread(app.state.verification_store.sweep)
+        except Exception as e:
+            print(f"Verification code sweep failed: {e}")
 
 
 # Initialize database on startup
@@ -142,6 +277,17 @@ def verify_admin_token(
 async def startup_event():
     """Initialize database and create default admin user."""
     init_db()
+    app.state.maintenance_task = asyncio.create_task(maintenance_worker())
+    app.state.verification_store = create_verification_store()
+    app.state.verification_sweep_task = asyncio.create_task(verification_code_sweeper())
+    app.state.email_queue = EmailQueue(
+        get_email_service(),
+        workers=settings.email_queue_workers,
+        max_size=settings.email_queue_max_size,
+        max_retries=settings.email_max_retries,
+        retry_backoff_seconds=settings.email_retry_backoff_seconds,
+    )
+    app.state.email_queue.start()
 
     # Create default admin user if not exists
     db = next(get_db())
@@ -152,46 +298,101 @@ async def startup_event():
         print("PLEASE CHANGE THE DEFAULT PASSWORD!")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers, sending queued emails first."""
+    app.state.maintenance_task.cancel()
+    app.state.verification_sweep_task.cancel()
+    await app.state.email_queue.stop()
+    password_executor.shutdown(wait=False)
+
+
 # Routes
 @app.post("/api/login", response_model=TokenResponse)
-async def login(request: LoginRequest, db: Session = Depends(get_db)):
-    """Admin login."""
-    admin = crud.get_admin_user(db, request.username)
-    if not admin or not crud.verify_admin_password(request.password, admin.hashed_password):
+async def login(request: LoginRequest):
+    """Admin login. The password is checked on the password hashing pool."""
+    admin = await authenticate_admin(request.username, request.password)
+    if not admin:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
         )
 
-    # Update last login
-    crud.update_admin_last_login(db, admin.id)
-
     # Create access token
     access_token = create_access_token(data={"sub": admin.username})
     return TokenResponse(access_token=access_token)
 
 
+# Total counts per filter combination, cached briefly so paging stays cheap
+KEY_COUNT_TTL_SECONDS = 10
+_key_count_cache: Dict[tuple, tuple] = {}
+
+
+def cached_key_count(db: Session, filters: dict) -> int:
+    """Count API keys matching filters, cached for KEY_COUNT_TTL_SECONDS."""
+    cache_key = tuple(sorted(filters.items()))
+    now = time.monotonic()
+    cached = _key_count_cache.get(cache_key)
+    if cached and cached[0] > now:
+        return cached[1]
+    count = crud.count_api_keys(db, **filters)
+    if len(_key_count_cache) > 1000:
+        _key_count_cache.clear()
+    _key_count_cache[cache_key] = (now + KEY_COUNT_TTL_SECONDS, count)
+    return count
+
+
 @app.get("/api/keys", response_model=List[APIKeyResponse])
-async def list_keys(
+def list_keys(
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[int] = None,
+    tier: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    created_by: Optional[str] = None,
+    expires_before: Optional[datetime] = None,
+    q: Optional[str] = None,
+    include_total: bool = False,
     admin=Depends(verify_admin_token),
     db: Session = Depends(get_db),
 ):
-    """List all API keys."""
-    keys = crud.list_api_keys(db, skip=skip, limit=limit)
+    """
+    List API keys, newest first.
+
+    Pages are fetched by cursor: pass the X-Next-Cursor header of a page as
+    ``cursor`` to get the next one. ``q`` searches user IDs by prefix. With
+    include_total, the number of matching keys is returned in X-Total-Count.
+    """
+    filters = {
+        name: value
+        for name, value in (
+            ("tier", tier),
+            ("is_active", is_active),
+            ("created_by", created_by),
+            ("expires_before", expires_before),
+            ("user_prefix", q.strip() if q else None),
+        )
+        if value is not None and value != ""
+    }
+    keys = crud.list_api_keys(db, skip=skip, limit=limit, cursor=cursor, **filters)
+
+    if len(keys) == limit:
+        response.headers["X-Next-Cursor"] = str(keys[-1].id)
+    if include_total:
+        response.headers["X-Total-Count"] = str(cached_key_count(db, filters))
     return keys
 
 
 @app.post("/api/keys", response_model=APIKeyResponse)
-async def create_key(
+def create_key(
     key_data: APIKeyCreate,
     admin=Depends(verify_admin_token),
     db: Session = Depends(get_db),
 ):
     """Create a new API key."""
     # Generate random API key
-    new_key = f"sk-internal-{secrets.token_urlsafe(32)}"
+    new_key = crud.generate_api_key()
 
     # Check tier validity
     if key_data.tier not in ["free", "standard", "premium"]:
@@ -213,7 +414,45 @@ async def create_key(
         expires_at=expires_at,
     )
 
-    return api_key
+    # Only the hash is stored, so this is the one time the key can be shown
+    response = APIKeyResponse.model_validate(api_key)
+    response.key = new_key
+    return response
+
+
+@app.post("/api/keys/bulk/{operation}")
+async def bulk_keys(
+    operation: str,
+    request: Request,
+    batch_size: int = Query(500, ge=1, le=5000),
+    grace_minutes: int = Query(0, ge=0),
+    admin=Depends(verify_admin_token),
+):
+    """
+    Create, import, change tier, deactivate or rotate many API keys.
+
+    The body is a JSON array (or {"items": [...]}) or a streamed NDJSON body
+    (Content-Type: application/x-ndjson) of items:
+
+    - create: {"user_id", "tier", "description", "expires_in_days"}
+    - import: {"key", "user_id", "tier", "is_active", "description", "expires_at"}
+    - tier: {"id", "tier"}
+    - deactivate: {"id"}
+    - rotate: {"id"}; with grace_minutes the old key stays valid that long
+
+    Items are applied in transactions of batch_size items, and gateways are
+    told to evict changed keys after each one. The response is NDJSON with
+    one result per item ({"index", "ok", ...}, including the new
+    raw key for create and rotate) and a final {"summary": ...} line.
+    """
+    if operation not in OPERATIONS:
+        raise HTTPException(status_code=404, detail=f"Unknown bulk operation. Must be one of: {', '.join(OPERATIONS)}")
+
+    options = {"grace_minutes": grace_minutes} if operation == "rotate" else {}
+    return DuplexStreamingResponse(
+        bulk_results(operation, read_items(request), admin.username, batch_size, **options),
+        media_type="application/x-ndjson",
+    )
 
 
 @app.put("/api/keys/{key_id}", response_model=APIKeyResponse)
@@ -221,20 +460,28 @@ async def update_key(
     key_id: int,
     key_data: APIKeyUpdate,
     admin=Depends(verify_admin_token),
-    db: Session = Depends(get_db),
 ):
     """Update an API key."""
-    updated_key = crud.update_api_key(
-        db,
-        key_id=key_id,
-        tier=key_data.tier,
-        is_active=key_data.is_active,
-        description=key_data.description,
-    )
-
+    def update() -> Optional[APIKeyResponse]:
+        # Own session, used and closed in the worker thread only
+        db = SessionLocal()
+        try:
+            db_key = crud.update_api_key(
+                db,
+                key_id=key_id,
+                tier=key_data.tier,
+                is_active=key_data.is_active,
+                description=key_data.description,
+            )
+            return APIKeyResponse.model_validate(db_key) if db_key else None
+        finally:
+            db.close()
+
+    updated_key = await asyncio.to_thread(update)
     if not updated_key:
         raise HTTPException(status_code=404, detail="API key not found")
 
+    await publish_key_changes([key_id])
     return updated_key
 
 
@@ -242,47 +489,308 @@ async def update_key(
 async def delete_key(
     key_id: int,
     admin=Depends(verify_admin_token),
-    db: Session = Depends(get_db),
 ):
     """Delete (deactivate) an API key."""
-    success = crud.delete_api_key(db, key_id)
+    def delete() -> bool:
+        db = SessionLocal()
+        try:
+            return crud.delete_api_key(db, key_id)
+        finally:
+            db.close()
+
+    success = await asyncio.to_thread(delete)
     if not success:
         raise HTTPException(status_code=404, detail="API key not found")
 
+    await publish_key_changes([key_id])
+
     return {"message": "API key deleted successfully"}
 
 
+@app.get("/api/teams", response_model=List[TeamResponse])
+def list_teams(admin=Depends(verify_admin_token), db: Session = Depends(get_db)):
+    """List teams and their members."""
+    return [
+        TeamResponse(id=team.id, name=team.name, organization=team.organization, members=members)
+        for team, members in crud.list_teams(db)
+    ]
+
+
+@app.post("/api/teams", response_model=TeamResponse)
+def create_team(team_data: TeamCreate, admin=Depends(verify_admin_token), db: Session = Depends(get_db)):
+    """Create a team, optionally within an organization."""
+    if crud.get_team(db, team_data.name):
+        raise HTTPException(status_code=409, detail="Team already exists")
+    team = crud.create_team(db, name=team_data.name, organization=team_data.organization or None)
+    return TeamResponse(id=team.id, name=team.name, organization=team.organization, members=[])
+
+
+@app.put("/api/teams/{name}/members", response_model=TeamResponse)
+def set_team_members(
+    name: str,
+    members: TeamMembersUpdate,
+    admin=Depends(verify_admin_token),
+    db: Session = Depends(get_db),
+):
+    """Replace a team's members (user IDs); a user belongs to one team at a time."""
+    team = crud.get_team(db, name)
+    if not team:
+        raise HTTPException(status_code=404, detail="Team not found")
+    crud.set_team_members(db, team, members.user_ids)
+    return TeamResponse(
+        id=team.id, name=team.name, organization=team.organization, members=sorted(set(members.user_ids))
+    )
+
+
+@app.delete("/api/teams/{name}")
+def delete_team(name: str, admin=Depends(verify_admin_token), db: Session = Depends(get_db)):
+    """Delete a team and its memberships."""
+    team = crud.get_team(db, name)
+    if not team:
+        raise HTTPException(status_code=404, detail="Team not found")
+    crud.delete_team(db, team)
+    return {"message": "Team deleted successfully"}
+
+
+def quota_statuses(db: Session, quota_list) -> List[QuotaStatus]:
+    """Quotas with their consumption in the current window periods."""
+    now = datetime.utcnow()
+    periods = quotas.current_periods(now)
+    usage = quotas.get_usage(db, periods, subjects={(q.scope, q.subject) for q in quota_list})
+    statuses = []
+    for quota in quota_list:
+        start = periods[quota.window]
+        requests, tokens = usage.get((quota.scope, quota.subject, quota.window, start), (0, 0))
+        statuses.append(QuotaStatus(
+            id=quota.id,
+            scope=quota.scope,
+            subject=quota.subject,
+            window=quota.window,
+            max_requests=quota.max_requests,
+            max_tokens=quota.max_tokens,
+            period_start=start,
+            period_end=quotas.period_end(quota.window, start),
+            requests_used=requests,
+            tokens_used=tokens,
+        ))
+    return statuses
+
+
+@app.get("/api/quotas", response_model=List[QuotaStatus])
+def list_quotas(
+    scope: Optional[str] = None,
+    subject: Optional[str] = None,
+    admin=Depends(verify_admin_token),
+    db: Session = Depends(get_read_db),
+):
+    """
+    List quotas with their consumption in the current day / month (UTC).
+
+    Consumption is what the gateways have flushed, so it lags by up to
+    QUOTA_FLUSH_SECONDS.
+    """
+    return quota_statuses(db, crud.list_quotas(db, scope=scope, subject=subject))
+
+
+@app.put("/api/quotas", response_model=QuotaStatus)
+def set_quota(quota_data: QuotaSet, admin=Depends(verify_admin_token), db: Session = Depends(get_db)):
+    """
+    Create or replace the quota of a subject and window.
+
+    Gateways pick up quota changes within QUOTA_FLUSH_SECONDS.
+    """
+    if quota_data.scope not in quotas.SCOPES:
+        raise HTTPException(status_code=400, detail=f"Invalid scope. Must be one of: {', '.join(quotas.SCOPES)}")
+    if quota_data.window not in quotas.WINDOWS:
+        raise HTTPException(status_code=400, detail=f"Invalid window. Must be one of: {', '.join(quotas.WINDOWS)}")
+    if any(limit is not None and limit < 0 for limit in (quota_data.max_requests, quota_data.max_tokens)):
+        raise HTTPException(status_code=400, detail="Quota limits must not be negative")
+    quota = crud.set_quota(
+        db,
+        scope=quota_data.scope,
+        subject=quota_data.subject,
+        window=quota_data.window,
+        max_requests=quota_data.max_requests,
+        max_tokens=quota_data.max_tokens,
+    )
+    return quota_statuses(db, [quota])[0]
+
+
+@app.delete("/api/quotas/{quota_id}")
+def delete_quota(quota_id: int, admin=Depends(verify_admin_token), db: Session = Depends(get_db)):
+    """Delete a quota."""
+    if not crud.delete_quota(db, quota_id):
+        raise HTTPException(status_code=404, detail="Quota not found")
+    return {"message": "Quota deleted successfully"}
+
+
 @app.get("/api/usage", response_model=List[UsageStats])
-async def get_usage(
+def get_usage(
     user_id: Optional[str] = None,
     days: int = 7,
+    granularity: str = Query("day", pattern="^(minute|hour|day)$"),
+    by_model: bool = False,
+    model: Optional[str] = None,
+    api_key_id: Optional[int] = None,
     admin=Depends(verify_admin_token),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
-    """Get usage statistics."""
-    stats = crud.get_usage_stats(db, user_id=user_id, days=days)
+    """
+    Get usage statistics per day, hour or minute.
+
+    Read from the usage rollups, which lag the request logs by at most
+    USAGE_ROLLUP_INTERVAL_SECONDS. With by_model, one row per bucket and model.
+    """
+    stats = crud.get_usage_stats(
+        db,
+        user_id=user_id,
+        days=days,
+        granularity=granularity,
+        by_model=by_model,
+        model=model,
+        api_key_id=api_key_id,
+    )
 
     return [
         UsageStats(
-            date=str(stat.date),
+            date=stat.bucket_start.date().isoformat() if granularity == "day" else stat.bucket_start.isoformat(sep=" "),
             requests=stat.requests or 0,
             total_tokens=stat.total_tokens or 0,
             prompt_tokens=stat.prompt_tokens or 0,
             completion_tokens=stat.completion_tokens or 0,
+            errors=stat.errors or 0,
+            avg_duration_ms=round((stat.duration_ms_sum or 0) / stat.requests, 2) if stat.requests else 0.0,
+            model=(stat.model or None) if by_model else None,
         )
         for stat in stats
     ]
 
 
+@app.get("/api/latency", response_model=List[LatencyPercentiles])
+def get_latency(
+    metric: str = Query("latency", pattern="^(latency|ttft)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    model: Optional[str] = None,
+    group_by: str = Query("", pattern="^((user|model|hour)(,(user|model|hour))*)?$"),
+    quantiles: str = "0.5,0.95,0.99",
+    admin=Depends(verify_admin_token),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Latency or TTFT percentiles (ms) over a time range (default: last 24 hours).
+
+    Percentiles are computed by merging the hourly sketches recorded by the
+    gateway, optionally grouped by user, model and/or hour. Results are
+    accurate to LATENCY_SKETCH_RELATIVE_ACCURACY and cover the range at hour
+    granularity.
+    """
+    try:
+        qs = [float(q) for q in quantiles.split(",") if q.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="quantiles must be comma-separated numbers")
+    if any(not 0 <= q <= 1 for q in qs):
+        raise HTTPException(status_code=400, detail="quantiles must be between 0 and 1")
+
+    until = until or datetime.utcnow()
+    since = since or until - timedelta(days=1)
+    since = since.replace(minute=0, second=0, microsecond=0)
+    groups = [g for g in group_by.split(",") if g]
+
+    merged: Dict[tuple, DDSketch] = {}
+    for row in crud.get_latency_sketches(db, metric, since, until, user_id=user_id, model=model):
+        key = tuple(
+            {"user": row.user_id, "model": row.model or None, "hour": row.bucket_start}[g] for g in groups
+        )
+        sketch = DDSketch.from_bytes(row.sketch)
+        if key in merged:
+            merged[key].merge(sketch)
+        else:
+            merged[key] = sketch
+
+    results = []
+    for key, sketch in sorted(merged.items(), key=lambda item: tuple(str(k) for k in item[0])):
+        fields = dict(zip(groups, key))
+        results.append(LatencyPercentiles(
+            user_id=fields.get("user"),
+            model=fields.get("model"),
+            hour=fields.get("hour"),
+            count=sketch.count,
+            mean_ms=sketch.mean,
+            min_ms=sketch.min if sketch.count else None,
+            max_ms=sketch.max if sketch.count else None,
+            percentiles={f"p{q * 100:g}": sketch.quantile(q) for q in qs},
+        ))
+    return results
+
+
+@app.get("/api/logs/partitions", response_model=List[LogPartitionInfo])
+def list_log_partitions(admin=Depends(verify_admin_token)):
+    """List live and archived request log partitions."""
+    partitions = []
+    for name in log_partitions.list_partitions(read_engine):
+        start, end = log_partitions.partition_bounds(name)
+        partitions.append(LogPartitionInfo(name=name, start=start, end=end, archived=False))
+    if settings.log_archive_dir:
+        for path in log_partitions.archived_partitions(settings.log_archive_dir):
+            start, end = log_partitions.partition_bounds(path.stem)
+            partitions.append(LogPartitionInfo(name=path.stem, start=start, end=end, archived=True))
+    return sorted(partitions, key=lambda p: p.start)
+
+
+@app.get("/api/logs/export")
+async def export_logs(
+    format: str = Query("jsonl", pattern="^(jsonl|csv|parquet)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    model: Optional[str] = None,
+    status_code: Optional[int] = None,
+    include_archive: bool = True,
+    batch_size: int = Query(5000, ge=100, le=100000),
+    admin=Depends(verify_admin_token),
+):
+    """
+    Stream raw request logs as JSONL, CSV or Parquet.
+
+    Logs are read in keyset batches across the legacy table, live partitions
+    and (with include_archive) archived partitions, and encoded batch by
+    batch, so exports of millions of rows use constant memory.
+    """
+    if format == "parquet":
+        try:
+            log_partitions.require_pyarrow()
+        except RuntimeError as e:
+            raise HTTPException(status_code=501, detail=str(e))
+
+    filters = {
+        name: value
+        for name, value in (("user_id", user_id), ("model", model), ("status_code", status_code))
+        if value is not None
+    }
+    batches = log_partitions.iter_log_batches(
+        read_engine,
+        since=since,
+        until=until,
+        filters=filters,
+        batch_size=batch_size,
+        archive_dir=(settings.log_archive_dir or None) if include_archive else None,
+    )
+    filename = f"request_logs_{datetime.utcnow():%Y%m%d%H%M%S}.{format}"
+    return StreamingResponse(
+        ENCODERS[format](batches),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 # ============================================================================
 # Self-Service Auth API (for users to get their own API keys via email)
 # ============================================================================
 
 @app.post("/auth/request-code")
-async def request_verification_code(
-    request: EmailRequest,
-    db: Session = Depends(get_db),
-):
+async def request_verification_code(request: EmailRequest):
     """
     Request a verification code via email.
 
@@ -305,26 +813,16 @@ async def request_verification_code(
     # Generate 6-digit code
     code = f"{random.randint(100000, 999999)}"
 
-    # Calculate expiration
-    expires_at = datetime.utcnow() + timedelta(minutes=settings.verification_code_expire_minutes)
-
-    # Save to database
-    crud.create_verification_code(
-        db,
-        email=email,
-        code=code,
-        expires_at=expires_at,
+    # Save to the verification store (expired codes are swept in the background)
+    await asyncio.to_thread(
+        app.state.verification_store.save, email, code, settings.verification_code_expire_minutes * 60
     )
 
-    # Send email
-    email_service = get_email_service()
-    success = email_service.send_verification_code(email, code)
-
-    if not success:
-        raise HTTPException(status_code=500, detail="Failed to send verification email")
-
-    # Clean up old expired codes (background task simulation)
-    crud.cleanup_expired_codes(db)
+    # Queue the email; background workers send and retry it
+    try:
+        app.state.email_queue.enqueue(email, code)
+    except EmailQueueFull:
+        raise HTTPException(status_code=503, detail="Too many pending emails, please try again shortly")
 
     return {
         "message": "Verification code sent to your email",
@@ -333,7 +831,7 @@ async def request_verification_code(
 
 
 @app.post("/auth/verify-code", response_model=APIKeySuccessResponse)
-async def verify_code_and_get_api_key(
+def verify_code_and_get_api_key(
     request: VerifyCodeRequest,
     db: Session = Depends(get_db),
 ):
@@ -345,31 +843,27 @@ async def verify_code_and_get_api_key(
     email = request.email.lower().strip()
     code = request.code.strip()
 
-    # Find valid verification code
-    verification = crud.get_valid_verification_code(db, email, code)
-
-    if not verification:
+    # Check the code and mark it used in one step, so it cannot be used twice
+    if not app.state.verification_store.consume(email, code):
         raise HTTPException(
             status_code=400,
             detail="Invalid or expired verification code"
         )
 
-    # Mark code as used
-    crud.mark_verification_code_used(db, verification.id)
-
     # Check if user already has an API key
     existing_keys = crud.get_api_keys_by_user(db, email)
     active_keys = [k for k in existing_keys if k.is_active]
 
     if active_keys:
-        # Return existing active key
+        # Only the hash of the existing key is stored, so it cannot be shown again
         return APIKeySuccessResponse(
-            api_key=active_keys[0].key,
-            message="You already have an active API key"
+            key_prefix=active_keys[0].key_prefix,
+            message="You already have an active API key. It is only shown when created; "
+                    "ask an administrator to rotate it if it was lost."
         )
 
     # Generate new API key
-    new_key = f"sk-internal-{secrets.token_urlsafe(32)}"
+    new_key = crud.generate_api_key()
 
     # Create API key with standard tier
     api_key = crud.create_api_key(
@@ -382,13 +876,14 @@ async def verify_code_and_get_api_key(
     )
 
     return APIKeySuccessResponse(
-        api_key=api_key.key,
+        api_key=new_key,
+        key_prefix=api_key.key_prefix,
         message="API key created successfully! Please save this key, it won't be shown again."
     )
 
 
 @app.get("/auth/my-keys", response_model=List[APIKeyResponse])
-async def get_my_keys(
+def get_my_keys(
     email: str,
     db: Session = Depends(get_db),
 ):
@@ -418,8 +913,15 @@ async def get_my_keys(
 
 @app.get("/health")
 async def health():
-    """Health check."""
-    return {"status": "healthy", "service": "admin"}
+    """Health check, with database pool, email queue, verification code and token cache statistics."""
+    return {
+        "status": "healthy",
+        "service": "admin",
+        "database": pool_stats(),
+        "email_queue": app.state.email_queue.stats(),
+        "verification_codes": app.state.verification_store.stats(),
+        "admin_token_cache": token_cache.stats(),
+    }
 
 
 # Serve static files (UI) - mount at the end
@@ -0,0 +1,126 @@
+"""Admin login and token checks that keep the event loop free.
+
+bcrypt is deliberately slow (~100-300 ms per hash), so password checks run
+on a small dedicated thread pool: a burst of logins queues there instead of
+blocking the event loop or taking over the threadpool that serves the
+self-service endpoints. Decoded admin tokens are cached briefly, so admin
+API requests do not hit the database for every call.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from jose import JWTError, jwt
+
+from shared import crud
+from shared.config import settings
+from shared.database import SessionLocal
+from shared.models import AdminUser
+
+# bcrypt releases the GIL, so threads hash in parallel
+password_executor = ThreadPoolExecutor(
+    max_workers=max(1, settings.password_hash_workers), thread_name_prefix="password-hash"
+)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """crud.verify_admin_password on the password hashing pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        password_executor, crud.verify_admin_password, plain_password, hashed_password
+    )
+
+
+async def authenticate_admin(username: str, password: str) -> Optional[AdminUser]:
+    """The active admin with these credentials, with its last login updated, or None."""
+    admin = await asyncio.to_thread(load_admin, username)
+    if admin is None or not await verify_password(password, admin.hashed_password):
+        return None
+    await asyncio.to_thread(_record_login, admin.id)
+    return admin
+
+
+def load_admin(username: str) -> Optional[AdminUser]:
+    """Load an active admin user in its own session; the returned object is detached."""
+    db = SessionLocal()
+    try:
+        return crud.get_admin_user(db, username)
+    finally:
+        db.close()
+
+
+def _record_login(admin_id: int) -> None:
+    db = SessionLocal()
+    try:
+        crud.update_admin_last_login(db, admin_id)
+    finally:
+        db.close()
+
+
+class AdminTokenCache:
+    """
+    Admin users by JWT, kept for at most ttl seconds and never past the
+    token's own expiry.
+
+    A deactivated admin keeps access until their cached entries expire.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[float, AdminUser]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[AdminUser]:
+        entry = self._entries.get(token)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[token]
+        self.misses += 1
+        return None
+
+    def put(self, token: str, admin: AdminUser, token_expires_at: Optional[float] = None) -> None:
+        if self.ttl <= 0:
+            return
+        expires = time.monotonic() + self.ttl
+        if token_expires_at is not None:
+            expires = min(expires, time.monotonic() + token_expires_at - time.time())
+        if len(self._entries) >= self.max_entries:
+            now = time.monotonic()
+            self._entries = {t: e for t, e in self._entries.items() if e[0] > now}
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+        self._entries[token] = (expires, admin)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "ttl_seconds": self.ttl}
+
+
+token_cache = AdminTokenCache(settings.admin_token_cache_ttl_seconds)
+
+
+async def admin_from_token(token: str) -> Optional[AdminUser]:
+    """The active admin user a JWT was issued to, or None if the token is invalid."""
+    admin = token_cache.get(token)
+    if admin is not None:
+        return admin
+
+    try:
+        payload = jwt.decode(token, settings.admin_secret_key, algorithms=[settings.admin_algorithm])
+    except JWTError:
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+
+    admin = await asyncio.to_thread(load_admin, username)
+    if admin is not None:
+        token_cache.put(token, admin, payload.get("exp"))
+    return admin
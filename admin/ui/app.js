@@ -3,6 +3,8 @@
 const API_BASE = '/api';
 let authToken = localStorage.getItem('admin_token');
 let usageChart = null;
+let keysNextCursor = null;
+let keySearchTimer = null;
 
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
@@ -17,6 +19,14 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // Create key form
     document.getElementById('create-key-form').addEventListener('submit', handleCreateKey);
+
+    // API key filters
+    document.getElementById('key-search').addEventListener('input', () => {
+        clearTimeout(keySearchTimer);
+        keySearchTimer = setTimeout(() => loadAPIKeys(), 300);
+    });
+    document.getElementById('key-filter-tier').addEventListener('change', () => loadAPIKeys());
+    document.getElementById('key-filter-active').addEventListener('change', () => loadAPIKeys());
 });
 
 function showLogin() {
@@ -79,9 +89,47 @@ async function loadDashboard() {
     ]);
 }
 
-async function loadAPIKeys() {
+async function loadKeyCount(params) {
+    const response = await fetch(`${API_BASE}/keys?${params}&limit=1&include_total=true`, {
+        headers: {
+            'Authorization': `Bearer ${authToken}`,
+        },
+    });
+    return response.ok ? parseInt(response.headers.get('X-Total-Count') || '0', 10) : 0;
+}
+
+async function loadKeyStats() {
+    const [total, active] = await Promise.all([
+        loadKeyCount(''),
+        loadKeyCount('is_active=true'),
+    ]);
+    document.getElementById('stat-total-keys').textContent = total.toLocaleString();
+    document.getElementById('stat-active-keys').textContent = active.toLocaleString();
+}
+
+function keyFilterParams() {
+    const params = new URLSearchParams();
+    const search = document.getElementById('key-search').value.trim();
+    const tier = document.getElementById('key-filter-tier').value;
+    const active = document.getElementById('key-filter-active').value;
+    if (search) params.set('q', search);
+    if (tier) params.set('tier', tier);
+    if (active) params.set('is_active', active);
+    return params;
+}
+
+async function loadAPIKeys(reset = true) {
     try {
-        const response = await fetch(`${API_BASE}/keys`, {
+        const params = keyFilterParams();
+        params.set('limit', '100');
+        if (reset) {
+            params.set('include_total', 'true');
+            loadKeyStats();
+        } else if (keysNextCursor) {
+            params.set('cursor', keysNextCursor);
+        }
+
+        const response = await fetch(`${API_BASE}/keys?${params}`, {
             headers: {
                 'Authorization': `Bearer ${authToken}`,
             },
@@ -96,20 +144,20 @@ async function loadAPIKeys() {
         }
 
         const keys = await response.json();
-
-        // Update stats
-        document.getElementById('stat-total-keys').textContent = keys.length;
-        document.getElementById('stat-active-keys').textContent = keys.filter(k => k.is_active).length;
+        keysNextCursor = response.headers.get('X-Next-Cursor');
+        document.getElementById('keys-load-more').classList.toggle('hidden', !keysNextCursor);
+        if (reset) {
+            const total = parseInt(response.headers.get('X-Total-Count') || '0', 10);
+            document.getElementById('keys-match-count').textContent = `${total.toLocaleString()} matching keys`;
+        }
 
         // Populate table
         const tbody = document.getElementById('keys-table-body');
-        tbody.innerHTML = keys.map(key => `
+        const rows = keys.map(key => `
             <tr>
                 <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${key.user_id}</td>
                 <td class="px-6 py-4 whitespace-nowrap text-sm font-mono text-gray-500">
-                    <span class="cursor-pointer hover:text-gray-700" onclick="copyToClipboard('${key.key}')" title="Click to copy">
-                        ${key.key.substring(0, 20)}...
-                    </span>
+                    <span title="Only the key prefix is stored">${key.key_prefix}...</span>
                 </td>
                 <td class="px-6 py-4 whitespace-nowrap">
                     <span class="px-2 inline-flex text-xs leading-5 font-semibold rounded-full ${getTierColor(key.tier)}">
@@ -134,6 +182,11 @@ async function loadAPIKeys() {
                 </td>
             </tr>
         `).join('');
+        if (reset) {
+            tbody.innerHTML = rows;
+        } else {
+            tbody.insertAdjacentHTML('beforeend', rows);
+        }
 
     } catch (error) {
         console.error('Error loading API keys:', error);
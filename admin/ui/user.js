@@ -3,6 +3,7 @@
 const API_BASE = '/auth';
 let userEmail = '';
 let apiKey = '';
+let existingKeyPrefix = '';  // Shown as a hint when the user already has a key
 
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
@@ -116,8 +117,9 @@ async function handleVerifySubmit(e) {
 
         const data = await response.json();
 
-        // Save API key
-        apiKey = data.api_key;
+        // Save API key (only returned for a newly created key)
+        apiKey = data.api_key || '';
+        existingKeyPrefix = data.api_key ? '' : data.key_prefix;
 
         // Show success step
         showStep3(data.message);
@@ -149,9 +151,14 @@ function showStep3(message) {
     document.getElementById('step-2').classList.add('hidden');
     document.getElementById('step-3').classList.remove('hidden');
 
-    // Display message and API key
+    // Display message and API key; an existing key is never shown, only its prefix as a hint
     document.getElementById('success-message').textContent = message;
     document.getElementById('api-key-display').value = apiKey;
+    document.getElementById('success-title').textContent = apiKey ? 'API Key Generated!' : 'You Already Have an API Key';
+    document.getElementById('existing-key-prefix').textContent = `${existingKeyPrefix}...`;
+    document.getElementById('api-key-box').classList.toggle('hidden', !apiKey);
+    document.getElementById('api-key-warning').classList.toggle('hidden', !apiKey);
+    document.getElementById('existing-key-hint').classList.toggle('hidden', !!apiKey);
 }
 
 function goBackToStep1() {
@@ -169,6 +176,7 @@ function goBackToStep1() {
 function startOver() {
     userEmail = '';
     apiKey = '';
+    existingKeyPrefix = '';
 
     document.getElementById('step-1').classList.remove('hidden');
     document.getElementById('step-2').classList.add('hidden');
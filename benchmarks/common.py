@@ -0,0 +1,282 @@
+"""Helpers shared by the benchmark tools."""
+import json
+import math
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+REPO_ROOT = Path(__file__).parent.parent
+
+# Rate limits handed to a gateway under test so the limiter never throttles the load
+UNLIMITED_RATE_LIMIT_ENV = {
+    f"RATE_LIMIT_{tier}_PER_{window}": "1000000000"
+    for tier in ("FREE", "STANDARD", "PREMIUM")
+    for window in ("MINUTE", "HOUR")
+}
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Percentile (0-100) of already sorted values, linear interpolation."""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q / 100
+    lower = math.floor(pos)
+    upper = math.ceil(pos)
+    if lower == upper:
+        return float(sorted_values[lower])
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+def summarize(values: Sequence[float]) -> Dict[str, float]:
+    """Count, mean, min, max and p50/p95/p99 of a sample."""
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "min": round(ordered[0], 3),
+        "p50": round(percentile(ordered, 50), 3),
+        "p95": round(percentile(ordered, 95), 3),
+        "p99": round(percentile(ordered, 99), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def free_port() -> int:
+    """Pick a free local TCP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_revision() -> Optional[str]:
+    """Current git commit of the repository, if available."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_metadata() -> Dict[str, Optional[str]]:
+    """Metadata stored with every result file so runs can be compared."""
+    return {
+        "git_revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+    }
+
+
+def write_results(path: str, results: dict) -> None:
+    """Write benchmark results as JSON."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Results written to {path}")
+
+
+def create_api_keys(users: Dict[str, str]) -> Dict[str, str]:
+    """
+    Create one API key per user in the database configured by DATABASE_URL.
+
+    DATABASE_URL must be set before this is called, since shared.database
+    binds its engine at import time.
+
+    Args:
+        users: Mapping of user_id to tier
+
+    Returns:
+        Mapping of user_id to the raw API key
+    """
+    from shared.database import SessionLocal, init_db
+    from shared import crud
+
+    init_db()
+    db = SessionLocal()
+    keys = {}
+    try:
+        for user_id, tier in users.items():
+            key = f"sk-internal-{secrets.token_urlsafe(32)}"
+            crud.create_api_key(
+                db,
+                key=key,
+                user_id=user_id,
+                tier=tier,
+                description="Benchmark key",
+                created_by="benchmark",
+            )
+            keys[user_id] = key
+    finally:
+        db.close()
+    return keys
+
+
+def seed_api_keys(count: int, tier: str = "premium", prefix: str = "bench-user") -> List[str]:
+    """Create ``count`` API keys for synthetic users, see create_api_keys."""
+    users = {f"{prefix}-{i}@company.com": tier for i in range(count)}
+    return list(create_api_keys(users).values())
+
+
+class ManagedService:
+    """A uvicorn service started as a subprocess for the duration of a run."""
+
+    def __init__(self, name: str, args: List[str], port: int, env: Optional[Dict[str, str]] = None,
+                 health_path: str = "/health"):
+        self.name = name
+        self.args = args
+        self.port = port
+        self.env = env or {}
+        self.health_path = health_path
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+    def start(self, timeout: float = 30.0) -> None:
+        env = {**os.environ, **self.env}
+        self.process = subprocess.Popen(
+            [sys.executable, *self.args],
+            cwd=REPO_ROOT,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                stderr = self.process.stderr.read().decode(errors="replace")
+                raise RuntimeError(f"{self.name} exited during startup:\n{stderr[-2000:]}")
+            try:
+                if httpx.get(self.url + self.health_path, timeout=1.0).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"{self.name} did not become healthy within {timeout}s")
+
+    def stop(self) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def uvicorn_args(app: str, port: int) -> List[str]:
+    """Command line for serving an ASGI app with uvicorn."""
+    return ["-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+
+
+def gateway_service(port: int, database_url: str, backend_url: str, unlimited: bool = True,
+                    extra_env: Optional[Dict[str, str]] = None) -> ManagedService:
+    """The real gateway app wired to a scratch database and a (mock) backend."""
+    env = {
+        "DATABASE_URL": database_url,
+        "LLM_BACKEND_URL": backend_url,
+        "ADMIN_HOST": "127.0.0.1",
+        "ADMIN_PORT": str(free_port()),
+    }
+    if unlimited:
+        env.update(UNLIMITED_RATE_LIMIT_ENV)
+    env.update(extra_env or {})
+    return ManagedService("gateway", uvicorn_args("gateway.main:app", port), port, env)
+
+
+def _read_proc_stats(pid: int):
+    """(cpu_seconds, rss_bytes) of a process from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+    rss_bytes = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu_seconds, rss_bytes
+
+
+def process_stats(pid: int):
+    """(cpu_seconds, rss_bytes) of a process, via psutil when installed."""
+    try:
+        import psutil
+    except ImportError:
+        return _read_proc_stats(pid)
+    proc = psutil.Process(pid)
+    cpu = proc.cpu_times()
+    return cpu.user + cpu.system, proc.memory_info().rss
+
+
+class ProcessSampler:
+    """Samples CPU utilisation and RSS of a process in a background thread."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[Dict[str, float]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        last_cpu, _ = process_stats(self.pid)
+        last_time = time.monotonic()
+        while not self._stop.wait(self.interval):
+            try:
+                cpu, rss = process_stats(self.pid)
+            except (OSError, ProcessLookupError):
+                return
+            now = time.monotonic()
+            self.samples.append({
+                "cpu_percent": 100 * (cpu - last_cpu) / (now - last_time),
+                "rss_mb": rss / (1024 * 1024),
+            })
+            last_cpu, last_time = cpu, now
+
+    def start(self) -> None:
+        self._stop.clear()
+        self.samples = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Dict[str, float]:
+        """Stop sampling and return a summary."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if not self.samples:
+            return {}
+        cpu = [s["cpu_percent"] for s in self.samples]
+        rss = [s["rss_mb"] for s in self.samples]
+        return {
+            "cpu_percent_mean": round(sum(cpu) / len(cpu), 1),
+            "cpu_percent_max": round(max(cpu), 1),
+            "rss_mb_start": round(rss[0], 1),
+            "rss_mb_end": round(rss[-1], 1),
+            "rss_mb_max": round(max(rss), 1),
+        }
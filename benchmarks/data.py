@@ -0,0 +1,91 @@
+"""Deterministic data generators for the benchmarks.
+
+Every generator takes a seed so two runs on different commits see exactly
+the same inputs.
+"""
+import json
+import random
+import string
+from typing import Dict, List
+
+DEFAULT_SEED = 1234
+
+TIERS = ("free", "standard", "premium")
+
+
+def api_key_strings(count: int, seed: int = DEFAULT_SEED) -> List[str]:
+    """Keys in the same shape as the admin service generates."""
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + "-_"
+    return ["sk-internal-" + "".join(rng.choices(alphabet, k=43)) for _ in range(count)]
+
+
+def api_key_rows(count: int, seed: int = DEFAULT_SEED) -> List[Dict]:
+    """Rows for a bulk insert into ``api_keys``, for the keys of api_key_strings."""
+    from shared.crud import api_key_columns
+
+    rng = random.Random(seed + 1)
+    keys = api_key_strings(count, seed)
+    return [
+        {
+            **api_key_columns(key),
+            "user_id": f"user{i}@company.com",
+            "tier": rng.choice(TIERS),
+            "is_active": True,
+            "description": "Benchmark key",
+            "created_by": "benchmark",
+        }
+        for i, key in enumerate(keys)
+    ]
+
+
+def request_timestamps(count: int, now: float, window: float = 3600.0, seed: int = DEFAULT_SEED) -> List[float]:
+    """Sorted request timestamps spread over the trailing ``window`` seconds."""
+    rng = random.Random(seed)
+    return sorted(now - rng.uniform(0, window) for _ in range(count))
+
+
+def completion_response(content_bytes: int, choices: int = 1, seed: int = DEFAULT_SEED) -> bytes:
+    """A JSON chat completion body of roughly ``content_bytes`` per choice."""
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(512)]
+    text = []
+    size = 0
+    while size < content_bytes:
+        word = rng.choice(words)
+        text.append(word)
+        size += len(word) + 1
+    content = " ".join(text)
+    body = {
+        "id": "chatcmpl-benchmark",
+        "object": "chat.completion",
+        "created": 1700000000,
+        "model": "meta-llama/Llama-2-7b-chat-hf",
+        "choices": [
+            {"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+            for i in range(choices)
+        ],
+        "usage": {"prompt_tokens": 42, "completion_tokens": len(text), "total_tokens": 42 + len(text)},
+    }
+    return json.dumps(body).encode()
+
+
+def request_header_items() -> List[tuple]:
+    """Raw ASGI headers of a typical OpenAI SDK request."""
+    headers = {
+        "host": "llm-gateway.company.com",
+        "user-agent": "OpenAI/Python 1.12.0",
+        "accept": "application/json",
+        "accept-encoding": "gzip, deflate",
+        "content-type": "application/json",
+        "content-length": "512",
+        "authorization": "Bearer " + api_key_strings(1)[0],
+        "x-stainless-lang": "python",
+        "x-stainless-package-version": "1.12.0",
+        "x-stainless-os": "Linux",
+        "x-stainless-arch": "x64",
+        "x-stainless-runtime": "CPython",
+        "x-stainless-runtime-version": "3.11.7",
+        "connection": "keep-alive",
+    }
+    return [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()]
@@ -0,0 +1,142 @@
+"""Scaling benchmark for the admin API key listing.
+
+Bulk-loads a scratch database with up to millions of API keys and times
+``crud.list_api_keys`` page fetches at increasing depths with OFFSET
+pagination and with keyset (cursor) pagination, plus filtered listings,
+user ID prefix search and total counts.
+
+Usage:
+    python -m benchmarks.keys_scale --keys 1000000
+    python -m benchmarks.keys_scale --keys 200000 --depths 0,1000,100000 --output bench_results/keys.json
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from .common import run_metadata, summarize, write_results
+from .data import DEFAULT_SEED, api_key_rows
+
+
+def load_keys(count: int, seed: int, batch_size: int = 50_000) -> float:
+    """Bulk insert ``count`` synthetic keys; returns seconds taken."""
+    from shared.database import engine, init_db
+    from shared.models import APIKey
+
+    init_db()
+    start = time.perf_counter()
+    creators = ["admin", "self-service", "ops"]
+    base = datetime.utcnow() - timedelta(days=365)
+    with engine.begin() as conn:
+        batch = []
+        for i, row in enumerate(api_key_rows(count, seed=seed)):
+            batch.append({
+                "key_hash": row["key_hash"],
+                "key_prefix": row["key_prefix"],
+                "user_id": row["user_id"],
+                "tier": row["tier"],
+                "is_active": i % 10 != 0,
+                "created_at": base + timedelta(seconds=i * 30),
+                "updated_at": base + timedelta(seconds=i * 30),
+                "expires_at": base + timedelta(days=30 + i % 700) if i % 4 == 0 else None,
+                "created_by": creators[i % len(creators)],
+            })
+            if len(batch) >= batch_size:
+                conn.execute(APIKey.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(APIKey.__table__.insert(), batch)
+    return time.perf_counter() - start
+
+
+def time_call(fn: Callable, repeat: int) -> Dict[str, float]:
+    """Latency summary (ms) of ``repeat`` calls."""
+    fn()  # Warm caches
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def run(args: argparse.Namespace) -> List[Dict]:
+    from shared import crud
+    from shared.database import SessionLocal
+    from shared.models import APIKey
+
+    db = SessionLocal()
+    results = []
+
+    def record(name: str, fn: Callable, **extra):
+        stats = time_call(fn, args.repeat)
+        results.append({"name": name, **extra, "latency_ms": stats})
+        print(f"  {name:<40} p50={stats['p50']:>9.2f}ms  p99={stats['p99']:>9.2f}ms")
+
+    try:
+        for depth in args.depths:
+            offset = depth * args.page_size
+            if offset >= args.keys:
+                continue
+            # Cursor a client would hold after paging down to this depth
+            cursor = db.query(APIKey.id).order_by(APIKey.id.desc()).offset(offset).limit(1).scalar()
+            cursor = cursor + 1 if cursor is not None else None
+            record(f"offset page {depth}", lambda: crud.list_api_keys(db, skip=offset, limit=args.page_size),
+                   mode="offset", depth=depth)
+            record(f"keyset page {depth}", lambda: crud.list_api_keys(db, cursor=cursor, limit=args.page_size),
+                   mode="keyset", depth=depth)
+
+        expires_before = datetime.utcnow() + timedelta(days=30)
+        filtered = {
+            "tier=premium": {"tier": "premium"},
+            "inactive": {"is_active": False},
+            "created_by=ops": {"created_by": "ops"},
+            "expiring in 30 days": {"expires_before": expires_before},
+            "prefix search": {"user_prefix": "user12"},
+            "tier=free + prefix": {"tier": "free", "user_prefix": "user4"},
+        }
+        for name, filters in filtered.items():
+            record(f"filter {name}", lambda: crud.list_api_keys(db, limit=args.page_size, **filters),
+                   mode="filter", filters={k: str(v) for k, v in filters.items()})
+        for name, filters in {"all": {}, **filtered}.items():
+            record(f"count {name}", lambda: crud.count_api_keys(db, **filters),
+                   mode="count", filters={k: str(v) for k, v in filters.items()})
+    finally:
+        db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Admin API key listing scaling benchmark")
+    parser.add_argument("--keys", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--depths", default="0,100,1000,5000,9000",
+                        help="Comma-separated page numbers to fetch")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--output", default="bench_results/keys_scale.json")
+    args = parser.parse_args()
+    args.depths = [int(d) for d in args.depths.split(",") if d.strip()]
+
+    # shared.database binds its engine on import, so point it at the scratch database first
+    workdir = tempfile.mkdtemp(prefix="keys-scale-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/keys.db"
+
+    print(f"Loading {args.keys} API keys")
+    load_seconds = load_keys(args.keys, args.seed)
+    print(f"  loaded in {load_seconds:.1f}s")
+    results = run(args)
+
+    write_results(args.output, {
+        "benchmark": "keys_scale",
+        "metadata": run_metadata(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "load_seconds": round(load_seconds, 2),
+        "results": results,
+    })
+
+
+if __name__ == "__main__":
+    main()
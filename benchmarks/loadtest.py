@@ -0,0 +1,262 @@
+"""Gateway load-testing benchmark.
+
+Starts a mock vLLM backend and the real ``gateway.main:app`` as separate
+uvicorn processes, drives the gateway with an async load generator at fixed
+request rates (open loop) and concurrency levels (closed loop), and reports
+latency/TTFT percentiles, throughput, error rates and gateway CPU/memory.
+
+Usage:
+    python -m benchmarks.loadtest --rps 10,50,100 --concurrency 8,32 --duration 20
+    python -m benchmarks.loadtest --stream --tokens-per-sec 100 --output results/stream.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+
+from .common import (
+    ManagedService,
+    ProcessSampler,
+    free_port,
+    gateway_service,
+    run_metadata,
+    seed_api_keys,
+    summarize,
+    write_results,
+)
+from .mock_vllm import add_mock_arguments, mock_command_args
+
+
+@dataclass
+class RequestResult:
+    """Outcome of a single request."""
+    status: int
+    latency_ms: float
+    ttft_ms: Optional[float] = None
+    completion_tokens: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class ScenarioResult:
+    """All request outcomes of one scenario."""
+    name: str
+    mode: str
+    target: float
+    duration_s: float
+    results: List[RequestResult] = field(default_factory=list)
+    dropped: int = 0  # Arrivals skipped because max in-flight was reached
+
+    def report(self) -> Dict:
+        ok = [r for r in self.results if r.status == 200]
+        status_counts: Dict[str, int] = {}
+        for r in self.results:
+            status_counts[str(r.status)] = status_counts.get(str(r.status), 0) + 1
+        total = len(self.results)
+        return {
+            "name": self.name,
+            "mode": self.mode,
+            "target": self.target,
+            "duration_s": round(self.duration_s, 3),
+            "requests": total,
+            "dropped": self.dropped,
+            "throughput_rps": round(len(ok) / self.duration_s, 2) if self.duration_s else 0,
+            "tokens_per_sec": round(sum(r.completion_tokens for r in ok) / self.duration_s, 2)
+            if self.duration_s else 0,
+            "error_rate": round((total - len(ok)) / total, 4) if total else 0,
+            "status_counts": status_counts,
+            "latency_ms": summarize([r.latency_ms for r in ok]),
+            "ttft_ms": summarize([r.ttft_ms for r in ok if r.ttft_ms is not None]),
+        }
+
+
+def _completion_tokens(body: bytes, stream: bool) -> int:
+    """Completion tokens reported by the backend, from a JSON or SSE body."""
+    try:
+        if not stream:
+            return json.loads(body).get("usage", {}).get("completion_tokens", 0)
+        for line in reversed(body.decode().splitlines()):
+            if line.startswith("data: {") and '"usage"' in line:
+                return json.loads(line[6:])["usage"].get("completion_tokens", 0)
+    except (ValueError, KeyError, AttributeError):
+        pass
+    return 0
+
+
+async def send_request(client: httpx.AsyncClient, api_key: str, payload: Optional[dict],
+                       path: str = "/v1/chat/completions", method: str = "POST") -> RequestResult:
+    """Send one request and time it, including time to first byte."""
+    stream = bool(payload and payload.get("stream"))
+    start = time.perf_counter()
+    ttft_ms = None
+    try:
+        async with client.stream(
+            method, path, json=payload, headers={"Authorization": f"Bearer {api_key}"}
+        ) as response:
+            chunks = []
+            async for chunk in response.aiter_bytes():
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                chunks.append(chunk)
+            body = b"".join(chunks)
+        latency_ms = (time.perf_counter() - start) * 1000
+        return RequestResult(
+            status=response.status_code,
+            latency_ms=latency_ms,
+            ttft_ms=ttft_ms,
+            completion_tokens=_completion_tokens(body, stream) if response.status_code == 200 else 0,
+        )
+    except httpx.HTTPError as e:
+        return RequestResult(
+            status=0,
+            latency_ms=(time.perf_counter() - start) * 1000,
+            error=f"{type(e).__name__}: {e}",
+        )
+
+
+async def run_open_loop(client: httpx.AsyncClient, keys: List[str], payload: dict, rps: float,
+                        duration: float, max_in_flight: int) -> ScenarioResult:
+    """Issue requests at a fixed arrival rate regardless of response times."""
+    scenario = ScenarioResult(name=f"rps-{rps:g}", mode="open", target=rps, duration_s=duration)
+    key_cycle = itertools.cycle(keys)
+    tasks = []
+    in_flight = 0
+
+    async def tracked(key):
+        nonlocal in_flight
+        in_flight += 1
+        try:
+            scenario.results.append(await send_request(client, key, payload))
+        finally:
+            in_flight -= 1
+
+    start = time.perf_counter()
+    total = int(rps * duration)
+    for i in range(total):
+        delay = start + i / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if in_flight >= max_in_flight:
+            scenario.dropped += 1
+            continue
+        tasks.append(asyncio.create_task(tracked(next(key_cycle))))
+    await asyncio.gather(*tasks)
+    scenario.duration_s = time.perf_counter() - start
+    return scenario
+
+
+async def run_closed_loop(client: httpx.AsyncClient, keys: List[str], payload: dict,
+                          concurrency: int, duration: float) -> ScenarioResult:
+    """Keep a fixed number of requests in flight for the duration."""
+    scenario = ScenarioResult(
+        name=f"concurrency-{concurrency}", mode="closed", target=concurrency, duration_s=duration
+    )
+    key_cycle = itertools.cycle(keys)
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            scenario.results.append(await send_request(client, next(key_cycle), payload))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    scenario.duration_s = time.perf_counter() - start
+    return scenario
+
+
+def build_payload(args: argparse.Namespace) -> dict:
+    """Chat completion request body used for every request."""
+    return {
+        "model": "meta-llama/Llama-2-7b-chat-hf",
+        "messages": [{"role": "user", "content": "word " * args.prompt_words}],
+        "max_tokens": args.max_tokens,
+        "stream": args.stream,
+    }
+
+
+async def run_scenarios(gateway_url: str, keys: List[str], args: argparse.Namespace,
+                        gateway_pid: Optional[int]) -> List[Dict]:
+    """Run every requested scenario against the gateway."""
+    payload = build_payload(args)
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    reports = []
+    async with httpx.AsyncClient(base_url=gateway_url, timeout=args.timeout, limits=limits) as client:
+        # Warm up connections and code paths before measuring
+        await asyncio.gather(*(send_request(client, k, payload) for k in keys[: min(len(keys), 8)]))
+
+        scenarios = [("open", rps) for rps in args.rps] + [("closed", c) for c in args.concurrency]
+        for mode, target in scenarios:
+            sampler = ProcessSampler(gateway_pid) if gateway_pid else None
+            if sampler:
+                sampler.start()
+            if mode == "open":
+                scenario = await run_open_loop(client, keys, payload, target, args.duration, args.max_in_flight)
+            else:
+                scenario = await run_closed_loop(client, keys, payload, int(target), args.duration)
+            report = scenario.report()
+            if sampler:
+                report["gateway_resources"] = sampler.stop()
+            reports.append(report)
+            latency = report["latency_ms"]
+            print(
+                f"  {report['name']:>18}: {report['throughput_rps']:8.1f} req/s  "
+                f"p50={latency.get('p50', 0):.1f}ms p99={latency.get('p99', 0):.1f}ms  "
+                f"errors={report['error_rate']:.2%}"
+            )
+    return reports
+
+
+def parse_list(value: str) -> List[float]:
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway load-testing benchmark")
+    parser.add_argument("--rps", type=parse_list, default=[10.0, 50.0], help="Comma-separated request rates")
+    parser.add_argument("--concurrency", type=parse_list, default=[8.0], help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds per scenario")
+    parser.add_argument("--users", type=int, default=50, help="Number of API keys to spread load over")
+    parser.add_argument("--max-in-flight", type=int, default=512)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--prompt-words", type=int, default=64)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--stream", action="store_true", help="Request streaming responses")
+    parser.add_argument("--keep-rate-limits", action="store_true",
+                        help="Keep the configured tier limits instead of disabling them")
+    parser.add_argument("--output", default="bench_results/loadtest.json")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="gateway-bench-")
+    database_url = f"sqlite:///{workdir}/bench.db"
+    os.environ["DATABASE_URL"] = database_url
+    keys = seed_api_keys(args.users)
+
+    mock_port = free_port()
+    mock = ManagedService("mock-vllm", mock_command_args(args, mock_port), mock_port)
+    gateway_port = free_port()
+    gateway = gateway_service(
+        gateway_port, database_url, f"http://127.0.0.1:{mock_port}", unlimited=not args.keep_rate_limits
+    )
+
+    print(f"Starting mock backend on :{mock_port} and gateway on :{gateway_port}")
+    with mock, gateway:
+        reports = asyncio.run(run_scenarios(gateway.url, keys, args, gateway.pid))
+
+    write_results(args.output, {
+        "benchmark": "loadtest",
+        "metadata": run_metadata(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "scenarios": reports,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""Micro-benchmarks for the gateway's per-request building blocks.
+
+Each benchmark reports microseconds per call (best and median of several
+repeats) and memory allocated per call, measured with ``tracemalloc``:
+the peak transient allocation of a single call and the bytes/blocks still
+retained per call afterwards. All inputs come from ``benchmarks.data`` with
+fixed seeds.
+
+Usage:
+    python -m benchmarks.micro
+    python -m benchmarks.micro --filter rate_limiter --output bench_results/micro.json
+    python -m benchmarks.micro --large   # include the 1M key lookup benchmark
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from .common import run_metadata, write_results
+from . import data
+
+# shared.database binds its engine on import, point it at a scratch file first
+_WORKDIR = tempfile.mkdtemp(prefix="gateway-micro-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_WORKDIR}/default.db"
+
+
+@dataclass
+class MicroResult:
+    """Cost of one benchmarked call."""
+    name: str
+    params: Dict = field(default_factory=dict)
+    calls: int = 0
+    us_per_call_best: float = 0.0
+    us_per_call_median: float = 0.0
+    peak_bytes_per_call: int = 0
+    retained_bytes_per_call: float = 0.0
+    retained_blocks_per_call: float = 0.0
+
+
+def measure(name: str, fn: Callable[[], object], params: Optional[Dict] = None,
+            repeat: int = 5, min_time: float = 0.2) -> MicroResult:
+    """Time ``fn`` and record its allocations."""
+    fn()  # Warm up caches and lazy imports
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    timings = [t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+
+    tracemalloc.start()
+    try:
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        peak_bytes = peak - base
+
+        base_blocks = sys.getallocatedblocks()
+        base, _ = tracemalloc.get_traced_memory()
+        for _ in range(number):
+            fn()
+        current, _ = tracemalloc.get_traced_memory()
+        retained_blocks = (sys.getallocatedblocks() - base_blocks) / number
+    finally:
+        tracemalloc.stop()
+
+    return MicroResult(
+        name=name,
+        params=params or {},
+        calls=number,
+        us_per_call_best=round(min(timings), 3),
+        us_per_call_median=round(statistics.median(timings), 3),
+        peak_bytes_per_call=peak_bytes,
+        retained_bytes_per_call=round((current - base) / number, 1),
+        retained_blocks_per_call=round(retained_blocks, 2),
+    )
+
+
+# ============================================================================
+# Rate limiter
+# ============================================================================
+
+def _unlimited_rate_limiter():
+    from shared.config import settings
+    from gateway.rate_limiter import RateLimiter
+
+    for tier in data.TIERS:
+        setattr(settings, f"rate_limit_{tier}_per_minute", 10 ** 9)
+        setattr(settings, f"rate_limit_{tier}_per_hour", 10 ** 9)
+    return RateLimiter()
+
+
+def bench_rate_limiter(history_sizes: List[int]) -> List[MicroResult]:
+    import time
+    from gateway.auth import APIKeyInfo
+
+    results = []
+    info = APIKeyInfo(key_id=1, key_prefix="sk-internal-benc", user_id="bench@company.com", tier="premium")
+    for size in history_sizes:
+        limiter = _unlimited_rate_limiter()
+        history = deque(data.request_timestamps(size, now=time.time()))
+        limiter.request_history[info.user_id] = history
+
+        def check():
+            limiter.check_rate_limit(info)
+            history.pop()  # Keep the history at a constant size
+
+        results.append(measure("rate_limiter.check_rate_limit", check, {"history": size}))
+        results.append(measure(
+            "rate_limiter.get_rate_limit_status",
+            lambda: limiter.get_rate_limit_status(info),
+            {"history": size},
+        ))
+    return results
+
+
+# ============================================================================
+# Database paths
+# ============================================================================
+
+def _scratch_session(name: str):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from shared.database import Base
+    import shared.models  # noqa: F401 - registers the tables
+
+    engine = create_engine(f"sqlite:///{_WORKDIR}/{name}.db", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(bind=engine, autoflush=False)()
+
+
+def _scratch_async_sessions(name: str):
+    """Async engine and session factory on a scratch database created by _scratch_session."""
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from shared.async_database import make_async_engine
+
+    engine = make_async_engine(f"sqlite:///{_WORKDIR}/{name}.db")
+    return engine, async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+
+def bench_verify_api_key(key_counts: List[int], seed: int) -> List[MicroResult]:
+    from fastapi import HTTPException
+    from sqlalchemy import insert
+    from shared.models import APIKey
+    from gateway.auth import key_cache, lookup_api_key
+
+    # Lookups are coroutines; each call runs to completion on one loop, which
+    # adds the loop's per-call overhead to the numbers
+    loop = asyncio.new_event_loop()
+    results = []
+    for count in key_counts:
+        engine, db = _scratch_session(f"keys_{count}")
+        rows = data.api_key_rows(count, seed)
+        keys = data.api_key_strings(count, seed)
+        for start in range(0, count, 50_000):
+            db.execute(insert(APIKey), rows[start:start + 50_000])
+        db.commit()
+        async_engine, sessions = _scratch_async_sessions(f"keys_{count}")
+
+        rng = random.Random(seed)
+        sample = [keys[rng.randrange(count)] for _ in range(1024)]
+        lookups = itertools.cycle(sample)
+
+        def verify(key):
+            return loop.run_until_complete(lookup_api_key(key, sessions))
+
+        def db_hit():
+            key_cache.clear()
+            return verify(next(lookups))
+
+        results.append(measure("auth.verify_api_key[hit]", db_hit, {"keys": count}))
+        for key in sample:
+            verify(key)
+        results.append(measure("auth.verify_api_key[cached]", lambda: verify(next(lookups)), {"keys": count}))
+
+        missing = data.api_key_strings(1, seed + 99)[0]
+
+        def miss():
+            try:
+                verify(missing)
+            except HTTPException:
+                pass
+
+        results.append(measure("auth.verify_api_key[miss]", miss, {"keys": count}))
+        db.close()
+        engine.dispose()
+        loop.run_until_complete(async_engine.dispose())
+    loop.close()
+    return results
+
+
+def bench_create_request_log() -> List[MicroResult]:
+    from shared import async_crud, crud
+
+    engine, db = _scratch_session("request_logs")
+    async_engine, sessions = _scratch_async_sessions("request_logs")
+    loop = asyncio.new_event_loop()
+    fields = dict(
+        user_id="bench@company.com",
+        api_key_id=1,
+        endpoint="v1/chat/completions",
+        method="POST",
+        status_code=200,
+        duration_ms=123.4,
+        prompt_tokens=42,
+        completion_tokens=128,
+        model="meta-llama/Llama-2-7b-chat-hf",
+    )
+
+    async def write_async():
+        async with sessions() as session:
+            await async_crud.create_request_log(session, **fields)
+
+    results = [
+        measure("crud.create_request_log", lambda: crud.create_request_log(db, **fields), repeat=3),
+        measure("async_crud.create_request_log", lambda: loop.run_until_complete(write_async()), repeat=3),
+    ]
+    db.close()
+    engine.dispose()
+    loop.run_until_complete(async_engine.dispose())
+    loop.close()
+    return results
+
+
+# ============================================================================
+# Proxy helpers
+# ============================================================================
+
+def bench_extract_usage(body_sizes: List[int], seed: int) -> List[MicroResult]:
+    from gateway.main import extract_usage
+
+    results = []
+    for size in body_sizes:
+        body = data.completion_response(size, seed=seed)
+        results.append(measure("gateway.extract_usage", lambda: extract_usage(body), {"bytes": len(body)}))
+    return results
+
+
+def bench_headers() -> List[MicroResult]:
+    from starlette.datastructures import Headers
+    from gateway.main import rate_limit_headers
+
+    raw = data.request_header_items()
+    return [
+        measure("gateway.rate_limit_headers", lambda: rate_limit_headers(100, 95, 1000, 998)),
+        measure("proxy.forward_request_headers", lambda: dict(Headers(raw=raw)), {"headers": len(raw)}),
+    ]
+
+
+def print_table(results: List[MicroResult]) -> None:
+    print(f"{'benchmark':<36} {'params':<22} {'best us':>10} {'median us':>10} {'peak B':>9} {'kept B':>8}")
+    for r in results:
+        params = ",".join(f"{k}={v}" for k, v in r.params.items())
+        print(
+            f"{r.name:<36} {params:<22} {r.us_per_call_best:>10.2f} {r.us_per_call_median:>10.2f} "
+            f"{r.peak_bytes_per_call:>9} {r.retained_bytes_per_call:>8.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway hot-path micro-benchmarks")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose group contains this")
+    parser.add_argument("--seed", type=int, default=data.DEFAULT_SEED)
+    parser.add_argument("--large", action="store_true", help="Include 1M key lookups")
+    parser.add_argument("--output", default="bench_results/micro.json")
+    args = parser.parse_args()
+
+    key_counts = [10_000, 100_000] + ([1_000_000] if args.large else [])
+    groups = {
+        "rate_limiter": lambda: bench_rate_limiter([10, 100, 1000]),
+        "verify_api_key": lambda: bench_verify_api_key(key_counts, args.seed),
+        "create_request_log": bench_create_request_log,
+        "extract_usage": lambda: bench_extract_usage([1_000, 100_000, 1_000_000], args.seed),
+        "headers": bench_headers,
+    }
+
+    results: List[MicroResult] = []
+    for name, run in groups.items():
+        if args.filter in name:
+            print(f"Running {name}...")
+            results.extend(run())
+
+    print()
+    print_table(results)
+    write_results(args.output, {
+        "benchmark": "micro",
+        "metadata": run_metadata(),
+        "config": {"seed": args.seed, "key_counts": key_counts},
+        "results": [asdict(r) for r in results],
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Local SMTP stand-in for testing email delivery.
+
+Speaks enough SMTP for smtplib (EHLO/HELO, AUTH PLAIN/LOGIN, MAIL, RCPT,
+DATA, RSET, NOOP, QUIT), accepts any credentials and keeps delivered
+messages in memory. Latency and transient failures (451) can be injected to
+see how the admin service behaves with a slow or flaky SMTP server.
+STARTTLS is not supported, so point the service at it with
+SMTP_USE_TLS=false.
+
+Usage:
+    python -m benchmarks.mock_smtp --port 2525 --latency-ms 500
+"""
+import argparse
+import asyncio
+import random
+from dataclasses import dataclass, field
+from email import message_from_bytes
+from email.message import Message
+from typing import List, Optional
+
+
+@dataclass
+class MockSMTPConfig:
+    """Behaviour of the mock SMTP server."""
+    latency_ms: float = 0.0  # Delay before the greeting and before accepting each message
+    failure_rate: float = 0.0  # Fraction of messages answered with 451
+    seed: Optional[int] = None
+
+
+@dataclass
+class MockSMTPServer:
+    """In-process mock SMTP server."""
+    config: MockSMTPConfig = field(default_factory=MockSMTPConfig)
+    messages: List[Message] = field(default_factory=list)
+    connections: int = 0
+    rejected: int = 0
+
+    def __post_init__(self):
+        self._rng = random.Random(self.config.seed)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def _delay(self):
+        if self.config.latency_ms > 0:
+            await asyncio.sleep(self.config.latency_ms / 1000)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+
+        async def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await self._delay()
+        await reply("220 mock-smtp ready")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    await reply("250-mock-smtp")
+                    await reply("250 AUTH PLAIN LOGIN")
+                elif verb == "HELO":
+                    await reply("250 mock-smtp")
+                elif verb == "AUTH":
+                    if command.upper().startswith("AUTH LOGIN"):
+                        await reply("334 VXNlcm5hbWU6")
+                        await reader.readline()
+                        await reply("334 UGFzc3dvcmQ6")
+                        await reader.readline()
+                    await reply("235 Authentication successful")
+                elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                    await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    lines = []
+                    while True:
+                        data = await reader.readline()
+                        if not data or data == b".\r\n":
+                            break
+                        lines.append(data[1:] if data.startswith(b"..") else data)
+                    await self._delay()
+                    if self._rng.random() < self.config.failure_rate:
+                        self.rejected += 1
+                        await reply("451 Temporary failure, try again later")
+                    else:
+                        self.messages.append(message_from_bytes(b"".join(lines)))
+                        await reply("250 Message accepted")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Start listening; returns the bound port."""
+        self._server = await asyncio.start_server(self.handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+async def _serve(args: argparse.Namespace):
+    server = MockSMTPServer(MockSMTPConfig(
+        latency_ms=args.latency_ms, failure_rate=args.failure_rate, seed=args.seed,
+    ))
+    port = await server.start(args.host, args.port)
+    print(f"Mock SMTP server listening on {args.host}:{port}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"  connections={server.connections} messages={len(server.messages)} rejected={server.rejected}")
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock SMTP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Mock OpenAI/vLLM backend for load testing the gateway.
+
+Serves the subset of the OpenAI API the gateway proxies (models, chat and
+text completions, embeddings) with configurable latency, token rate,
+streaming and error injection, so gateway overhead can be measured without
+a GPU. Embeddings are deterministic hashes of the words and character
+trigrams of the input, so texts that share most of their wording get
+similar vectors.
+
+Usage:
+    python -m benchmarks.mock_vllm --port 8100 --latency-ms 50 --tokens-per-sec 200
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class MockConfig:
+    """Behaviour of the mock backend."""
+    model: str = "meta-llama/Llama-2-7b-chat-hf"
+    latency_ms: float = 20.0  # Time to first token
+    jitter_ms: float = 0.0  # Uniform +/- jitter applied to latency_ms
+    tokens_per_sec: float = 0.0  # Generation speed, 0 = instant
+    completion_tokens: int = 16  # Used when the request has no max_tokens
+    error_rate: float = 0.0  # Fraction of requests answered with HTTP 500
+    embedding_dim: int = 256
+    seed: Optional[int] = None
+
+
+def _count_prompt_tokens(body: dict) -> int:
+    """Rough whitespace token count of the prompt."""
+    if "messages" in body:
+        text = " ".join(str(m.get("content", "")) for m in body["messages"])
+    else:
+        text = str(body.get("prompt", ""))
+    return max(1, len(text.split()))
+
+
+def mock_embedding(text: str, dim: int) -> List[float]:
+    """Unit vector of signed feature hashes of the words and character trigrams of a text."""
+    vector = [0.0] * dim
+    words = text.lower().split()
+    joined = " ".join(words)
+    features = words + [joined[i:i + 3] for i in range(len(joined) - 2)]
+    for feature in features:
+        digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+        vector[digest % dim] += 1.0 if digest >> 63 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def create_mock_app(config: Optional[MockConfig] = None) -> FastAPI:
+    """Create the mock backend app."""
+    config = config or MockConfig()
+    rng = random.Random(config.seed)
+    app = FastAPI(title="Mock vLLM Backend")
+
+    async def first_token_delay(duration_ms: Optional[float] = None):
+        delay = config.latency_ms
+        if config.jitter_ms:
+            delay += rng.uniform(-config.jitter_ms, config.jitter_ms)
+        if duration_ms is not None:
+            delay = min(delay, duration_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    async def token_delay(tokens: int, seconds_per_token: Optional[float] = None):
+        if seconds_per_token is None and config.tokens_per_sec > 0:
+            seconds_per_token = 1 / config.tokens_per_sec
+        if seconds_per_token and tokens > 0:
+            await asyncio.sleep(tokens * seconds_per_token)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "service": "mock-vllm"}
+
+    @app.get("/v1/models")
+    async def models():
+        return {
+            "object": "list",
+            "data": [{"id": config.model, "object": "model", "owned_by": "mock"}],
+        }
+
+    async def completion(request: Request, chat: bool):
+        body = await request.json()
+        if config.error_rate and rng.random() < config.error_rate:
+            return JSONResponse(status_code=500, content={"error": {"message": "Injected failure"}})
+
+        model = body.get("model", config.model)
+        prompt_tokens = _count_prompt_tokens(body)
+        completion_tokens = int(body.get("max_tokens") or config.completion_tokens)
+
+        # Replay tools pass the recorded duration so each request takes as long as it originally did
+        duration_ms = body.get("mock_duration_ms")
+        seconds_per_token = None
+        if duration_ms is not None:
+            duration_ms = float(duration_ms)
+            remaining_ms = max(0.0, duration_ms - config.latency_ms)
+            seconds_per_token = remaining_ms / 1000 / max(1, completion_tokens - 1)
+        request_id = f"cmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+        if body.get("stream"):
+            async def events():
+                await first_token_delay(duration_ms)
+                for i in range(completion_tokens):
+                    if i:
+                        await token_delay(1, seconds_per_token)
+                    if chat:
+                        choice = {"index": 0, "delta": {"content": "tok "}, "finish_reason": None}
+                    else:
+                        choice = {"index": 0, "text": "tok ", "finish_reason": None}
+                    chunk = {
+                        "id": request_id,
+                        "object": "chat.completion.chunk" if chat else "text_completion",
+                        "created": created,
+                        "model": model,
+                        "choices": [choice],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                final = {
+                    "id": request_id,
+                    "object": "chat.completion.chunk" if chat else "text_completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": usage,
+                }
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await first_token_delay(duration_ms)
+        await token_delay(completion_tokens - 1, seconds_per_token)
+        text = "tok " * completion_tokens
+        if chat:
+            choice = {
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "length",
+            }
+        else:
+            choice = {"index": 0, "text": text, "finish_reason": "length"}
+
+        return {
+            "id": request_id,
+            "object": "chat.completion" if chat else "text_completion",
+            "created": created,
+            "model": model,
+            "choices": [choice],
+            "usage": usage,
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        return await completion(request, chat=True)
+
+    @app.post("/v1/completions")
+    async def completions(request: Request):
+        return await completion(request, chat=False)
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        if config.error_rate and rng.random() < config.error_rate:
+            return JSONResponse(status_code=500, content={"error": {"message": "Injected failure"}})
+
+        inputs = body.get("input", "")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        prompt_tokens = sum(max(1, len(str(text).split())) for text in inputs)
+        return {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": mock_embedding(str(text), config.embedding_dim)}
+                for i, text in enumerate(inputs)
+            ],
+            "model": body.get("model", config.model),
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        }
+
+    return app
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add mock backend options to an argument parser."""
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Time to first token")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform latency jitter")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="Generation speed (0 = instant)")
+    parser.add_argument("--completion-tokens", type=int, default=16, help="Default completion length")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of injected 500s")
+    parser.add_argument("--embedding-dim", type=int, default=256, help="Size of /v1/embeddings vectors")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def mock_config_from_args(args: argparse.Namespace) -> MockConfig:
+    """Build a MockConfig from parsed arguments."""
+    return MockConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        embedding_dim=args.embedding_dim,
+        seed=args.seed,
+    )
+
+
+def mock_command_args(args: argparse.Namespace, port: int) -> list:
+    """Command line that starts this mock with the parsed options."""
+    command = [
+        "-m", "benchmarks.mock_vllm", "--port", str(port),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--tokens-per-sec", str(args.tokens_per_sec), "--completion-tokens", str(args.completion_tokens),
+        "--error-rate", str(args.error_rate), "--embedding-dim", str(args.embedding_dim),
+    ]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    return command
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock OpenAI/vLLM backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    app = create_mock_app(mock_config_from_args(args))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
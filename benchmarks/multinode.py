@@ -0,0 +1,201 @@
+"""Accuracy of shared rate limits across several gateway nodes.
+
+Runs several in-process gateway rate limiters in shared mode against one
+SQLite database, on a simulated clock, and drives them with Poisson
+traffic whose split between the nodes shifts halfway through the run (as
+when a load balancer drains a node). Every admission is recorded, and the
+global request counts in every sliding minute and hour window are compared
+with the limits:
+
+* overshoot: requests admitted beyond a limit, across all nodes
+* utilisation: admitted requests relative to one limiter seeing all traffic
+* estimate: the overshoot the nodes themselves reported at their syncs
+
+Each sync interval is run separately, next to nodes enforcing the full
+limits on their own (local mode), to show the accuracy it buys.
+
+Usage:
+    python -m benchmarks.multinode --nodes 3 --sync-seconds 0.5,1,5,15
+    python -m benchmarks.multinode --users 500 --rate 1 --duration 3600 --share-floor 0.2
+"""
+import argparse
+import heapq
+import os
+import random
+import tempfile
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from gateway.auth import APIKeyInfo
+from gateway.rate_limit_sync import RateLimitSync
+from gateway.rate_limiter import RateLimiter
+from shared.config import settings
+from shared.database import Base
+from shared.models import RateLimitNode, RateLimitReport
+
+from .common import run_metadata, write_results
+
+
+class SimulatedClock:
+    """Clock advanced by the simulation."""
+
+    def __init__(self, start: float):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def arrivals(users: int, rate: float, duration: float, seed: int) -> List[tuple]:
+    """(time offset, user index) of Poisson arrivals, in time order."""
+    rng = random.Random(seed)
+    events = []
+    for user in range(users):
+        t = rng.expovariate(rate)
+        while t < duration:
+            events.append((t, user))
+            t += rng.expovariate(rate)
+    events.sort()
+    return events
+
+
+def node_weights(nodes: int, shifted: bool) -> List[float]:
+    """Traffic split: most of it on the first node, then on the last one."""
+    weights = [2.0 ** -i for i in range(nodes)]
+    return weights[::-1] if shifted else weights
+
+
+def max_excess(timestamps: List[float], window: float, limit: int) -> int:
+    """Largest number of requests beyond ``limit`` in any sliding window."""
+    worst = 0
+    for i, t in enumerate(timestamps):
+        count = i + 1 - bisect_left(timestamps, t - window + 1e-9, 0, i + 1)
+        worst = max(worst, count - limit)
+    return worst
+
+
+def simulate(events: List[tuple], args: argparse.Namespace, sync_seconds: Optional[float]) -> Dict:
+    """
+    Run the traffic through ``args.nodes`` limiters.
+
+    sync_seconds None runs them in local mode, 0 runs a single limiter that
+    sees all traffic (the exact global limit).
+    """
+    start = 1_700_000_000.0
+    clock = SimulatedClock(start)
+    nodes = 1 if sync_seconds == 0 else args.nodes
+    limiters, syncs, session = [], [], None
+    if sync_seconds:
+        path = os.path.join(tempfile.mkdtemp(prefix="multinode-"), "limits.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine, tables=[RateLimitNode.__table__, RateLimitReport.__table__])
+        session = sessionmaker(bind=engine)
+    for i in range(nodes):
+        sync = None
+        if sync_seconds:
+            sync = RateLimitSync(f"node{i}", sync_seconds=sync_seconds, share_floor=args.share_floor, clock=clock)
+            syncs.append(sync)
+        limiters.append(RateLimiter(clock=clock, sync=sync))
+
+    # Nodes sync on their own schedules, evenly staggered
+    schedule = [(start + sync_seconds * (i + 1) / nodes, i) for i in range(len(syncs))]
+    heapq.heapify(schedule)
+
+    rng = random.Random(args.seed)
+    users = [APIKeyInfo(key_id=u, key_prefix="sim", user_id=f"user{u}", tier=args.tier) for u in range(args.users)]
+    admitted: Dict[int, List[float]] = {}
+    rejected = 0
+    sync_ms = []
+    for offset, user in events:
+        now = start + offset
+        while schedule and schedule[0][0] <= now:
+            at, i = heapq.heappop(schedule)
+            clock.now = at
+            db = session()
+            try:
+                syncs[i].sync(db, limiters[i].request_history)
+            finally:
+                db.close()
+            sync_ms.append(syncs[i].last_sync_ms)
+            heapq.heappush(schedule, (at + sync_seconds, i))
+        clock.now = now
+        weights = node_weights(nodes, shifted=offset >= args.duration / 2)
+        node = rng.choices(range(nodes), weights)[0]
+        try:
+            limiters[node].check_rate_limit(users[user])
+        except HTTPException:
+            rejected += 1
+            continue
+        admitted.setdefault(user, []).append(now)
+
+    minute_limit, hour_limit = limiters[0].get_tier_limits(args.tier)
+    minute_excess = [max_excess(ts, 60, minute_limit) for ts in admitted.values()]
+    hour_excess = [max_excess(ts, 3600, hour_limit) for ts in admitted.values()]
+    result = {
+        "admitted": sum(len(ts) for ts in admitted.values()),
+        "rejected": rejected,
+        "minute_overshoot_max": max(minute_excess, default=0),
+        "hour_overshoot_max": max(hour_excess, default=0),
+        "users_over_minute_limit": sum(1 for e in minute_excess if e > 0),
+        "users_over_hour_limit": sum(1 for e in hour_excess if e > 0),
+    }
+    if syncs:
+        sync_ms.sort()
+        result["reported_overshoot_max"] = max(s.overshoot_max for s in syncs)
+        result["reported_overshoot_events"] = sum(s.overshoot_events for s in syncs)
+        result["syncs"] = len(sync_ms)
+        result["sync_ms_p50"] = round(sync_ms[len(sync_ms) // 2], 2) if sync_ms else 0.0
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared rate limit accuracy across gateway nodes")
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=0.5, help="Requests per second per user")
+    parser.add_argument("--duration", type=float, default=1800.0, help="Simulated seconds")
+    parser.add_argument("--tier", default="free", choices=("free", "standard", "premium"))
+    parser.add_argument("--sync-seconds", default="0.5,1,5,15", help="Comma-separated sync intervals to compare")
+    parser.add_argument("--share-floor", type=float, default=settings.rate_limit_share_floor)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default="bench_results/multinode.json")
+    args = parser.parse_args()
+
+    events = arrivals(args.users, args.rate, args.duration, args.seed)
+    print(f"{len(events)} requests from {args.users} users over {args.duration:.0f} s on {args.nodes} nodes")
+
+    runs = {}
+    for name, sync_seconds in (
+        [("global", 0), ("local", None)]
+        + [(f"shared_{s}s", float(s)) for s in args.sync_seconds.split(",")]
+    ):
+        wall = time.perf_counter()
+        runs[name] = simulate(events, args, sync_seconds)
+        runs[name]["wall_seconds"] = round(time.perf_counter() - wall, 1)
+
+    ideal = runs["global"]["admitted"] or 1
+    print(f"\n{'mode':<14}{'admitted':>10}{'util %':>8}{'min over':>10}{'hour over':>11}{'users over':>12}{'reported':>10}")
+    for name, run in runs.items():
+        run["utilisation"] = round(run["admitted"] / ideal, 4)
+        users_over = max(run["users_over_minute_limit"], run["users_over_hour_limit"])
+        print(
+            f"{name:<14}{run['admitted']:>10}{run['utilisation'] * 100:>8.1f}"
+            f"{run['minute_overshoot_max']:>10}{run['hour_overshoot_max']:>11}{users_over:>12}"
+            f"{run.get('reported_overshoot_max', '-'):>10}"
+        )
+
+    write_results(args.output, {
+        "benchmark": "multinode",
+        "metadata": run_metadata(),
+        "config": vars(args),
+        "runs": runs,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+"""Offline rate-limit policy and capacity simulator over historical logs.
+
+Replays ``request_logs`` through a candidate tier policy and an upstream
+capacity model without touching any service, and reports how many requests
+would have been rejected per user and tier, how long accepted requests
+would have queued upstream, and how busy the upstream would have been.
+The current limits from ``shared.config`` are always simulated as a
+baseline next to the candidate.
+
+Both stages are vectorised with NumPy:
+
+* Rate limits reproduce the gateway's sliding-window log exactly. Whether
+  a request is admitted depends only on earlier admissions of the same
+  user, so the admission vector is the unique fixed point of a triangular
+  system; it is found by Jacobi iteration over all users at once, with
+  window counts from cumulative sums and ``searchsorted``. Users that have
+  not converged after ``--max-iterations`` are finished with an exact
+  per-user loop.
+* The upstream is modelled as a pooled FIFO queue with ``nodes x
+  slots_per_node`` parallel sequences (the heavy-traffic approximation of
+  an M/G/c queue), solved with the closed form of Lindley's recursion.
+
+Usage:
+    python -m benchmarks.policy_sim --source-db sqlite:///./llm_api.db --policy candidate.json --nodes 2
+    python -m benchmarks.policy_sim --synthetic 5000000 --policy candidate.json
+
+Policy file format (tiers missing from the file keep their current limits):
+    {"free": {"per_minute": 10, "per_hour": 100}, "premium": {"per_minute": 200, "per_hour": 3000}}
+"""
+import argparse
+import bisect
+import json
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+
+from .common import run_metadata, write_results
+
+TIERS = ("free", "standard", "premium")
+
+
+@dataclass
+class LogArrays:
+    """Column arrays of the simulated request logs."""
+    timestamps: np.ndarray  # float64 seconds
+    user_idx: np.ndarray  # int64 index into users
+    tier_idx: np.ndarray  # int64 index into TIERS
+    prompt_tokens: np.ndarray
+    completion_tokens: np.ndarray
+    duration_ms: np.ndarray
+    users: np.ndarray  # user_id strings
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+@dataclass
+class CapacityModel:
+    """Upstream serving capacity."""
+    nodes: int = 1
+    slots_per_node: int = 16  # Concurrent sequences per node
+    prefill_tokens_per_sec: float = 4000.0  # Per sequence
+    decode_tokens_per_sec: float = 30.0  # Per sequence
+    overhead_ms: float = 20.0
+    use_recorded_durations: bool = False
+
+    @property
+    def servers(self) -> int:
+        return self.nodes * self.slots_per_node
+
+    def service_seconds(self, logs: LogArrays, mask: np.ndarray) -> np.ndarray:
+        if self.use_recorded_durations:
+            return logs.duration_ms[mask] / 1000
+        return (
+            self.overhead_ms / 1000
+            + logs.prompt_tokens[mask] / self.prefill_tokens_per_sec
+            + logs.completion_tokens[mask] / self.decode_tokens_per_sec
+        )
+
+
+def current_policy() -> Dict[str, Dict[str, int]]:
+    """Tier limits currently configured in shared.config."""
+    from shared.config import settings
+
+    return {
+        tier: {
+            "per_minute": getattr(settings, f"rate_limit_{tier}_per_minute"),
+            "per_hour": getattr(settings, f"rate_limit_{tier}_per_hour"),
+        }
+        for tier in TIERS
+    }
+
+
+def load_policy(path: Optional[str]) -> Dict[str, Dict[str, int]]:
+    """Candidate policy from a JSON file, defaulting to the current limits."""
+    policy = current_policy()
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for tier, limits in json.load(f).items():
+                policy.setdefault(tier, {}).update(limits)
+    return policy
+
+
+def _tier_index(tiers) -> np.ndarray:
+    # Unknown tiers fall back to free, like RateLimiter.get_tier_limits
+    lookup = {"standard": 1, "premium": 2}
+    return np.fromiter((lookup.get(t, 0) for t in tiers), dtype=np.int64, count=len(tiers))
+
+
+def _arrays(timestamps, user_ids, tiers, prompt, completion, duration) -> LogArrays:
+    users, user_idx = np.unique(np.asarray(user_ids, dtype=object).astype(str), return_inverse=True)
+    return LogArrays(
+        timestamps=np.asarray(timestamps, dtype=np.float64),
+        user_idx=user_idx.astype(np.int64),
+        tier_idx=_tier_index(tiers),
+        prompt_tokens=np.asarray(prompt, dtype=np.float64),
+        completion_tokens=np.asarray(completion, dtype=np.float64),
+        duration_ms=np.asarray(duration, dtype=np.float64),
+        users=users,
+    )
+
+
+def load_from_db(database_url: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 batch_size: int = 50_000) -> LogArrays:
+    """Load request_logs columns (including time partitions), with tiers joined from api_keys."""
+    from sqlalchemy import create_engine, select
+    from shared.log_partitions import log_tables
+    from shared.models import APIKey
+
+    columns = ([], [], [], [], [], [])
+    engine = create_engine(database_url)
+    with engine.connect() as conn:
+        for table in log_tables(engine, since, until):
+            logs = table.c
+            query = (
+                select(
+                    logs.timestamp,
+                    logs.user_id,
+                    APIKey.tier,
+                    logs.prompt_tokens,
+                    logs.completion_tokens,
+                    logs.duration_ms,
+                )
+                .outerjoin(APIKey, APIKey.id == logs.api_key_id)
+            )
+            if since:
+                query = query.where(logs.timestamp >= since)
+            if until:
+                query = query.where(logs.timestamp < until)
+
+            result = conn.execution_options(yield_per=batch_size).execute(query)
+            for rows in result.partitions():
+                for ts, user_id, tier, prompt, completion, duration in rows:
+                    columns[0].append(ts.timestamp())
+                    columns[1].append(user_id)
+                    columns[2].append(tier or "standard")
+                    columns[3].append(prompt or 0)
+                    columns[4].append(completion or 0)
+                    columns[5].append(duration or 0.0)
+    engine.dispose()
+    return _arrays(*columns)
+
+
+def load_from_export(path: str) -> LogArrays:
+    """Load a JSONL or CSV export of request_logs."""
+    from .replay import records_from_export
+
+    columns = ([], [], [], [], [], [])
+    for r in records_from_export(path):
+        columns[0].append(r.timestamp.timestamp())
+        columns[1].append(r.user_id)
+        columns[2].append(r.tier)
+        columns[3].append(r.prompt_tokens)
+        columns[4].append(r.completion_tokens)
+        columns[5].append(r.duration_ms)
+    return _arrays(*columns)
+
+
+def synthetic_logs(rows: int, users: int = 2000, days: float = 7.0, seed: int = 1234) -> LogArrays:
+    """Bursty synthetic traffic: Zipf-distributed users, clustered arrivals."""
+    rng = np.random.default_rng(seed)
+    span = days * 86400
+    # Bursts: a few arrival clusters per user-hour instead of uniform arrivals
+    centers = rng.uniform(0, span, size=max(1, rows // 20))
+    timestamps = np.sort(rng.choice(centers, size=rows) + rng.exponential(30.0, size=rows))
+    weights = 1.0 / np.arange(1, users + 1) ** 1.1
+    user_idx = rng.choice(users, size=rows, p=weights / weights.sum())
+    user_tiers = rng.choice(3, size=users, p=[0.3, 0.6, 0.1])
+    completion = rng.integers(16, 512, size=rows).astype(np.float64)
+    return LogArrays(
+        timestamps=timestamps,
+        user_idx=user_idx.astype(np.int64),
+        tier_idx=user_tiers[user_idx].astype(np.int64),
+        prompt_tokens=rng.integers(16, 2048, size=rows).astype(np.float64),
+        completion_tokens=completion,
+        duration_ms=20 + completion / 30 * 1000,
+        users=np.array([f"user{i}@company.com" for i in range(users)]),
+    )
+
+
+def _admit_sequential(times: np.ndarray, minute_limits: np.ndarray, hour_limits: np.ndarray) -> np.ndarray:
+    """Exact sliding-window admission for one user, like RateLimiter.check_rate_limit."""
+    admitted = np.zeros(len(times), dtype=bool)
+    if minute_limits.min() == minute_limits.max() and hour_limits.min() == hour_limits.max():
+        return _admit_jumping(times, int(minute_limits[0]), int(hour_limits[0]))
+
+    history = []  # Admitted timestamps
+    minute_start = hour_start = 0
+    for i, now in enumerate(times.tolist()):
+        while hour_start < len(history) and history[hour_start] < now - 3600:
+            hour_start += 1
+        while minute_start < len(history) and history[minute_start] < now - 60:
+            minute_start += 1
+        if len(history) - hour_start >= hour_limits[i]:
+            continue
+        if len(history) - minute_start >= minute_limits[i]:
+            continue
+        history.append(now)
+        admitted[i] = True
+    return admitted
+
+
+def _admit_jumping(times: np.ndarray, minute_limit: int, hour_limit: int) -> np.ndarray:
+    """
+    Exact admission for one user with fixed limits, in O(admitted * log n).
+
+    The k-th admission is the first arrival after the previous one that is
+    strictly later than both the (k - minute_limit)-th admission + 60s and
+    the (k - hour_limit)-th admission + 3600s, so rejected runs are skipped
+    with a binary search instead of being visited one by one.
+    """
+    admitted = np.zeros(len(times), dtype=bool)
+    if minute_limit <= 0 or hour_limit <= 0:
+        return admitted
+    values = times.tolist()
+    history = []
+    position = 0
+    while position < len(values):
+        k = len(history)
+        threshold = -np.inf
+        if k >= minute_limit:
+            threshold = history[k - minute_limit] + 60
+        if k >= hour_limit:
+            threshold = max(threshold, history[k - hour_limit] + 3600)
+        position = max(position, bisect.bisect_right(values, threshold, lo=position))
+        if position >= len(values):
+            break
+        history.append(values[position])
+        admitted[position] = True
+        position += 1
+    return admitted
+
+
+def simulate_rate_limits(logs: LogArrays, policy: Dict[str, Dict[str, int]],
+                         max_iterations: int = 16) -> Dict:
+    """Admission decision for every request under a tier policy."""
+    n = len(logs)
+    order = np.lexsort((logs.timestamps, logs.user_idx))
+    user = logs.user_idx[order]
+    t = logs.timestamps[order] - logs.timestamps.min()
+
+    # Offset every user's timeline so one sorted key array serves all users
+    # and a window never reaches into the previous user's requests
+    span = t.max() + 3601.0
+    key = t + user * span
+    lo_minute = np.searchsorted(key, key - 60, side="left")
+    lo_hour = np.searchsorted(key, key - 3600, side="left")
+
+    minute_table = np.array([policy[tier]["per_minute"] for tier in TIERS])
+    hour_table = np.array([policy[tier]["per_hour"] for tier in TIERS])
+    tier = logs.tier_idx[order]
+    minute_limits = minute_table[tier]
+    hour_limits = hour_table[tier]
+
+    # Jacobi iteration, restricted each round to the users that still changed.
+    # Windows never cross users, so a user's segment can be iterated on its own.
+    admitted = np.ones(n, dtype=bool)
+    active = np.arange(n)  # Positions (into the sorted arrays) still iterated
+    local_minute, local_hour = lo_minute, lo_hour
+    iterations = 0
+    for iterations in range(1, max_iterations + 1):
+        values = admitted[active]
+        cumulative = np.zeros(len(active) + 1, dtype=np.int64)
+        np.cumsum(values, out=cumulative[1:])
+        positions = np.arange(len(active))
+        in_minute = cumulative[positions] - cumulative[local_minute]
+        in_hour = cumulative[positions] - cumulative[local_hour]
+        updated = (in_minute < minute_limits[active]) & (in_hour < hour_limits[active])
+        changed = updated != values
+        admitted[active] = updated
+        if not changed.any():
+            active = active[:0]
+            break
+
+        # Keep only the segments of users with a change this round
+        changed_users = np.bincount(user[active], weights=changed, minlength=len(logs.users)) > 0
+        still_active = changed_users[user[active]]
+        remap = np.cumsum(still_active) - 1
+        local_minute = remap[local_minute[still_active]]
+        local_hour = remap[local_hour[still_active]]
+        active = active[still_active]
+
+    # Finish users that have not reached the fixed point with the exact loop
+    fallback_users = np.unique(user[active])
+    starts = np.searchsorted(user, fallback_users, side="left")
+    ends = np.searchsorted(user, fallback_users, side="right")
+    for start, end in zip(starts, ends):
+        admitted[start:end] = _admit_sequential(
+            t[start:end], minute_limits[start:end], hour_limits[start:end]
+        )
+
+    result = np.empty(n, dtype=bool)
+    result[order] = admitted
+    return {"admitted": result, "iterations": iterations, "fallback_users": len(fallback_users)}
+
+
+def simulate_queue(logs: LogArrays, admitted: np.ndarray, capacity: CapacityModel) -> Dict:
+    """Upstream queue waits and utilisation for the admitted requests."""
+    order = np.argsort(logs.timestamps[admitted], kind="stable")
+    arrivals = logs.timestamps[admitted][order]
+    service = capacity.service_seconds(logs, admitted)[order] / capacity.servers
+    if len(arrivals) == 0:
+        return {"requests": 0}
+
+    # Lindley: W[n] = max(0, W[n-1] + S[n-1] - (A[n] - A[n-1])), closed form via running minimum
+    steps = np.empty(len(arrivals))
+    steps[0] = 0.0
+    steps[1:] = service[:-1] - np.diff(arrivals)
+    drift = np.cumsum(steps)
+    waits = drift - np.minimum(np.minimum.accumulate(drift), 0.0)
+
+    span = max(arrivals[-1] + waits[-1] + service[-1] - arrivals[0], 1e-9)
+    hours = ((arrivals - arrivals[0]) // 3600).astype(np.int64)
+    hourly_max = np.zeros(hours.max() + 1)
+    np.maximum.at(hourly_max, hours, waits)
+
+    return {
+        "requests": int(len(arrivals)),
+        "servers": capacity.servers,
+        "utilisation": round(float(service.sum() / span), 4),
+        "wait_s": {
+            "mean": round(float(waits.mean()), 3),
+            "p50": round(float(np.percentile(waits, 50)), 3),
+            "p95": round(float(np.percentile(waits, 95)), 3),
+            "p99": round(float(np.percentile(waits, 99)), 3),
+            "max": round(float(waits.max()), 3),
+        },
+        "queued_fraction": round(float((waits > 0).mean()), 4),
+        "hourly_max_wait_s": [round(float(w), 3) for w in hourly_max],
+    }
+
+
+def rejection_report(logs: LogArrays, admitted: np.ndarray, top_users: int) -> Dict:
+    """Rejected requests per tier and for the most affected users."""
+    rejected = ~admitted
+    by_tier = {}
+    for i, tier in enumerate(TIERS):
+        in_tier = logs.tier_idx == i
+        total = int(in_tier.sum())
+        if total:
+            count = int((rejected & in_tier).sum())
+            by_tier[tier] = {"requests": total, "rejected": count, "rejected_fraction": round(count / total, 4)}
+
+    per_user_total = np.bincount(logs.user_idx, minlength=len(logs.users))
+    per_user_rejected = np.bincount(logs.user_idx, weights=rejected, minlength=len(logs.users)).astype(np.int64)
+    worst = np.argsort(-per_user_rejected, kind="stable")[:top_users]
+    by_user = {
+        str(logs.users[u]): {"requests": int(per_user_total[u]), "rejected": int(per_user_rejected[u])}
+        for u in worst if per_user_rejected[u] > 0
+    }
+    return {
+        "requests": len(logs),
+        "rejected": int(rejected.sum()),
+        "rejected_fraction": round(float(rejected.mean()), 4) if len(logs) else 0,
+        "users_affected": int((per_user_rejected > 0).sum()),
+        "by_tier": by_tier,
+        "top_rejected_users": by_user,
+    }
+
+
+def run_policy(name: str, logs: LogArrays, policy: Dict, capacity: CapacityModel, args) -> Dict:
+    start = time.perf_counter()
+    limits = simulate_rate_limits(logs, policy, args.max_iterations)
+    limit_seconds = time.perf_counter() - start
+    queue = simulate_queue(logs, limits["admitted"], capacity)
+    total_seconds = time.perf_counter() - start
+
+    report = {
+        "policy": policy,
+        "rate_limits": rejection_report(logs, limits["admitted"], args.top_users),
+        "upstream": queue,
+        "engine": {
+            "iterations": limits["iterations"],
+            "fallback_users": limits["fallback_users"],
+            "rate_limit_seconds": round(limit_seconds, 3),
+            "total_seconds": round(total_seconds, 3),
+        },
+    }
+    rl = report["rate_limits"]
+    print(
+        f"  {name:>9}: rejected {rl['rejected']:,}/{rl['requests']:,} ({rl['rejected_fraction']:.2%}), "
+        f"upstream util {queue.get('utilisation', 0):.1%}, wait p99 {queue.get('wait_s', {}).get('p99', 0):.2f}s "
+        f"[{total_seconds:.2f}s, {limits['iterations']} iterations, {limits['fallback_users']} fallback users]"
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline rate-limit policy and capacity simulator")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--source-db", help="SQLAlchemy URL of the database holding request_logs")
+    source.add_argument("--export", help="JSONL or CSV export of request_logs")
+    source.add_argument("--synthetic", type=int, help="Simulate this many synthetic log rows")
+    parser.add_argument("--since", type=datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.fromisoformat)
+    parser.add_argument("--policy", help="JSON file with the candidate tier limits")
+    parser.add_argument("--nodes", type=int, default=1, help="Upstream GPU nodes")
+    parser.add_argument("--slots-per-node", type=int, default=16, help="Concurrent sequences per node")
+    parser.add_argument("--prefill-tokens-per-sec", type=float, default=4000.0)
+    parser.add_argument("--decode-tokens-per-sec", type=float, default=30.0)
+    parser.add_argument("--overhead-ms", type=float, default=20.0)
+    parser.add_argument("--use-recorded-durations", action="store_true",
+                        help="Use recorded duration_ms as service time instead of the token model")
+    parser.add_argument("--max-iterations", type=int, default=16)
+    parser.add_argument("--top-users", type=int, default=20)
+    parser.add_argument("--output", default="bench_results/policy_sim.json")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.source_db:
+        logs = load_from_db(args.source_db, args.since, args.until)
+    elif args.export:
+        logs = load_from_export(args.export)
+    else:
+        logs = synthetic_logs(args.synthetic)
+    print(f"Loaded {len(logs):,} log rows for {len(logs.users):,} users in {time.perf_counter() - start:.2f}s")
+    if not len(logs):
+        return
+
+    capacity = CapacityModel(
+        nodes=args.nodes,
+        slots_per_node=args.slots_per_node,
+        prefill_tokens_per_sec=args.prefill_tokens_per_sec,
+        decode_tokens_per_sec=args.decode_tokens_per_sec,
+        overhead_ms=args.overhead_ms,
+        use_recorded_durations=args.use_recorded_durations,
+    )
+    results = {
+        "current": run_policy("current", logs, current_policy(), capacity, args),
+        "candidate": run_policy("candidate", logs, load_policy(args.policy), capacity, args),
+    }
+    write_results(args.output, {
+        "benchmark": "policy_sim",
+        "metadata": run_metadata(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "capacity": vars(capacity),
+        **results,
+    })
+
+
+if __name__ == "__main__":
+    main()
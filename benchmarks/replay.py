@@ -0,0 +1,323 @@
+"""Replay recorded traffic from ``request_logs`` against the gateway.
+
+Reads RequestLog rows from a database (including time partitions) (or a JSONL/CSV export of them) and
+re-issues them against the real gateway and a mock backend with the same
+arrival pattern, per-user mix and token sizes, optionally compressed in
+time. Each recorded user gets its own API key with its recorded tier, so
+rate limits see the same per-user traffic as production did; tier limits
+are scaled by the compression factor so throttling stays comparable.
+
+Usage:
+    python -m benchmarks.replay --source-db sqlite:///./llm_api.db --since 2024-05-01 --until 2024-05-02 --speed 10
+    python -m benchmarks.replay --export logs.jsonl --speed 60 --replay-durations
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+from .common import (
+    ManagedService,
+    ProcessSampler,
+    create_api_keys,
+    free_port,
+    gateway_service,
+    run_metadata,
+    summarize,
+    write_results,
+)
+from .loadtest import RequestResult, send_request
+from .mock_vllm import add_mock_arguments, mock_command_args
+
+
+@dataclass
+class LogRecord:
+    """The parts of a RequestLog row needed to reproduce the request."""
+    timestamp: datetime
+    user_id: str
+    endpoint: str
+    method: str = "POST"
+    status_code: int = 200
+    duration_ms: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    model: Optional[str] = None
+    tier: str = "standard"
+
+
+def _parse_timestamp(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace("Z", ""))
+
+
+def _record_from_mapping(row: Dict) -> LogRecord:
+    return LogRecord(
+        timestamp=_parse_timestamp(row["timestamp"]),
+        user_id=str(row["user_id"]),
+        endpoint=str(row["endpoint"]),
+        method=str(row.get("method") or "POST"),
+        status_code=int(row.get("status_code") or 200),
+        duration_ms=float(row.get("duration_ms") or 0),
+        prompt_tokens=int(row.get("prompt_tokens") or 0),
+        completion_tokens=int(row.get("completion_tokens") or 0),
+        model=row.get("model") or None,
+        tier=str(row.get("tier") or "standard"),
+    )
+
+
+def records_from_export(path: str) -> Iterator[LogRecord]:
+    """Read records from a JSONL or CSV export of request_logs."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield _record_from_mapping(row)
+        else:
+            for line in f:
+                if line.strip():
+                    yield _record_from_mapping(json.loads(line))
+
+
+def records_from_db(database_url: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                    batch_size: int = 10_000) -> Iterator[LogRecord]:
+    """Read records from request_logs and its time partitions, with tiers joined from api_keys."""
+    from sqlalchemy import create_engine, select
+    from shared.log_partitions import log_tables
+    from shared.models import APIKey
+
+    engine = create_engine(database_url)
+    with engine.connect() as conn:
+        for table in log_tables(engine, since, until):
+            logs = table.c
+            query = (
+                select(
+                    logs.timestamp, logs.user_id, logs.endpoint, logs.method, logs.status_code,
+                    logs.duration_ms, logs.prompt_tokens, logs.completion_tokens, logs.model, APIKey.tier,
+                )
+                .outerjoin(APIKey, APIKey.id == logs.api_key_id)
+                .order_by(logs.timestamp, logs.id)
+            )
+            if since:
+                query = query.where(logs.timestamp >= since)
+            if until:
+                query = query.where(logs.timestamp < until)
+
+            for row in conn.execution_options(yield_per=batch_size).execute(query):
+                yield LogRecord(
+                    timestamp=row.timestamp,
+                    user_id=row.user_id,
+                    endpoint=row.endpoint,
+                    method=row.method,
+                    status_code=row.status_code,
+                    duration_ms=row.duration_ms,
+                    prompt_tokens=row.prompt_tokens or 0,
+                    completion_tokens=row.completion_tokens or 0,
+                    model=row.model,
+                    tier=row.tier or "standard",
+                )
+    engine.dispose()
+
+
+def build_request(record: LogRecord, replay_durations: bool, speed: float) -> Optional[dict]:
+    """Request body reproducing the recorded prompt and completion sizes."""
+    if record.method == "GET":
+        return None
+    body = {
+        "model": record.model or "meta-llama/Llama-2-7b-chat-hf",
+        "max_tokens": max(1, record.completion_tokens),
+    }
+    prompt = "word " * max(1, record.prompt_tokens)
+    if record.endpoint.endswith("chat/completions"):
+        body["messages"] = [{"role": "user", "content": prompt}]
+    else:
+        body["prompt"] = prompt
+    if replay_durations:
+        body["mock_duration_ms"] = record.duration_ms / speed
+    return body
+
+
+def scaled_rate_limit_env(speed: float) -> Dict[str, str]:
+    """
+    Tier limits scaled by the time compression factor.
+
+    Windows stay one minute / one hour of wall-clock time during a replay,
+    so limits are multiplied by ``speed`` to throttle the same share of the
+    recorded traffic. Candidate limits can be tried by exporting
+    RATE_LIMIT_* variables before running the replay.
+    """
+    from shared.config import settings
+
+    env = {}
+    for tier in ("free", "standard", "premium"):
+        for window in ("minute", "hour"):
+            name = f"rate_limit_{tier}_per_{window}"
+            env[name.upper()] = str(max(1, int(getattr(settings, name) * speed)))
+    return env
+
+
+class ReplayStats:
+    """Replay outcomes grouped per user and tier."""
+
+    def __init__(self):
+        self.results: List[RequestResult] = []
+        self.lag_ms: List[float] = []
+        self.by_user: Dict[str, List[RequestResult]] = {}
+        self.by_tier: Dict[str, List[RequestResult]] = {}
+        self.recorded_status: Dict[str, int] = {}
+
+    def add(self, record: LogRecord, result: RequestResult) -> None:
+        self.results.append(result)
+        self.by_user.setdefault(record.user_id, []).append(result)
+        self.by_tier.setdefault(record.tier, []).append(result)
+
+    @staticmethod
+    def _group(results: List[RequestResult]) -> Dict:
+        statuses: Dict[str, int] = {}
+        for r in results:
+            statuses[str(r.status)] = statuses.get(str(r.status), 0) + 1
+        return {
+            "requests": len(results),
+            "status_counts": statuses,
+            "rate_limited": statuses.get("429", 0),
+            "latency_ms": summarize([r.latency_ms for r in results if r.status == 200]),
+        }
+
+    def report(self, duration_s: float) -> Dict:
+        overall = self._group(self.results)
+        overall["duration_s"] = round(duration_s, 3)
+        overall["throughput_rps"] = round(len(self.results) / duration_s, 2) if duration_s else 0
+        overall["ttft_ms"] = summarize([r.ttft_ms for r in self.results if r.status == 200 and r.ttft_ms])
+        overall["schedule_lag_ms"] = summarize(self.lag_ms)
+        overall["recorded_status_counts"] = self.recorded_status
+        return {
+            "overall": overall,
+            "by_tier": {tier: self._group(rs) for tier, rs in sorted(self.by_tier.items())},
+            "by_user": {user: self._group(rs) for user, rs in sorted(self.by_user.items())},
+        }
+
+
+async def replay(records: Iterator[LogRecord], gateway_url: str, keys: Dict[str, str],
+                 args: argparse.Namespace) -> ReplayStats:
+    """Issue every record at its (compressed) original offset."""
+    stats = ReplayStats()
+    semaphore = asyncio.Semaphore(args.max_in_flight)
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    tasks = set()
+
+    async def issue(client, record):
+        try:
+            result = await send_request(
+                client,
+                keys[record.user_id],
+                build_request(record, args.replay_durations, args.speed),
+                path=f"/{record.endpoint.lstrip('/')}",
+                method=record.method,
+            )
+            stats.add(record, result)
+        finally:
+            semaphore.release()
+
+    async with httpx.AsyncClient(base_url=gateway_url, timeout=args.timeout, limits=limits) as client:
+        start_wall = time.perf_counter()
+        start_log = None
+        for record in records:
+            if start_log is None:
+                start_log = record.timestamp
+            target = start_wall + (record.timestamp - start_log).total_seconds() / args.speed
+            delay = target - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await semaphore.acquire()
+            stats.lag_ms.append(max(0.0, (time.perf_counter() - target) * 1000))
+            stats.recorded_status[str(record.status_code)] = stats.recorded_status.get(str(record.status_code), 0) + 1
+            task = asyncio.create_task(issue(client, record))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded request_logs against the gateway")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--source-db", help="SQLAlchemy URL of the database holding request_logs")
+    source.add_argument("--export", help="JSONL or CSV export of request_logs")
+    parser.add_argument("--since", type=_parse_timestamp, help="Only replay logs at or after this time")
+    parser.add_argument("--until", type=_parse_timestamp, help="Only replay logs before this time")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time compression factor, e.g. 10 = 10x faster")
+    parser.add_argument("--replay-durations", action="store_true",
+                        help="Make the mock backend take each request's recorded duration (compressed by --speed)")
+    parser.add_argument("--unlimited", action="store_true", help="Disable gateway rate limits during replay")
+    parser.add_argument("--max-in-flight", type=int, default=1024)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", default="bench_results/replay.json")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    def load_records() -> Iterator[LogRecord]:
+        if args.source_db:
+            return records_from_db(args.source_db, args.since, args.until)
+        records = records_from_export(args.export)
+        return (
+            r for r in records
+            if (not args.since or r.timestamp >= args.since) and (not args.until or r.timestamp < args.until)
+        )
+
+    # shared.database binds its engine on import, so point it at the scratch database first
+    workdir = tempfile.mkdtemp(prefix="gateway-replay-")
+    database_url = f"sqlite:///{workdir}/replay.db"
+    os.environ["DATABASE_URL"] = database_url
+
+    # First pass: one key per recorded user with its recorded tier
+    users: Dict[str, str] = {}
+    for record in load_records():
+        users.setdefault(record.user_id, record.tier)
+    if not users:
+        print("No request logs matched")
+        return
+    keys = create_api_keys(users)
+    print(f"Replaying traffic of {len(users)} users at {args.speed:g}x speed")
+
+    mock_port = free_port()
+    mock = ManagedService("mock-vllm", mock_command_args(args, mock_port), mock_port)
+    gateway = gateway_service(
+        free_port(),
+        database_url,
+        f"http://127.0.0.1:{mock_port}",
+        unlimited=args.unlimited,
+        extra_env={} if args.unlimited else scaled_rate_limit_env(args.speed),
+    )
+
+    with mock, gateway:
+        sampler = ProcessSampler(gateway.pid)
+        sampler.start()
+        start = time.perf_counter()
+        stats = asyncio.run(replay(load_records(), gateway.url, keys, args))
+        report = stats.report(time.perf_counter() - start)
+        report["gateway_resources"] = sampler.stop()
+
+    overall = report["overall"]
+    print(
+        f"  {overall['requests']} requests, {overall['rate_limited']} rate limited, "
+        f"p99={overall['latency_ms'].get('p99', 0):.1f}ms, "
+        f"schedule lag p99={overall['schedule_lag_ms'].get('p99', 0):.1f}ms"
+    )
+    write_results(args.output, {
+        "benchmark": "replay",
+        "metadata": run_metadata(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        **report,
+    })
+
+
+if __name__ == "__main__":
+    main()
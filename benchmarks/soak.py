@@ -0,0 +1,280 @@
+"""Memory and resource soak test for a long-running gateway process.
+
+Runs ``gateway.main:app`` in-process against a mock backend and drives it
+with many simulated users while the rate limiter's clock runs faster than
+wall time, so hours of traffic pass in minutes. RSS, ``tracemalloc`` top
+allocators, open file descriptors and sockets, upstream connections,
+database pool usage and rate-limiter state are sampled over time, and the
+run fails (exit code 1) when their growth after warm-up exceeds the
+configured thresholds.
+
+Usage:
+    python -m benchmarks.soak --users 20000 --rps 200 --duration 600 --speed 60
+    python -m benchmarks.soak --churn 5 --max-rss-growth-mb 50 --output bench_results/soak.json
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+import httpx
+
+from .common import (
+    ManagedService,
+    create_api_keys,
+    free_port,
+    process_stats,
+    run_metadata,
+    write_results,
+)
+from .mock_vllm import add_mock_arguments, mock_command_args
+
+
+class CompressedClock:
+    """Wall clock that runs ``speed`` times faster than real time."""
+
+    def __init__(self, speed: float):
+        self.speed = speed
+        self.start_wall = time.time()
+        self.start_monotonic = time.monotonic()
+
+    def __call__(self) -> float:
+        return self.start_wall + (time.monotonic() - self.start_monotonic) * self.speed
+
+    @property
+    def simulated_hours(self) -> float:
+        return (self() - self.start_wall) / 3600
+
+
+def _open_fds() -> Dict[str, int]:
+    """Open file descriptors of this process, and how many are sockets."""
+    fds = sockets = 0
+    fd_dir = "/proc/self/fd"
+    if not os.path.isdir(fd_dir):
+        return {}
+    for name in os.listdir(fd_dir):
+        try:
+            target = os.readlink(os.path.join(fd_dir, name))
+        except OSError:
+            continue
+        fds += 1
+        if target.startswith("socket:"):
+            sockets += 1
+    return {"open_fds": fds, "open_sockets": sockets}
+
+
+def _upstream_connections(client: httpx.AsyncClient) -> int:
+    """Connections held by the gateway's shared httpx client pool."""
+    try:
+        return len(client._transport._pool.connections)
+    except AttributeError:
+        return -1
+
+
+def sample(gateway, clock: CompressedClock, requests_sent: int) -> Dict:
+    """One point of the resource time series."""
+    from shared.database import engine
+
+    _, rss = process_stats(os.getpid())
+    traced, traced_peak = tracemalloc.get_traced_memory()
+    limiter = gateway.rate_limiter
+    point = {
+        "elapsed_s": round(time.monotonic() - clock.start_monotonic, 1),
+        "simulated_hours": round(clock.simulated_hours, 2),
+        "requests": requests_sent,
+        "rss_mb": round(rss / (1024 * 1024), 2),
+        "traced_mb": round(traced / (1024 * 1024), 2),
+        "traced_peak_mb": round(traced_peak / (1024 * 1024), 2),
+        "gc_objects": len(gc.get_objects()),
+        "upstream_connections": _upstream_connections(gateway.http_client),
+        "db_pool_checked_out": engine.pool.checkedout() if hasattr(engine.pool, "checkedout") else -1,
+        "rate_limiter_users": len(limiter.request_history),
+        "rate_limiter_timestamps": sum(len(h) for h in limiter.request_history.values()),
+    }
+    point.update(_open_fds())
+    return point
+
+
+def top_growth(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, limit: int) -> List[Dict]:
+    """Allocation sites whose retained memory grew the most."""
+    stats = after.compare_to(before, "lineno")
+    return [
+        {
+            "location": str(stat.traceback),
+            "size_diff_kb": round(stat.size_diff / 1024, 1),
+            "count_diff": stat.count_diff,
+            "size_kb": round(stat.size / 1024, 1),
+        }
+        for stat in stats[:limit]
+        if stat.size_diff > 0
+    ]
+
+
+def check_thresholds(baseline: Dict, final: Dict, args: argparse.Namespace) -> List[str]:
+    """Growth between the post-warm-up baseline and the final sample that exceeds a threshold."""
+    checks = [
+        ("rss_mb", args.max_rss_growth_mb),
+        ("traced_mb", args.max_traced_growth_mb),
+        ("open_fds", args.max_fd_growth),
+        ("open_sockets", args.max_fd_growth),
+        ("upstream_connections", args.max_connection_growth),
+        ("rate_limiter_users", args.max_tracked_users_growth),
+    ]
+    failures = []
+    for metric, limit in checks:
+        if limit is None or metric not in baseline or metric not in final:
+            continue
+        growth = final[metric] - baseline[metric]
+        if growth > limit:
+            failures.append(f"{metric} grew by {growth:g} (limit {limit:g})")
+    return failures
+
+
+async def soak(args: argparse.Namespace, keys: List[str]) -> Dict:
+    from gateway import main as gateway
+
+    clock = CompressedClock(args.speed)
+    gateway.rate_limiter.clock = clock
+    rng = random.Random(args.seed)
+
+    await gateway.app.router.startup()
+    transport = httpx.ASGITransport(app=gateway.app, raise_app_exceptions=False)
+    payload = {
+        "model": "meta-llama/Llama-2-7b-chat-hf",
+        "messages": [{"role": "user", "content": "word " * 32}],
+        "max_tokens": 16,
+    }
+    series: List[Dict] = []
+    statuses: Dict[str, int] = {}
+    requests_sent = 0
+    in_flight = set()
+    semaphore = asyncio.Semaphore(args.max_in_flight)
+
+    async def one(client, key):
+        try:
+            response = await client.post(
+                "/v1/chat/completions", json=payload, headers={"Authorization": f"Bearer {key}"}
+            )
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        except Exception as e:
+            statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+        finally:
+            semaphore.release()
+
+    tracemalloc.start(args.traceback_depth)
+    baseline = baseline_snapshot = None
+    start = time.monotonic()
+    next_sample = start
+    next_churn = start + args.churn_interval
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway", timeout=60.0) as client:
+            interval = 1 / args.rps
+            while time.monotonic() - start < args.duration:
+                now = time.monotonic()
+                if args.churn and now >= next_churn:
+                    # Self-service key churn: new principals keep arriving
+                    new_users = {f"churn-{len(keys) + i}@company.com": "standard" for i in range(args.churn)}
+                    keys.extend((await asyncio.to_thread(create_api_keys, new_users)).values())
+                    next_churn = now + args.churn_interval
+                if now >= next_sample:
+                    gc.collect()
+                    point = sample(gateway, clock, requests_sent)
+                    series.append(point)
+                    if baseline is None and now - start >= args.warmup:
+                        baseline = point
+                        baseline_snapshot = tracemalloc.take_snapshot()
+                    print(
+                        f"  t={point['elapsed_s']:>6}s sim={point['simulated_hours']:>6.2f}h "
+                        f"rss={point['rss_mb']:>7.1f}MB traced={point['traced_mb']:>6.1f}MB "
+                        f"fds={point.get('open_fds', -1):>4} limiter_users={point['rate_limiter_users']}"
+                    )
+                    next_sample = now + args.sample_interval
+
+                await semaphore.acquire()
+                task = asyncio.create_task(one(client, rng.choice(keys)))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                requests_sent += 1
+                await asyncio.sleep(max(0.0, start + requests_sent * interval - time.monotonic()))
+            if in_flight:
+                await asyncio.gather(*in_flight)
+
+        gc.collect()
+        final = sample(gateway, clock, requests_sent)
+        series.append(final)
+        final_snapshot = tracemalloc.take_snapshot()
+        baseline = baseline or series[0]
+        baseline_snapshot = baseline_snapshot or final_snapshot
+        growth = top_growth(baseline_snapshot, final_snapshot, args.top_allocators)
+        top_now = [
+            {"location": str(stat.traceback), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+            for stat in final_snapshot.statistics("lineno")[: args.top_allocators]
+        ]
+    finally:
+        tracemalloc.stop()
+        await gateway.app.router.shutdown()
+
+    return {
+        "statuses": statuses,
+        "baseline": baseline,
+        "final": final,
+        "series": series,
+        "top_allocators": top_now,
+        "top_growth": growth,
+        "failures": check_thresholds(baseline, final, args),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway memory and resource soak test")
+    parser.add_argument("--users", type=int, default=5000, help="Simulated users, one API key each")
+    parser.add_argument("--rps", type=float, default=100.0, help="Request rate in wall-clock time")
+    parser.add_argument("--duration", type=float, default=300.0, help="Wall-clock seconds to run")
+    parser.add_argument("--speed", type=float, default=60.0, help="Rate limiter clock speed-up")
+    parser.add_argument("--churn", type=int, default=0, help="New users created every churn interval")
+    parser.add_argument("--churn-interval", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=30.0, help="Seconds before the growth baseline")
+    parser.add_argument("--sample-interval", type=float, default=10.0)
+    parser.add_argument("--max-in-flight", type=int, default=32)
+    parser.add_argument("--traceback-depth", type=int, default=1)
+    parser.add_argument("--top-allocators", type=int, default=15)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=100.0)
+    parser.add_argument("--max-traced-growth-mb", type=float, default=50.0)
+    parser.add_argument("--max-fd-growth", type=float, default=50.0)
+    parser.add_argument("--max-connection-growth", type=float, default=50.0)
+    parser.add_argument("--max-tracked-users-growth", type=float, default=None,
+                        help="Fail if the rate limiter tracks this many more principals than at baseline")
+    parser.add_argument("--output", default="bench_results/soak.json")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    # The gateway is imported in-process, so configure it through the environment first
+    workdir = tempfile.mkdtemp(prefix="gateway-soak-")
+    mock_port = free_port()
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/soak.db"
+    os.environ["LLM_BACKEND_URL"] = f"http://127.0.0.1:{mock_port}"
+    keys = list(create_api_keys({f"soak-{i}@company.com": "standard" for i in range(args.users)}).values())
+
+    with ManagedService("mock-vllm", mock_command_args(args, mock_port), mock_port):
+        report = asyncio.run(soak(args, keys))
+
+    write_results(args.output, {
+        "benchmark": "soak",
+        "metadata": run_metadata(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        **report,
+    })
+    if report["failures"]:
+        print("FAIL: " + "; ".join(report["failures"]))
+        sys.exit(1)
+    print("PASS: resource growth within thresholds")
+
+
+if __name__ == "__main__":
+    main()
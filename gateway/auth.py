@@ -4,29 +4,34 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from datetime import datetime
 from typing import Optional
-from fastapi import HTTPException, Security, status, Depends
+from fastapi import HTTPException, Security, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from pydantic import BaseModel
 
-from shared.database import get_db
-from shared import crud
+from shared.async_database import AsyncSessionLocal
+from shared import async_crud, crud
+from shared.config import settings
+from .key_cache import KeyCache
 
 security = HTTPBearer(auto_error=False)
 
+# Validated keys, evicted on admin changes (see gateway.main for the invalidation channels)
+key_cache = KeyCache(ttl_seconds=settings.key_cache_ttl_seconds, max_entries=settings.key_cache_max_entries)
+
 
 class APIKeyInfo(BaseModel):
     """API key information after validation."""
     key_id: int
-    key: str
+    key_prefix: str
     user_id: str
     tier: str
 
 
-def verify_api_key(
+async def verify_api_key(
     credentials: Optional[HTTPAuthorizationCredentials] = Security(security),
-    db: Session = Depends(get_db),
 ) -> APIKeyInfo:
     """
     Verify API key from Authorization header.
@@ -46,37 +51,54 @@ def verify_api_key(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    api_key = credentials.credentials
+    return await lookup_api_key(credentials.credentials)
 
-    # Look up API key in database
-    db_key = crud.get_api_key(db, api_key)
 
-    if not db_key:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid API key. Please check your credentials.",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+async def lookup_api_key(api_key: str, session_factory: async_sessionmaker = AsyncSessionLocal) -> APIKeyInfo:
+    """
+    Validate an API key.
 
-    # Check if key is active
-    if not db_key.is_active:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="API key has been deactivated.",
-            headers={"WWW-Authenticate": "Bearer"},
+    Keys are looked up by digest in the key cache first, so the database is
+    only read (asynchronously) on a cache miss.
+
+    Raises:
+        HTTPException: If the key is unknown or deactivated (both found as
+            no active key with its digest) or expired
+    """
+    key_hash = crud.hash_api_key(api_key)
+
+    cached = key_cache.get(key_hash)
+    if cached is not None:
+        info, expires_at = cached.info, cached.expires_at
+    else:
+        generation = key_cache.generation
+
+        # Look up API key in database
+        async with session_factory() as db:
+            db_key = await async_crud.get_api_key_by_hash(db, key_hash)
+
+        if not db_key:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid API key. Please check your credentials.",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        info = APIKeyInfo(
+            key_id=db_key.id,
+            key_prefix=db_key.key_prefix,
+            user_id=db_key.user_id,
+            tier=db_key.tier,
         )
+        expires_at = db_key.expires_at
+        key_cache.put(key_hash, info, expires_at, generation)
 
     # Check expiration
-    if db_key.expires_at and db_key.expires_at < db_key.updated_at:
+    if expires_at and expires_at < datetime.utcnow():
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="API key has expired.",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    return APIKeyInfo(
-        key_id=db_key.id,
-        key=db_key.key,
-        user_id=db_key.user_id,
-        tier=db_key.tier,
-    )
+    return info
@@ -0,0 +1,525 @@
+"""Asynchronous batch inference for Gateway.
+
+Clients upload a JSONL file of requests (POST /v1/files) and create a batch
+from it (POST /v1/batches), as in the OpenAI Batch API. Files are stored
+under BATCH_DIR and batches in the ``batches`` table. A background runner
+works through the batches one at a time with bounded concurrency: fewer
+requests at once during BATCH_PEAK_HOURS, and backing off further while
+interactive requests are in flight. Results are appended to the batch's
+output and error files as they finish, so they can be read while the batch
+runs, and a batch interrupted by a restart resumes after its last written
+result.
+"""
+import asyncio
+import json
+import os
+import secrets
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from fastapi import HTTPException
+from sqlalchemy import or_, select, update
+
+from shared import async_crud
+from shared.async_database import AsyncSessionLocal
+from shared.config import settings
+from shared.models import Batch, BatchFile
+from .auth import APIKeyInfo
+from .idempotency import StoredResponse
+from .rate_limit_sync import default_node_id
+
+ENDPOINTS = ("/v1/chat/completions", "/v1/completions", "/v1/embeddings")
+COMPLETION_WINDOWS = {"24h": timedelta(hours=24)}
+UNFINISHED = ("in_progress", "cancelling")
+LEASE_SECONDS = 60  # A batch is taken over this long after its gateway stopped renewing the lease
+PROGRESS_SECONDS = 2.0  # Counts are saved and the lease renewed this often
+BACKOFF_SECONDS = 1.0  # Concurrency is adjusted to the interactive load this often
+IDLE_POLL_SECONDS = 10.0  # Batches left by stopped gateways are looked for this often
+RETRY_SECONDS = 10.0  # Pause after a 429 without Retry-After
+
+# Runs one batch request: (key, url, body, start time) -> backend response
+Execute = Callable[[APIKeyInfo, str, bytes, float], Awaitable[StoredResponse]]
+
+
+class BatchValidationError(ValueError):
+    """A batch input file or batch request is invalid."""
+
+
+def new_id(prefix: str) -> str:
+    return f"{prefix}{secrets.token_hex(12)}"
+
+
+def file_path(file_id: str) -> str:
+    """Where a batch file is stored."""
+    return os.path.join(settings.batch_dir, f"{file_id}.jsonl")
+
+
+def validate_input_file(path: str, max_requests: int) -> Tuple[int, Set[str]]:
+    """
+    Check every line of a batch input file.
+
+    Returns:
+        Number of requests and the set of endpoint URLs they use
+
+    Raises:
+        BatchValidationError: On the first invalid line
+    """
+    custom_ids = set()
+    urls = set()
+    with open(path, "rb") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                raise BatchValidationError(f"Line {line_no}: not valid JSON")
+            if not isinstance(item, dict):
+                raise BatchValidationError(f"Line {line_no}: expected a JSON object")
+            custom_id = item.get("custom_id")
+            if not isinstance(custom_id, str) or not custom_id:
+                raise BatchValidationError(f"Line {line_no}: custom_id must be a non-empty string")
+            if custom_id in custom_ids:
+                raise BatchValidationError(f"Line {line_no}: duplicate custom_id '{custom_id}'")
+            if item.get("method") != "POST":
+                raise BatchValidationError(f"Line {line_no}: method must be POST")
+            if item.get("url") not in ENDPOINTS:
+                raise BatchValidationError(f"Line {line_no}: url must be one of {', '.join(ENDPOINTS)}")
+            if not isinstance(item.get("body"), dict):
+                raise BatchValidationError(f"Line {line_no}: body must be a JSON object")
+            custom_ids.add(custom_id)
+            urls.add(item["url"])
+            if len(custom_ids) > max_requests:
+                raise BatchValidationError(f"A batch can have at most {max_requests} requests")
+    if not custom_ids:
+        raise BatchValidationError("The file has no requests")
+    return len(custom_ids), urls
+
+
+def read_progress(paths: List[str]) -> Tuple[Set[str], List[int]]:
+    """
+    custom_ids already written to a batch's result files, and the number of
+    lines per file.
+
+    A line cut short by a crash is truncated, so appending resumes on a
+    line boundary.
+    """
+    done = set()
+    lines = []
+    for path in paths:
+        count = 0
+        if os.path.exists(path):
+            with open(path, "r+b") as f:
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+                if end < len(data):
+                    f.truncate(end)
+                for line in data[:end].splitlines():
+                    if line.strip():
+                        done.add(json.loads(line)["custom_id"])
+                        count += 1
+        lines.append(count)
+    return done, lines
+
+
+async def current_key(db, batch: Batch) -> Optional[APIKeyInfo]:
+    """The batch's API key as it is now, None if it was deleted, deactivated (or rotated) or expired."""
+    db_key = await async_crud.get_api_key_by_id(db, batch.api_key_id)
+    if db_key is None or not db_key.is_active:
+        return None
+    if db_key.expires_at and db_key.expires_at < datetime.utcnow():
+        return None
+    return APIKeyInfo(key_id=db_key.id, key_prefix=db_key.key_prefix, user_id=db_key.user_id, tier=db_key.tier)
+
+
+def retry_after(e: HTTPException) -> float:
+    """Seconds to wait after a 429, from its Retry-After header."""
+    try:
+        return max(0.0, float((e.headers or {}).get("Retry-After", RETRY_SECONDS)))
+    except ValueError:
+        return RETRY_SECONDS
+
+
+def parse_hours(hours: str) -> Optional[Tuple[int, int]]:
+    """(start, end) hour of a "9-18" style range, None if empty."""
+    if not hours:
+        return None
+    start, end = (int(h) for h in hours.split("-"))
+    return start, end
+
+
+def in_hours(hours: Optional[Tuple[int, int]], hour: int) -> bool:
+    if hours is None:
+        return False
+    start, end = hours
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[int]:
+    return int((value - datetime(1970, 1, 1)).total_seconds()) if value else None
+
+
+def file_object(row: BatchFile) -> dict:
+    """OpenAI file object of a batch file."""
+    path = file_path(row.id)
+    return {
+        "id": row.id,
+        "object": "file",
+        "bytes": os.path.getsize(path) if os.path.exists(path) else 0,
+        "created_at": _timestamp(row.created_at),
+        "filename": row.filename,
+        "purpose": row.purpose,
+    }
+
+
+def batch_object(row: Batch, counts: Optional[Dict[str, int]] = None) -> dict:
+    """OpenAI batch object; ``counts`` overrides the saved counts of a running batch."""
+    counts = counts or {"completed": row.completed, "failed": row.failed}
+    finished = _timestamp(row.finished_at)
+    return {
+        "id": row.id,
+        "object": "batch",
+        "endpoint": row.endpoint,
+        "errors": json.loads(row.errors) if row.errors else None,
+        "input_file_id": row.input_file_id,
+        "completion_window": row.completion_window,
+        "status": row.status,
+        "output_file_id": row.output_file_id,
+        "error_file_id": row.error_file_id,
+        "created_at": _timestamp(row.created_at),
+        "in_progress_at": _timestamp(row.in_progress_at),
+        "expires_at": _timestamp(row.created_at + COMPLETION_WINDOWS[row.completion_window]),
+        "completed_at": finished if row.status == "completed" else None,
+        "failed_at": finished if row.status == "failed" else None,
+        "expired_at": finished if row.status == "expired" else None,
+        "cancelling_at": _timestamp(row.cancelling_at),
+        "cancelled_at": finished if row.status == "cancelled" else None,
+        "request_counts": {"total": row.total, "completed": counts["completed"], "failed": counts["failed"]},
+        "metadata": json.loads(row.batch_metadata) if row.batch_metadata else None,
+    }
+
+
+class BatchRunner:
+    """
+    Background worker running batches, oldest first, one at a time.
+
+    Requests run concurrently up to BATCH_CONCURRENCY, or
+    BATCH_PEAK_CONCURRENCY during BATCH_PEAK_HOURS. While at least
+    BATCH_INTERACTIVE_THRESHOLD interactive requests are in flight the limit
+    is halved every second, down to pausing the batch; once the load drops it
+    grows back by one request per second.
+
+    A batch is claimed with a lease in the database, so with several gateway
+    processes each batch runs on one of them. A request that was running when
+    the gateway stopped is run again on resume.
+
+    A request rejected with 429 (a quota used up, or the backend's rate
+    limit) is not recorded: the batch stops starting requests and is put
+    aside until its Retry-After has passed (at most until it expires), so
+    other batches can run meanwhile; it resumes with the rejected requests.
+
+    The batch's API key is read again when the batch is claimed and every
+    PROGRESS_SECONDS; requests run at its current tier, and the batch fails
+    once the key is deactivated, rotated, expired or deleted.
+    """
+
+    def __init__(
+        self,
+        execute: Execute,
+        concurrency: int = 4,
+        peak_concurrency: int = 1,
+        peak_hours: str = "",
+        interactive_threshold: int = 8,
+        node_id: str = "",
+    ):
+        self.execute = execute
+        self.concurrency = concurrency
+        self.peak_concurrency = peak_concurrency
+        self.peak_hours = parse_hours(peak_hours)
+        self.interactive_threshold = interactive_threshold
+        self.node_id = node_id or default_node_id()
+
+        self.interactive_in_flight = 0
+        self.limit = concurrency
+        self.adjusted_at = 0.0
+        self.current: Optional[str] = None
+        self.key: Optional[APIKeyInfo] = None  # API key of the running batch, as last read
+        self.counts: Dict[str, int] = {}
+        self.cancelled: Set[str] = set()
+        self.revoked: Set[str] = set()  # Running batches whose key is no longer valid
+        self.resume_at: Optional[datetime] = None  # Set by a 429: the running batch pauses until then
+        self.wakeup = asyncio.Event()
+        self.requests_run = 0
+        self.throttled = 0  # Requests rejected with 429, to be run again
+
+    @contextmanager
+    def interactive(self):
+        """Count an interactive request as in flight, for the batch backoff."""
+        self.interactive_in_flight += 1
+        try:
+            yield
+        finally:
+            self.interactive_in_flight -= 1
+
+    def base_concurrency(self) -> int:
+        return self.peak_concurrency if in_hours(self.peak_hours, datetime.now().hour) else self.concurrency
+
+    def adjust(self) -> int:
+        """Concurrency limit for the current interactive load."""
+        now = time.monotonic()
+        if now - self.adjusted_at >= BACKOFF_SECONDS:
+            self.adjusted_at = now
+            busy = self.interactive_threshold and self.interactive_in_flight >= self.interactive_threshold
+            self.limit = self.limit // 2 if busy else self.limit + 1
+        self.limit = min(self.limit, self.base_concurrency())
+        return self.limit
+
+    async def run(self) -> None:
+        """Run batches as they are created or left over by stopped gateways, until cancelled."""
+        while True:
+            batch = None
+            try:
+                batch = await self.claim_next()
+                if batch is not None:
+                    await self.run_batch(batch)
+            except Exception as e:
+                print(f"Batch run failed: {e}")
+                if batch is not None:
+                    try:
+                        await self.finish(batch.id, "failed", errors=[{"code": "internal_error", "message": str(e)[:500]}])
+                    except Exception as e:
+                        print(f"Batch {batch.id} could not be marked failed: {e}")
+            # Left set when cancelled, for release()
+            self.current = None
+            self.key = None
+            if batch is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=IDLE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def claim_next(self) -> Optional[Batch]:
+        """Take the oldest unfinished batch whose files are here and whose lease is free."""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            candidates = (await db.execute(
+                select(Batch)
+                .where(Batch.status.in_(UNFINISHED), or_(Batch.lease_until.is_(None), Batch.lease_until < now))
+                .order_by(Batch.created_at)
+                .limit(100)
+            )).scalars().all()
+            for batch in candidates:
+                if not os.path.exists(file_path(batch.input_file_id)):
+                    continue  # Stored on another gateway
+                claimed = await db.execute(
+                    update(Batch)
+                    .where(Batch.id == batch.id, or_(Batch.lease_until.is_(None), Batch.lease_until < now))
+                    .values(
+                        claimed_by=self.node_id,
+                        lease_until=now + timedelta(seconds=LEASE_SECONDS),
+                        in_progress_at=batch.in_progress_at or now,
+                    )
+                )
+                await db.commit()
+                if claimed.rowcount == 1:
+                    await db.refresh(batch)
+                    return batch
+        return None
+
+    async def run_batch(self, batch: Batch) -> None:
+        output_path, error_path = file_path(batch.output_file_id), file_path(batch.error_file_id)
+        done, (completed, failed) = await asyncio.to_thread(read_progress, [output_path, error_path])
+        self.current = batch.id
+        self.counts = {"completed": completed, "failed": failed}
+        self.resume_at = None
+        if batch.status == "cancelling":
+            self.cancelled.add(batch.id)
+        expires_at = batch.created_at + COMPLETION_WINDOWS[batch.completion_window]
+        async with AsyncSessionLocal() as db:
+            self.key = await current_key(db, batch)
+        if self.key is None:
+            self.revoked.add(batch.id)
+
+        progress = asyncio.create_task(self.save_progress(batch))
+        running: Set[asyncio.Task] = set()
+        expired = False
+        try:
+            with open(file_path(batch.input_file_id), "rb") as requests, \
+                    open(output_path, "ab") as output, open(error_path, "ab") as errors:
+                for line in requests:
+                    if not line.strip():
+                        continue
+                    item = json.loads(line)
+                    if item["custom_id"] in done:
+                        continue
+                    # Wait for a free slot at the current concurrency
+                    while True:
+                        if batch.id in self.cancelled or batch.id in self.revoked or self.resume_at:
+                            break
+                        if datetime.utcnow() >= expires_at:
+                            expired = True
+                            break
+                        if len(running) < self.adjust():
+                            break
+                        if running:
+                            await asyncio.wait(running, timeout=BACKOFF_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                        else:
+                            await asyncio.sleep(BACKOFF_SECONDS)
+                    if batch.id in self.cancelled or batch.id in self.revoked or self.resume_at or expired:
+                        break
+                    task = asyncio.create_task(self.run_request(self.key, item, output, errors))
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+                if running:
+                    await asyncio.gather(*running)
+        finally:
+            progress.cancel()
+            for task in running:
+                task.cancel()
+
+        if batch.id in self.revoked:
+            self.revoked.discard(batch.id)
+            self.cancelled.discard(batch.id)
+            await self.finish(batch.id, "failed", errors=[{
+                "code": "invalid_api_key",
+                "message": "The API key of this batch was deactivated, rotated, expired or deleted.",
+            }])
+            return
+        if batch.id in self.cancelled:
+            status = "cancelled"
+            self.cancelled.discard(batch.id)
+        elif self.resume_at and not expired:
+            await self.pause(batch.id, min(self.resume_at, expires_at))
+            return
+        else:
+            status = "expired" if expired else "completed"
+        await self.finish(batch.id, status)
+
+    async def run_request(self, key: APIKeyInfo, item: dict, output, errors) -> None:
+        """Run one batch request and append its result to the output or error file."""
+        start = time.time()
+        body = json.dumps(item["body"]).encode()
+        response, error = None, None
+        try:
+            stored = await self.execute(key, item["url"], body, start)
+            if stored.status_code == 429:
+                self.throttle(RETRY_SECONDS)
+                return
+            try:
+                content = json.loads(stored.content)
+            except ValueError:
+                content = stored.content.decode(errors="replace")
+            response = {"status_code": stored.status_code, "request_id": new_id("req_"), "body": content}
+        except HTTPException as e:
+            if e.status_code == 429:
+                self.throttle(retry_after(e))
+                return
+            error = {"code": str(e.status_code), "message": str(e.detail)}
+
+        succeeded = response is not None and response["status_code"] < 400
+        record = {"id": new_id("batch_req_"), "custom_id": item["custom_id"], "response": response, "error": error}
+        target = output if succeeded else errors
+        target.write(json.dumps(record).encode() + b"\n")
+        target.flush()
+        self.counts["completed" if succeeded else "failed"] += 1
+        self.requests_run += 1
+
+    def throttle(self, seconds: float) -> None:
+        """Put a rejected request back and pause the running batch for ``seconds``."""
+        self.throttled += 1
+        until = datetime.utcnow() + timedelta(seconds=seconds)
+        self.resume_at = max(self.resume_at, until) if self.resume_at else until
+
+    async def save_progress(self, batch: Batch) -> None:
+        """
+        Save the counts and renew the lease every PROGRESS_SECONDS; picks up
+        cancellations and changes to the batch's API key.
+        """
+        batch_id = batch.id
+        while True:
+            await asyncio.sleep(PROGRESS_SECONDS)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(Batch)
+                        .where(Batch.id == batch_id)
+                        .values(
+                            completed=self.counts["completed"],
+                            failed=self.counts["failed"],
+                            lease_until=datetime.utcnow() + timedelta(seconds=LEASE_SECONDS),
+                        )
+                    )
+                    await db.commit()
+                    status = (await db.execute(select(Batch.status).where(Batch.id == batch_id))).scalar()
+                    key = await current_key(db, batch)
+                if status == "cancelling":
+                    self.cancelled.add(batch_id)
+                if key is None:
+                    self.revoked.add(batch_id)
+                else:
+                    self.key = key
+            except Exception as e:
+                print(f"Batch progress save failed: {e}")
+
+    async def finish(self, batch_id: str, status: str, errors: Optional[list] = None) -> None:
+        """Save a batch's final status and counts and release its lease."""
+        values = {"status": status, "finished_at": datetime.utcnow(), "claimed_by": None, "lease_until": None}
+        if self.current == batch_id:
+            values.update(completed=self.counts["completed"], failed=self.counts["failed"])
+        if errors:
+            values["errors"] = json.dumps({"object": "list", "data": errors})
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Batch).where(Batch.id == batch_id).values(**values))
+            await db.commit()
+
+    async def pause(self, batch_id: str, until: datetime) -> None:
+        """Save a batch's counts and set it aside until ``until``, when any gateway may resume it."""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Batch)
+                .where(Batch.id == batch_id)
+                .values(
+                    completed=self.counts["completed"],
+                    failed=self.counts["failed"],
+                    claimed_by=None,
+                    lease_until=until,
+                )
+            )
+            await db.commit()
+
+    async def release(self) -> None:
+        """Give up the lease of the running batch, so it resumes right after a restart."""
+        if self.current is None:
+            return
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Batch)
+                .where(Batch.id == self.current, Batch.claimed_by == self.node_id)
+                .values(
+                    completed=self.counts["completed"],
+                    failed=self.counts["failed"],
+                    claimed_by=None,
+                    lease_until=None,
+                )
+            )
+            await db.commit()
+
+    def live_counts(self, batch_id: str) -> Optional[Dict[str, int]]:
+        """Counts of a batch running here, more recent than the saved ones."""
+        return dict(self.counts) if batch_id == self.current else None
+
+    def stats(self) -> dict:
+        return {
+            "current_batch": self.current,
+            "concurrency_limit": self.limit,
+            "interactive_in_flight": self.interactive_in_flight,
+            "requests_run": self.requests_run,
+            "throttled": self.throttled,
+        }
@@ -0,0 +1,147 @@
+"""Idempotency-Key handling for Gateway."""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple, Union
+
+# (API key ID, Idempotency-Key header)
+IdempotencyScope = Tuple[int, str]
+
+MAX_KEY_LENGTH = 255
+
+
+class StoredResponse(NamedTuple):
+    status_code: int
+    content: bytes
+    media_type: Optional[str]
+
+
+class CompletedEntry(NamedTuple):
+    fingerprint: bytes
+    response: StoredResponse
+    expires_at: float
+
+
+class InFlightEntry(NamedTuple):
+    fingerprint: bytes
+    task: asyncio.Task
+
+
+def request_fingerprint(method: str, path: str, body: bytes) -> bytes:
+    """Digest of a request, so a key reused for a different request is detected."""
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), body):
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.digest()
+
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was already used for a different request."""
+
+
+class IdempotencyStore:
+    """
+    Upstream calls by API key and Idempotency-Key, so client retries do not
+    start another generation.
+
+    A call runs as its own task: a retry that arrives while it is running
+    waits for the same task, and the original keeps running if its client
+    disconnects. Completed responses are kept for ``ttl_seconds`` after they
+    finish, within ``max_entries`` and ``max_bytes``; the oldest are dropped
+    first. Failed calls and upstream 5xx responses are not kept, so they can
+    be retried. Entries are per gateway process.
+
+    Call from the event loop only.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 600,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.in_flight: Dict[IdempotencyScope, InFlightEntry] = {}
+        self.completed: Dict[IdempotencyScope, CompletedEntry] = OrderedDict()  # Oldest first
+        self.bytes = 0
+        self.started = 0
+        self.attached = 0  # Retries that waited for a running call
+        self.replayed = 0  # Retries answered from a completed call
+        self.evicted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def lookup(self, scope: IdempotencyScope, fingerprint: bytes) -> Union[StoredResponse, asyncio.Task, None]:
+        """
+        The completed response or the running call for a key, None if there
+        is neither.
+
+        Raises:
+            IdempotencyConflict: If the key was used for a different request
+        """
+        self._expire()
+        entry = self.completed.get(scope) or self.in_flight.get(scope)
+        if entry is None:
+            return None
+        if entry.fingerprint != fingerprint:
+            raise IdempotencyConflict(scope[1])
+        if isinstance(entry, CompletedEntry):
+            self.replayed += 1
+            return entry.response
+        self.attached += 1
+        return entry.task
+
+    def start(
+        self, scope: IdempotencyScope, fingerprint: bytes, call: Awaitable[StoredResponse]
+    ) -> asyncio.Task:
+        """Run an upstream call as a task, to be found by lookup() until it expires."""
+        task = asyncio.ensure_future(call)
+        self.in_flight[scope] = InFlightEntry(fingerprint, task)
+        self.started += 1
+        task.add_done_callback(lambda done: self._finish(scope, fingerprint, done))
+        return task
+
+    def _finish(self, scope: IdempotencyScope, fingerprint: bytes, task: asyncio.Task) -> None:
+        self.in_flight.pop(scope, None)
+        if task.cancelled() or task.exception() is not None:  # Retrieved, so unawaited failures are not logged
+            return
+        response = task.result()
+        size = len(response.content)
+        if response.status_code >= 500 or size > self.max_bytes:
+            return
+        self.completed[scope] = CompletedEntry(fingerprint, response, self.clock() + self.ttl_seconds)
+        self.bytes += size
+        self._expire()
+
+    def _expire(self) -> None:
+        """Drop expired responses, then the oldest ones while over the bounds."""
+        now = self.clock()
+        completed = self.completed
+        while completed:
+            scope, entry = next(iter(completed.items()))
+            if entry.expires_at > now and len(completed) <= self.max_entries and self.bytes <= self.max_bytes:
+                break
+            del completed[scope]
+            self.bytes -= len(entry.response.content)
+            if entry.expires_at > now:
+                self.evicted += 1
+
+    def stats(self) -> dict:
+        return {
+            "completed": len(self.completed),
+            "in_flight": len(self.in_flight),
+            "bytes": self.bytes,
+            "started": self.started,
+            "attached": self.attached,
+            "replayed": self.replayed,
+            "evicted": self.evicted,
+            "ttl_seconds": self.ttl_seconds,
+        }
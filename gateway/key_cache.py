@@ -0,0 +1,116 @@
+"""In-memory API key cache for Gateway."""
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional
+
+
+class CachedKey(NamedTuple):
+    info: Any  # APIKeyInfo
+    expires_at: Optional[datetime]
+    cached_at: float
+
+
+class KeyCache:
+    """
+    Validated API keys by key digest.
+
+    Entries are evicted when the admin service reports a change to the key
+    (pushed to /internal/invalidate, or picked up from the config change
+    feed by the poller), and in any case after ``ttl_seconds``, which bounds
+    how stale an entry can get if both channels miss a change.
+
+    A lookup that misses the cache reads the database and then puts the
+    result; if an invalidation arrives in between, the put is dropped so a
+    key read just before its revocation is not cached after it.
+    """
+
+    def __init__(self, ttl_seconds: float = 60, max_entries: int = 100000, clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries: Dict[bytes, CachedKey] = {}
+        self.hashes_by_id: Dict[int, bytes] = {}
+        self.generation = 0  # Bumped by every invalidation
+        self.version = 0  # Last config change version applied
+        self.polled_at: Optional[datetime] = None  # When the change feed was last read
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def get(self, key_hash: bytes) -> Optional[CachedKey]:
+        """Cached entry for a key digest, None on a miss."""
+        entry = self.entries.get(key_hash)
+        if entry is None or self.clock() - entry.cached_at >= self.ttl_seconds:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key_hash: bytes, info: Any, expires_at: Optional[datetime], generation: int) -> bool:
+        """
+        Cache a key read from the database.
+
+        Args:
+            key_hash: Key digest
+            info: Validated key information
+            expires_at: Key expiry, checked on every hit
+            generation: self.generation from before the database read
+
+        Returns:
+            Whether the entry was cached
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            if generation != self.generation:
+                return False
+            if key_hash not in self.entries and len(self.entries) >= self.max_entries:
+                oldest = next(iter(self.entries))
+                self.hashes_by_id.pop(self.entries.pop(oldest).info.key_id, None)
+            self.entries[key_hash] = CachedKey(info, expires_at, self.clock())
+            self.hashes_by_id[info.key_id] = key_hash
+        return True
+
+    def invalidate(self, key_ids: Iterable[int]) -> int:
+        """Evict keys by ID; returns how many were cached."""
+        evicted = 0
+        with self._lock:
+            self.generation += 1
+            for key_id in key_ids:
+                key_hash = self.hashes_by_id.pop(key_id, None)
+                if key_hash is not None and self.entries.pop(key_hash, None) is not None:
+                    evicted += 1
+        return evicted
+
+    def clear(self) -> int:
+        """Evict everything; returns how many keys were cached."""
+        with self._lock:
+            self.generation += 1
+            evicted = len(self.entries)
+            self.entries.clear()
+            self.hashes_by_id.clear()
+        return evicted
+
+    def apply_changes(self, changes: Iterable[Any], polled_at: datetime) -> int:
+        """Evict the API keys named in config change rows and advance the version."""
+        key_ids = []
+        for change in changes:
+            if change.entity == "api_key":
+                key_ids.append(change.entity_id)
+            self.version = max(self.version, change.id)
+        self.polled_at = polled_at
+        return self.invalidate(key_ids) if key_ids else 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "version": self.version,
+            "ttl_seconds": self.ttl_seconds,
+        }
@@ -0,0 +1,79 @@
+"""Latency and TTFT quantile sketches for Gateway."""
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from typing import Callable, Dict, Optional
+from sqlalchemy.orm import Session
+
+from shared import crud
+from shared.crud import SketchKey
+from shared.sketches import DDSketch
+
+
+class LatencyRecorder:
+    """
+    In-memory latency and TTFT sketches per user, model and hour.
+
+    Requests are added to the current sketches and flush() merges them into
+    the database, so the per-request cost is a dictionary update and the
+    database sees one write per user/model/hour per flush interval.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, clock: Callable[[], float] = time.time):
+        self.relative_accuracy = relative_accuracy
+        self.clock = clock
+        self.sketches: Dict[SketchKey, DDSketch] = {}
+        self._lock = threading.Lock()
+
+    def _sketch(self, metric: str, bucket_start: datetime, user_id: str, model: str) -> DDSketch:
+        key = (metric, bucket_start, user_id, model)
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = DDSketch(self.relative_accuracy)
+        return sketch
+
+    def record(self, user_id: str, model: Optional[str], latency_ms: float, ttft_ms: Optional[float] = None) -> None:
+        """Record one request's total latency and time to first byte."""
+        bucket_start = datetime.utcfromtimestamp(self.clock()).replace(minute=0, second=0, microsecond=0)
+        model = model or ""
+        with self._lock:
+            self._sketch("latency", bucket_start, user_id, model).add(latency_ms)
+            if ttft_ms is not None:
+                self._sketch("ttft", bucket_start, user_id, model).add(ttft_ms)
+
+    def drain(self) -> Dict[SketchKey, DDSketch]:
+        """Take the sketches recorded since the last drain."""
+        with self._lock:
+            sketches, self.sketches = self.sketches, {}
+        return sketches
+
+    def flush(self, db: Session) -> int:
+        """
+        Merge recorded sketches into the database.
+
+        If the write fails the sketches are put back, so they are retried on
+        the next flush instead of being lost.
+
+        Returns:
+            Number of sketches written
+        """
+        sketches = self.drain()
+        if not sketches:
+            return 0
+        try:
+            crud.merge_latency_sketches(db, sketches)
+        except Exception:
+            with self._lock:
+                for key, sketch in sketches.items():
+                    current = self.sketches.get(key)
+                    if current is None:
+                        self.sketches[key] = sketch
+                    else:
+                        current.merge(sketch)
+            raise
+        return len(sketches)
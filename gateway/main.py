@@ -1,23 +1,46 @@
 """API Gateway - Handles authentication, rate limiting, and routing."""
+import os
 import sys
+import hmac
+import json
+import shutil
+import struct
 import time
+import asyncio
+from datetime import datetime, timedelta
 from pathlib import Path
 
 # Add parent directory to path for shared imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from typing import Optional
-from fastapi import FastAPI, Request, HTTPException, status, Depends
+from typing import Dict, List, Optional, Tuple, Union
+from fastapi import FastAPI, Request, HTTPException, status, Depends, Header, File, Form, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import Response, JSONResponse, FileResponse
 import httpx
-from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from sqlalchemy import select, update
 
-from shared.database import get_db, init_db
-from shared import crud
+from shared.database import SessionLocal, init_db, pool_stats
+from shared.async_database import AsyncSessionLocal, async_engine
+from shared import async_crud
 from shared.config import settings
+from shared.models import Batch, BatchFile
 from .rate_limiter import RateLimiter
-from .auth import verify_api_key, APIKeyInfo
+from .rate_limit_sync import create_rate_limit_sync
+from .auth import verify_api_key, APIKeyInfo, key_cache
+from .latency import LatencyRecorder
+from .quota_tracker import QuotaTracker
+from . import batches
+from .batches import BatchRunner, BatchValidationError
+from .semantic_cache import create_semantic_cache
+from .idempotency import (
+    MAX_KEY_LENGTH,
+    IdempotencyConflict,
+    IdempotencyStore,
+    StoredResponse,
+    request_fingerprint,
+)
 
 app = FastAPI(title="LLM API Gateway", version="1.0.0")
 
@@ -30,23 +53,248 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Rate limiter
-rate_limiter = RateLimiter()
+# Rate limiter, sharing its limits with the other gateways when RATE_LIMIT_MODE=shared
+rate_limit_sync = create_rate_limit_sync()
+rate_limiter = RateLimiter(max_principals=settings.rate_limit_max_principals, sync=rate_limit_sync)
+
+# Latency / TTFT sketches, flushed to the database periodically
+latency_recorder = LatencyRecorder(relative_accuracy=settings.latency_sketch_relative_accuracy)
+
+# Organization / team / user / key quotas, counted in memory and flushed periodically
+quota_tracker = QuotaTracker()
+
+# Upstream calls by Idempotency-Key, so client retries reuse them
+idempotency_store = IdempotencyStore(
+    ttl_seconds=settings.idempotency_ttl_seconds,
+    max_entries=settings.idempotency_max_entries,
+    max_bytes=settings.idempotency_max_bytes,
+)
 
 # HTTP client for proxying requests
 http_client = httpx.AsyncClient(timeout=300.0)
 
 
+async def embed_prompt(text: str) -> List[float]:
+    """Embedding of a prompt from the LLM backend's /v1/embeddings."""
+    payload = {"input": text}
+    if settings.semantic_cache_embedding_model:
+        payload["model"] = settings.semantic_cache_embedding_model
+    response = await http_client.post(
+        f"{settings.llm_backend_url}/v1/embeddings",
+        json=payload,
+        timeout=settings.semantic_cache_embedding_timeout_seconds,
+    )
+    response.raise_for_status()
+    return response.json()["data"][0]["embedding"]
+
+
+# Responses to near-duplicate prompts, when SEMANTIC_CACHE_ENABLED
+semantic_cache = create_semantic_cache(embed_prompt)
+
+
+def flush_latency_sketches() -> int:
+    """Write recorded latency sketches to the database."""
+    db = SessionLocal()
+    try:
+        return latency_recorder.flush(db)
+    finally:
+        db.close()
+
+
+async def latency_sketch_flusher():
+    """Background task flushing latency sketches every LATENCY_SKETCH_FLUSH_SECONDS."""
+    while True:
+        await asyncio.sleep(settings.latency_sketch_flush_seconds)
+        try:
+            await asyncio.to_thread(flush_latency_sketches)
+        except Exception as e:
+            print(f"Latency sketch flush failed: {e}")
+
+
+def flush_quota_usage() -> int:
+    """Add counted quota usage to the database and reload quotas and totals."""
+    db = SessionLocal()
+    try:
+        return quota_tracker.flush(db)
+    finally:
+        db.close()
+
+
+async def quota_usage_flusher():
+    """Background task flushing quota usage every QUOTA_FLUSH_SECONDS."""
+    while True:
+        await asyncio.sleep(settings.quota_flush_seconds)
+        try:
+            await asyncio.to_thread(flush_quota_usage)
+        except Exception as e:
+            print(f"Quota usage flush failed: {e}")
+
+
+def snapshot_rate_limiter() -> None:
+    """Save the rate limiter state to RATE_LIMIT_SNAPSHOT_PATH."""
+    start = time.perf_counter()
+    users = rate_limiter.snapshot(settings.rate_limit_snapshot_path)
+    app.state.rate_limit_snapshot = {
+        "users": users,
+        "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+        "saved_at": datetime.utcnow().isoformat(),
+    }
+
+
+async def rate_limiter_snapshotter():
+    """Background task saving the rate limiter state every RATE_LIMIT_SNAPSHOT_SECONDS."""
+    while True:
+        await asyncio.sleep(settings.rate_limit_snapshot_seconds)
+        try:
+            await asyncio.to_thread(snapshot_rate_limiter)
+        except Exception as e:
+            print(f"Rate limiter snapshot failed: {e}")
+
+
+# Idle users evicted per step of the sweep, between which requests are served
+RATE_LIMIT_EVICTION_CHUNK = 10000
+
+
+async def rate_limiter_sweeper():
+    """Background task evicting idle rate limiter state every RATE_LIMIT_SWEEP_SECONDS."""
+    while True:
+        await asyncio.sleep(settings.rate_limit_sweep_seconds)
+        try:
+            # Eviction must run on the event loop, which owns the histories
+            while rate_limiter.evict_idle(max_evictions=RATE_LIMIT_EVICTION_CHUNK) == RATE_LIMIT_EVICTION_CHUNK:
+                await asyncio.sleep(0)
+            app.state.rate_limit_memory = await asyncio.to_thread(rate_limiter.memory_usage)
+        except Exception as e:
+            print(f"Rate limiter sweep failed: {e}")
+
+
+def sync_rate_limits() -> int:
+    """Exchange request counts with the other gateways and rebalance this node's shares."""
+    db = SessionLocal()
+    try:
+        return rate_limit_sync.sync(db, rate_limiter.request_history)
+    finally:
+        db.close()
+
+
+async def rate_limit_syncer():
+    """Background task syncing shared rate limits every RATE_LIMIT_SYNC_SECONDS."""
+    while True:
+        await asyncio.sleep(settings.rate_limit_sync_seconds)
+        try:
+            await asyncio.to_thread(sync_rate_limits)
+        except Exception as e:
+            print(f"Rate limit sync failed: {e}")
+
+
+def restore_rate_limiter() -> None:
+    """Restore the rate limiter state saved before the last shutdown or crash."""
+    start = time.perf_counter()
+    try:
+        users = rate_limiter.restore(settings.rate_limit_snapshot_path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Rate limiter snapshot not restored: {e}")
+        return
+    if users:
+        print(f"Restored rate limits of {users} users in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+# Config change feed polling: each poll re-reads this far back for versions
+# that committed out of order, and starts over past this many changes
+CONFIG_POLL_OVERLAP = timedelta(seconds=10)
+CONFIG_POLL_LIMIT = 10000
+
+
+async def start_config_version() -> None:
+    """Start following the config change feed from its current version."""
+    async with AsyncSessionLocal() as db:
+        key_cache.version = await async_crud.latest_config_version(db)
+    key_cache.polled_at = datetime.utcnow()
+
+
+async def poll_config_changes() -> int:
+    """Evict API keys changed since the last poll from the key cache."""
+    polled_at = datetime.utcnow()
+    since = key_cache.polled_at - CONFIG_POLL_OVERLAP if key_cache.polled_at else None
+    async with AsyncSessionLocal() as db:
+        changes = await async_crud.get_config_changes(db, key_cache.version, since=since, limit=CONFIG_POLL_LIMIT)
+        if len(changes) >= CONFIG_POLL_LIMIT:
+            # Too many changes to apply one by one (e.g. a bulk migration)
+            key_cache.version = await async_crud.latest_config_version(db)
+            key_cache.polled_at = polled_at
+            return key_cache.clear()
+    return key_cache.apply_changes(changes, polled_at)
+
+
+async def config_change_poller():
+    """Background task applying config changes every CONFIG_POLL_SECONDS."""
+    while True:
+        await asyncio.sleep(settings.config_poll_seconds)
+        try:
+            await poll_config_changes()
+        except Exception as e:
+            print(f"Config change poll failed: {e}")
+
+
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database."""
+    """Initialize database and start background tasks."""
     init_db()
+    await start_config_version()
+    app.state.rate_limit_snapshot = None
+    app.state.rate_limit_memory = None
+    app.state.rate_limit_sweep_task = asyncio.create_task(rate_limiter_sweeper())
+    if settings.rate_limit_snapshot_path:
+        restore_rate_limiter()
+        app.state.rate_limit_snapshot_task = asyncio.create_task(rate_limiter_snapshotter())
+    if rate_limit_sync is not None:
+        # Start from what the other gateways admitted in the last hour
+        await asyncio.to_thread(sync_rate_limits)
+        app.state.rate_limit_sync_task = asyncio.create_task(rate_limit_syncer())
+    # Start from the usage all gateways have stored for the current periods
+    await asyncio.to_thread(flush_quota_usage)
+    app.state.latency_flush_task = asyncio.create_task(latency_sketch_flusher())
+    app.state.quota_flush_task = asyncio.create_task(quota_usage_flusher())
+    app.state.config_poll_task = asyncio.create_task(config_change_poller())
+    os.makedirs(settings.batch_dir, exist_ok=True)
+    app.state.batch_task = asyncio.create_task(batch_runner.run())
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close HTTP client."""
+    """Flush latency sketches, quota usage and rate limiter state and close HTTP client."""
+    app.state.config_poll_task.cancel()
+    app.state.rate_limit_sweep_task.cancel()
+    app.state.batch_task.cancel()
+    await asyncio.gather(app.state.batch_task, return_exceptions=True)
+    try:
+        await batch_runner.release()
+    except Exception as e:
+        print(f"Batch lease release failed: {e}")
+    if settings.rate_limit_snapshot_path:
+        app.state.rate_limit_snapshot_task.cancel()
+        try:
+            await asyncio.to_thread(snapshot_rate_limiter)
+        except Exception as e:
+            print(f"Rate limiter snapshot failed: {e}")
+    if rate_limit_sync is not None:
+        app.state.rate_limit_sync_task.cancel()
+        try:
+            await asyncio.to_thread(sync_rate_limits)
+        except Exception as e:
+            print(f"Rate limit sync failed: {e}")
+    app.state.latency_flush_task.cancel()
+    app.state.quota_flush_task.cancel()
+    try:
+        await asyncio.to_thread(flush_latency_sketches)
+    except Exception as e:
+        print(f"Latency sketch flush failed: {e}")
+    try:
+        await asyncio.to_thread(flush_quota_usage)
+    except Exception as e:
+        print(f"Quota usage flush failed: {e}")
     await http_client.aclose()
+    await async_engine.dispose()
 
 
 # Middleware for request logging
@@ -102,44 +350,137 @@ async def health_check():
             "gateway": "healthy",
             "llm_backend": "healthy" if llm_backend_healthy else "unhealthy",
             "admin": "healthy" if admin_healthy else "unhealthy",
-        }
+        },
+        "key_cache": key_cache.stats(),
+        "quotas": quota_tracker.stats(),
+        "idempotency": idempotency_store.stats(),
+        "batches": batch_runner.stats(),
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+        "rate_limiter": {
+            **rate_limiter.stats(),
+            "memory": app.state.rate_limit_memory,
+            "snapshot": app.state.rate_limit_snapshot,
+            "sync": rate_limit_sync.stats() if rate_limit_sync is not None else None,
+        },
+        "database": pool_stats(),
     }
 
 
-# Proxy to LLM Backend with authentication and rate limiting
-async def proxy_to_llm_backend(
-    request: Request,
-    path: str,
-    api_key_info: APIKeyInfo,
-    db: Session,
-):
-    """Proxy request to LLM backend with auth and rate limiting."""
-    start_time = time.time()
+class InvalidationRequest(BaseModel):
+    key_ids: List[int] = []
+    all: bool = False
 
-    # Check rate limit
-    rate_limiter.check_rate_limit(api_key_info)
 
-    # Get rate limit status for headers
-    minute_limit, minute_remaining, hour_limit, hour_remaining = (
-        rate_limiter.get_rate_limit_status(api_key_info)
+def verify_internal_token(x_internal_token: Optional[str] = Header(None)):
+    """
+    Require the shared INTERNAL_API_TOKEN on /internal endpoints.
+
+    They are served on the public port, so without a token configured they
+    are refused and key changes reach the cache through the change feed only.
+    """
+    if not settings.internal_api_token:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Internal endpoints are disabled")
+    if not hmac.compare_digest(x_internal_token or "", settings.internal_api_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid internal token")
+
+
+@app.post("/internal/invalidate", dependencies=[Depends(verify_internal_token)])
+async def invalidate_keys(request: InvalidationRequest):
+    """
+    Evict changed API keys from the key cache.
+
+    Called by the admin service right after it commits a key change, so
+    revocations apply within milliseconds instead of the next poll.
+    """
+    evicted = key_cache.clear() if request.all else key_cache.invalidate(request.key_ids)
+    return {"evicted": evicted}
+
+
+def extract_usage(content: bytes) -> Tuple[int, int, Optional[str]]:
+    """
+    Extract token usage and model name from a JSON completion response.
+
+    Returns:
+        Tuple of (prompt_tokens, completion_tokens, model)
+    """
+    try:
+        response_json = json.loads(content)
+    except ValueError:
+        return 0, 0, None
+    if not isinstance(response_json, dict):
+        return 0, 0, None
+
+    usage = response_json.get("usage") or {}
+    return (
+        usage.get("prompt_tokens", 0),
+        usage.get("completion_tokens", 0),
+        response_json.get("model"),
     )
 
-    # Forward request to LLM backend
-    url = f"{settings.llm_backend_url}/{path}"
 
-    # Get request body
-    body = await request.body()
+def requests_stream(body: bytes) -> bool:
+    """Whether a request body asks for a streamed response."""
+    if b'"stream"' not in body:
+        return False
+    try:
+        return json.loads(body).get("stream") is True
+    except (ValueError, AttributeError):
+        return False
+
+
+def rate_limit_headers(
+    minute_limit: int, minute_remaining: int, hour_limit: int, hour_remaining: int
+) -> Dict[str, str]:
+    """Build the X-RateLimit-* response headers."""
+    return {
+        "X-RateLimit-Limit-Minute": str(minute_limit),
+        "X-RateLimit-Remaining-Minute": str(minute_remaining),
+        "X-RateLimit-Limit-Hour": str(hour_limit),
+        "X-RateLimit-Remaining-Hour": str(hour_remaining),
+    }
+
+
+async def log_request(**fields) -> None:
+    """Write a request log without blocking the event loop."""
+    async with AsyncSessionLocal() as db:
+        await async_crud.create_request_log(db, **fields)
+
+
+async def call_llm_backend(
+    method: str,
+    path: str,
+    body: bytes,
+    content_type: str,
+    api_key_info: APIKeyInfo,
+    quota_keys: list,
+    start_time: float,
+) -> StoredResponse:
+    """Forward an admitted request to the LLM backend, then record and log its usage."""
+    url = f"{settings.llm_backend_url}/{path}"
+    # Non-streamed bodies arrive whole once generation is done, so only streams have a TTFT
+    streaming = requests_stream(body)
 
     try:
-        # Forward request
-        response = await http_client.request(
-            method=request.method,
+        # Forward request, timing the first byte of a streamed response body
+        upstream_request = http_client.build_request(
+            method=method,
             url=url,
             content=body,
             headers={
-                "Content-Type": request.headers.get("Content-Type", "application/json"),
+                "Content-Type": content_type,
             },
         )
+        response = await http_client.send(upstream_request, stream=True)
+        ttft_ms = None
+        chunks = []
+        try:
+            async for chunk in response.aiter_bytes():
+                if streaming and ttft_ms is None:
+                    ttft_ms = (time.time() - start_time) * 1000
+                chunks.append(chunk)
+        finally:
+            await response.aclose()
+        content = b"".join(chunks)
 
         # Log request to database
         duration_ms = (time.time() - start_time) * 1000
@@ -150,53 +491,32 @@ async def proxy_to_llm_backend(
         model = None
 
         if response.status_code == 200:
-            try:
-                response_json = response.json()
-                if "usage" in response_json:
-                    prompt_tokens = response_json["usage"].get("prompt_tokens", 0)
-                    completion_tokens = response_json["usage"].get("completion_tokens", 0)
-                if "model" in response_json:
-                    model = response_json["model"]
-            except:
-                pass
+            prompt_tokens, completion_tokens, model = extract_usage(content)
+            latency_recorder.record(api_key_info.user_id, model, duration_ms, ttft_ms)
+            quota_tracker.add_tokens(quota_keys, prompt_tokens + completion_tokens)
 
         # Log to database
-        crud.create_request_log(
-            db,
+        await log_request(
             user_id=api_key_info.user_id,
             api_key_id=api_key_info.key_id,
             endpoint=path,
-            method=request.method,
+            method=method,
             status_code=response.status_code,
             duration_ms=duration_ms,
             prompt_tokens=prompt_tokens,
             completion_tokens=completion_tokens,
             model=model,
-            error=None if response.status_code == 200 else response.text[:500],
+            error=None if response.status_code == 200 else content.decode(errors="replace")[:500],
         )
 
-        # Add rate limit headers
-        headers = {
-            "X-RateLimit-Limit-Minute": str(minute_limit),
-            "X-RateLimit-Remaining-Minute": str(minute_remaining),
-            "X-RateLimit-Limit-Hour": str(hour_limit),
-            "X-RateLimit-Remaining-Hour": str(hour_remaining),
-        }
-
-        return Response(
-            content=response.content,
-            status_code=response.status_code,
-            headers=headers,
-            media_type=response.headers.get("Content-Type"),
-        )
+        return StoredResponse(response.status_code, content, response.headers.get("Content-Type"))
 
     except httpx.TimeoutException:
-        crud.create_request_log(
-            db,
+        await log_request(
             user_id=api_key_info.user_id,
             api_key_id=api_key_info.key_id,
             endpoint=path,
-            method=request.method,
+            method=method,
             status_code=504,
             duration_ms=(time.time() - start_time) * 1000,
             error="Request timeout",
@@ -204,12 +524,11 @@ async def proxy_to_llm_backend(
         raise HTTPException(status_code=504, detail="Request timeout")
 
     except Exception as e:
-        crud.create_request_log(
-            db,
+        await log_request(
             user_id=api_key_info.user_id,
             api_key_id=api_key_info.key_id,
             endpoint=path,
-            method=request.method,
+            method=method,
             status_code=500,
             duration_ms=(time.time() - start_time) * 1000,
             error=str(e)[:500],
@@ -217,16 +536,348 @@ async def proxy_to_llm_backend(
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+def backend_response(stored: StoredResponse, headers: Dict[str, str]) -> Response:
+    """Response to the client from a (possibly stored) backend response."""
+    return Response(
+        content=stored.content,
+        status_code=stored.status_code,
+        headers=headers,
+        media_type=stored.media_type,
+    )
+
+
+async def replay_idempotent(existing: Union[StoredResponse, asyncio.Task], api_key_info: APIKeyInfo) -> Response:
+    """
+    Answer a retry from the call already made with its Idempotency-Key.
+
+    Retries are not rate limited, counted against quotas or logged again.
+    """
+    # Shielded: a retry giving up must not cancel the call it waits for
+    stored = existing if isinstance(existing, StoredResponse) else await asyncio.shield(existing)
+    headers = rate_limit_headers(*rate_limiter.get_rate_limit_status(api_key_info))
+    headers["Idempotent-Replayed"] = "true"
+    return backend_response(stored, headers)
+
+
+async def log_semantic_cache_hit(
+    method: str, path: str, cached: StoredResponse, api_key_info: APIKeyInfo, start_time: float
+) -> None:
+    """Log a request answered from the semantic cache; no tokens were generated for it."""
+    await log_request(
+        user_id=api_key_info.user_id,
+        api_key_id=api_key_info.key_id,
+        endpoint=path,
+        method=method,
+        status_code=cached.status_code,
+        duration_ms=(time.time() - start_time) * 1000,
+        prompt_tokens=0,
+        completion_tokens=0,
+        model=extract_usage(cached.content)[2],
+    )
+
+
+# Proxy to LLM Backend with authentication and rate limiting
+async def proxy_to_llm_backend(
+    request: Request,
+    path: str,
+    api_key_info: APIKeyInfo,
+):
+    """Proxy request to LLM backend with auth and rate limiting."""
+    start_time = time.time()
+
+    # Get request body
+    body = await request.body()
+
+    # A POST with an Idempotency-Key reuses the call made for the same key
+    idempotency_key = request.headers.get("Idempotency-Key")
+    scope = fingerprint = None
+    if idempotency_key and request.method == "POST" and idempotency_store.enabled:
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters",
+            )
+        scope = (api_key_info.key_id, idempotency_key)
+        fingerprint = request_fingerprint(request.method, path, body)
+        try:
+            existing = idempotency_store.lookup(scope, fingerprint)
+        except IdempotencyConflict:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used for a different request",
+            )
+        if existing is not None:
+            return await replay_idempotent(existing, api_key_info)
+
+    # Check rate limit
+    rate_limiter.check_rate_limit(api_key_info)
+
+    # Check and count organization / team / user / key quotas
+    quota_keys = quota_tracker.check(api_key_info)
+
+    # Get rate limit status for headers
+    minute_limit, minute_remaining, hour_limit, hour_remaining = (
+        rate_limiter.get_rate_limit_status(api_key_info)
+    )
+
+    # Add rate limit headers
+    headers = rate_limit_headers(minute_limit, minute_remaining, hour_limit, hour_remaining)
+
+    async def answer() -> StoredResponse:
+        # A prompt close enough to a cached one is answered from the semantic cache
+        query = lookup = None
+        if semantic_cache is not None:
+            query = semantic_cache.query(api_key_info.user_id, path, body, request.headers.get("Cache-Control"))
+        if query is not None:
+            lookup = await semantic_cache.lookup(query)
+            headers["X-Semantic-Cache"] = "miss"
+            if lookup.response is not None:
+                headers["X-Semantic-Cache"] = "hit"
+                headers["X-Semantic-Cache-Similarity"] = f"{lookup.similarity:.4f}"
+                await log_semantic_cache_hit(request.method, path, lookup.response, api_key_info, start_time)
+                return lookup.response
+
+        stored = await call_llm_backend(
+            request.method,
+            path,
+            body,
+            request.headers.get("Content-Type", "application/json"),
+            api_key_info,
+            quota_keys,
+            start_time,
+        )
+        if lookup is not None and lookup.vector is not None:
+            semantic_cache.store(query, lookup.vector, stored)
+        return stored
+
+    with batch_runner.interactive():
+        if scope is None:
+            stored = await answer()
+        else:
+            # Started before anything is awaited, so a concurrent retry finds it, and
+            # runs on even if this client disconnects, so its retry can pick it up
+            stored = await asyncio.shield(idempotency_store.start(scope, fingerprint, answer()))
+
+    return backend_response(stored, headers)
+
+
+# Batch API (OpenAI compatible): requests from an uploaded JSONL file run in the background
+async def execute_batch_request(
+    api_key_info: APIKeyInfo, url: str, body: bytes, start_time: float
+) -> StoredResponse:
+    """Run one batch request like an interactive one, counted against quotas but not rate limited."""
+    quota_keys = quota_tracker.check(api_key_info)
+    return await call_llm_backend(
+        "POST", url.lstrip("/"), body, "application/json", api_key_info, quota_keys, start_time
+    )
+
+
+batch_runner = BatchRunner(
+    execute_batch_request,
+    concurrency=settings.batch_concurrency,
+    peak_concurrency=settings.batch_peak_concurrency,
+    peak_hours=settings.batch_peak_hours,
+    interactive_threshold=settings.batch_interactive_threshold,
+)
+
+
+class BatchCreateRequest(BaseModel):
+    input_file_id: str
+    endpoint: str
+    completion_window: str = "24h"
+    metadata: Optional[Dict[str, str]] = None
+
+
+async def get_owned(model, object_id: str, user_id: str):
+    """A batch file or batch of the key's user, 404 otherwise."""
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(select(model).where(model.id == object_id, model.user_id == user_id))).scalar()
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No such object: {object_id}")
+    return row
+
+
+@app.post("/v1/files")
+async def upload_file(
+    file: UploadFile = File(...),
+    purpose: str = Form(...),
+    api_key_info: APIKeyInfo = Depends(verify_api_key),
+):
+    """Upload a JSONL batch input file; every line is validated before it is accepted."""
+    if purpose != "batch":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only purpose 'batch' is supported")
+    if file.size is not None and file.size > settings.batch_max_file_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Files can be at most {settings.batch_max_file_bytes} bytes",
+        )
+
+    file_id = batches.new_id("file-")
+    path = batches.file_path(file_id)
+
+    def store() -> int:
+        with open(path, "wb") as f:
+            shutil.copyfileobj(file.file, f)
+        return batches.validate_input_file(path, settings.batch_max_requests)[0]
+
+    try:
+        requests = await asyncio.to_thread(store)
+    except BatchValidationError as e:
+        os.remove(path)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    row = BatchFile(
+        id=file_id, user_id=api_key_info.user_id, filename=file.filename or "batch.jsonl",
+        purpose=purpose, requests=requests,
+    )
+    async with AsyncSessionLocal() as db:
+        db.add(row)
+        await db.commit()
+    return batches.file_object(row)
+
+
+@app.get("/v1/files/{file_id}")
+async def get_file(file_id: str, api_key_info: APIKeyInfo = Depends(verify_api_key)):
+    return batches.file_object(await get_owned(BatchFile, file_id, api_key_info.user_id))
+
+
+@app.get("/v1/files/{file_id}/content")
+async def get_file_content(file_id: str, api_key_info: APIKeyInfo = Depends(verify_api_key)):
+    """File contents; the results of a running batch so far."""
+    await get_owned(BatchFile, file_id, api_key_info.user_id)
+    path = batches.file_path(file_id)
+    if not os.path.exists(path):
+        return Response(content=b"", media_type="application/jsonl")
+    return FileResponse(path, media_type="application/jsonl")
+
+
+@app.post("/v1/batches")
+async def create_batch(request: BatchCreateRequest, api_key_info: APIKeyInfo = Depends(verify_api_key)):
+    """Queue a batch of the requests in an uploaded file."""
+    if request.endpoint not in batches.ENDPOINTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"endpoint must be one of {', '.join(batches.ENDPOINTS)}",
+        )
+    if request.completion_window not in batches.COMPLETION_WINDOWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"completion_window must be one of {', '.join(batches.COMPLETION_WINDOWS)}",
+        )
+    input_file = await get_owned(BatchFile, request.input_file_id, api_key_info.user_id)
+    path = batches.file_path(input_file.id)
+    if input_file.purpose != "batch" or not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not a batch input file on this gateway")
+    try:
+        total, urls = await asyncio.to_thread(batches.validate_input_file, path, settings.batch_max_requests)
+    except BatchValidationError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if urls != {request.endpoint}:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Every request in the file must use the batch endpoint {request.endpoint}",
+        )
+
+    batch_id = batches.new_id("batch_")
+    output_file = BatchFile(
+        id=batches.new_id("file-"), user_id=api_key_info.user_id,
+        filename=f"{batch_id}_output.jsonl", purpose="batch_output",
+    )
+    error_file = BatchFile(
+        id=batches.new_id("file-"), user_id=api_key_info.user_id,
+        filename=f"{batch_id}_error.jsonl", purpose="batch_output",
+    )
+    batch = Batch(
+        id=batch_id,
+        user_id=api_key_info.user_id,
+        api_key_id=api_key_info.key_id,
+        tier=api_key_info.tier,
+        endpoint=request.endpoint,
+        completion_window=request.completion_window,
+        status="in_progress",
+        input_file_id=input_file.id,
+        output_file_id=output_file.id,
+        error_file_id=error_file.id,
+        total=total,
+        completed=0,
+        failed=0,
+        batch_metadata=json.dumps(request.metadata) if request.metadata else None,
+        created_at=datetime.utcnow(),
+    )
+    async with AsyncSessionLocal() as db:
+        db.add_all([output_file, error_file, batch])
+        await db.commit()
+    batch_runner.wakeup.set()
+    return batches.batch_object(batch)
+
+
+@app.get("/v1/batches")
+async def list_batches(
+    limit: int = 20,
+    after: Optional[str] = None,
+    api_key_info: APIKeyInfo = Depends(verify_api_key),
+):
+    """The user's batches, newest first; ``after`` is the last batch ID of the previous page."""
+    limit = max(1, min(limit, 100))
+    query = select(Batch).where(Batch.user_id == api_key_info.user_id)
+    if after:
+        cursor = await get_owned(Batch, after, api_key_info.user_id)
+        query = query.where(
+            (Batch.created_at < cursor.created_at)
+            | ((Batch.created_at == cursor.created_at) & (Batch.id < cursor.id))
+        )
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            query.order_by(Batch.created_at.desc(), Batch.id.desc()).limit(limit + 1)
+        )).scalars().all()
+    data = [batches.batch_object(row, batch_runner.live_counts(row.id)) for row in rows[:limit]]
+    return {
+        "object": "list",
+        "data": data,
+        "first_id": data[0]["id"] if data else None,
+        "last_id": data[-1]["id"] if data else None,
+        "has_more": len(rows) > limit,
+    }
+
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str, api_key_info: APIKeyInfo = Depends(verify_api_key)):
+    batch = await get_owned(Batch, batch_id, api_key_info.user_id)
+    return batches.batch_object(batch, batch_runner.live_counts(batch_id))
+
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, api_key_info: APIKeyInfo = Depends(verify_api_key)):
+    """
+    Cancel a batch. A running batch goes through cancelling while its
+    requests in flight finish; results so far stay in its output files.
+    """
+    batch = await get_owned(Batch, batch_id, api_key_info.user_id)
+    if batch.status not in batches.UNFINISHED:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Batch is already {batch.status}")
+    now = datetime.utcnow()
+    running = batch.lease_until is not None and batch.lease_until > now
+    values = {"status": "cancelling", "cancelling_at": batch.cancelling_at or now}
+    if not running:
+        values.update(status="cancelled", finished_at=now)
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Batch).where(Batch.id == batch_id, Batch.status.in_(batches.UNFINISHED)).values(**values))
+        await db.commit()
+        batch = (await db.execute(select(Batch).where(Batch.id == batch_id))).scalar()
+    if batch_id == batch_runner.current:
+        batch_runner.cancelled.add(batch_id)
+    return batches.batch_object(batch, batch_runner.live_counts(batch_id))
+
+
 # LLM API Routes (with authentication)
 @app.api_route("/v1/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def llm_api_proxy(
     path: str,
     request: Request,
     api_key_info: APIKeyInfo = Depends(verify_api_key),
-    db: Session = Depends(get_db),
 ):
     """Proxy all /v1/* requests to LLM backend."""
-    return await proxy_to_llm_backend(request, f"v1/{path}", api_key_info, db)
+    return await proxy_to_llm_backend(request, f"v1/{path}", api_key_info)
 
 
 # Auth API Routes (self-service, no authentication required)
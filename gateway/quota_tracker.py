@@ -0,0 +1,182 @@
+"""Hierarchical quota enforcement for Gateway."""
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from shared import quotas
+from shared.quotas import UsageKey
+from .auth import APIKeyInfo
+
+
+class QuotaLimit(NamedTuple):
+    window: str
+    max_requests: Optional[int]
+    max_tokens: Optional[int]
+
+
+class QuotaTracker:
+    """
+    In-memory quota counters, checked along each key's hierarchy
+    (organization > team > user > key).
+
+    Consumption is counted locally and flush() adds it to the shared
+    ``quota_usage`` rows, then reloads quota definitions, team memberships
+    and the totals of all gateways. A check is a few dictionary lookups per
+    level, with no database access; several gateways together can overshoot
+    a quota by what they admit within one flush interval.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self.limits: Dict[Tuple[str, str], List[QuotaLimit]] = {}
+        self.memberships: Dict[str, Tuple[str, Optional[str]]] = {}
+        self.totals: Dict[UsageKey, Tuple[int, int]] = {}  # Stored usage, as of the last flush
+        self.pending: Dict[UsageKey, List[int]] = {}  # Counted here since the last flush
+        self.flushing: Dict[UsageKey, List[int]] = {}  # Being written, until the totals are reloaded
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def hierarchy(self, user_info: APIKeyInfo) -> List[Tuple[str, str]]:
+        """(scope, subject) of the key and everything above it, outermost first."""
+        levels = [("user", user_info.user_id), ("key", str(user_info.key_id))]
+        membership = self.memberships.get(user_info.user_id)
+        if membership is not None:
+            team, organization = membership
+            levels.insert(0, ("team", team))
+            if organization:
+                levels.insert(0, ("organization", organization))
+        return levels
+
+    def used(self, key: UsageKey) -> Tuple[int, int]:
+        """(requests, tokens) counted against a quota period, including unflushed counts."""
+        requests, tokens = self.totals.get(key, (0, 0))
+        for counts in (self.pending.get(key), self.flushing.get(key)):
+            if counts is not None:
+                requests += counts[0]
+                tokens += counts[1]
+        return requests, tokens
+
+    def check(self, user_info: APIKeyInfo) -> List[UsageKey]:
+        """
+        Admit a request against every quota along the key's hierarchy and
+        count it.
+
+        Returns:
+            The quota periods the request was counted in, for add_tokens()
+
+        Raises:
+            HTTPException: If any request or token quota is used up
+        """
+        if not self.limits:
+            return []
+        now = datetime.utcfromtimestamp(self.clock())
+        periods = quotas.current_periods(now)
+        keys = []
+        with self._lock:
+            for scope, subject in self.hierarchy(user_info):
+                for limit in self.limits.get((scope, subject), ()):
+                    start = periods[limit.window]
+                    key = (scope, subject, limit.window, start)
+                    requests, tokens = self.used(key)
+                    if limit.max_requests is not None and requests >= limit.max_requests:
+                        self._reject(scope, subject, limit.window, "requests", limit.max_requests, start, now)
+                    if limit.max_tokens is not None and tokens >= limit.max_tokens:
+                        self._reject(scope, subject, limit.window, "tokens", limit.max_tokens, start, now)
+                    keys.append(key)
+
+            for key in keys:
+                self.pending.setdefault(key, [0, 0])[0] += 1
+        return keys
+
+    def _reject(self, scope: str, subject: str, window: str, unit: str, limit: int,
+                start: datetime, now: datetime) -> None:
+        self.rejected += 1
+        retry_after = int((quotas.period_end(window, start) - now).total_seconds()) + 1
+        period = "daily" if window == "day" else "monthly"
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Quota exceeded. The {period} {unit} quota of {scope} '{subject}' ({limit}) is used up.",
+            headers={
+                "X-Quota-Scope": scope,
+                "X-Quota-Window": window,
+                "Retry-After": str(retry_after),
+            },
+        )
+
+    def add_tokens(self, keys: List[UsageKey], tokens: int) -> None:
+        """Count a completed request's tokens in the periods check() returned."""
+        if not keys or not tokens:
+            return
+        with self._lock:
+            for key in keys:
+                self.pending.setdefault(key, [0, 0])[1] += tokens
+
+    def load(self, db: Session) -> None:
+        """
+        Reload quotas, memberships and the stored totals of the current
+        periods; counts written by flush() are part of the totals from now on.
+        """
+        limits = {
+            subject: [QuotaLimit(q.window, q.max_requests, q.max_tokens) for q in subject_quotas]
+            for subject, subject_quotas in quotas.load_quotas(db).items()
+        }
+        memberships = quotas.load_memberships(db)
+        periods = quotas.current_periods(datetime.utcfromtimestamp(self.clock()))
+        totals = quotas.get_usage(db, periods, subjects=limits.keys()) if limits else {}
+        with self._lock:
+            self.limits = limits
+            self.memberships = memberships
+            self.totals = totals
+            self.flushing = {}
+
+    def flush(self, db: Session) -> int:
+        """
+        Add the local counts to the stored usage and reload (see load).
+
+        If the write fails the counts are kept for the next flush. If only
+        the reload fails, the written counts keep counting here until a
+        reload succeeds.
+
+        Returns:
+            Number of quota periods written
+        """
+        with self._lock:
+            pending, self.pending = self.pending, {}
+            for key, (requests, tokens) in pending.items():
+                counts = self.flushing.setdefault(key, [0, 0])
+                counts[0] += requests
+                counts[1] += tokens
+        if pending:
+            try:
+                quotas.merge_usage(db, pending)
+            except Exception:
+                with self._lock:
+                    for key, (requests, tokens) in pending.items():
+                        flushing = self.flushing.get(key)
+                        if flushing is not None:
+                            flushing[0] -= requests
+                            flushing[1] -= tokens
+                            if flushing == [0, 0]:
+                                del self.flushing[key]
+                        counts = self.pending.setdefault(key, [0, 0])
+                        counts[0] += requests
+                        counts[1] += tokens
+                raise
+        self.load(db)
+        return len(pending)
+
+    def stats(self) -> dict:
+        return {
+            "quotas": sum(len(limits) for limits in self.limits.values()),
+            "team_members": len(self.memberships),
+            "pending": len(self.pending),
+            "rejected": self.rejected,
+        }
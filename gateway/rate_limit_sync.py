@@ -0,0 +1,257 @@
+"""Approximate global rate limits across gateway nodes."""
+import math
+import os
+import socket
+import sys
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from typing import Callable, Dict, Mapping, NamedTuple, Optional, Sequence, Tuple
+from sqlalchemy.orm import Session
+
+from shared import rate_limit_reports
+from shared.config import settings
+from shared.rate_limit_reports import Report
+
+MODES = ("local", "shared")
+MINUTE = 60
+HOUR = 3600
+READ_OVERLAP_SECONDS = 10.0  # Re-read reports this far back, for writes that committed late
+PRUNE_SECONDS = 60.0  # Reports older than an hour are dropped this often
+
+
+class Allotment(NamedTuple):
+    """This node's share of one user's limits, as of the last sync."""
+    share: float  # Fraction of what is left of each limit this node may admit
+    minute_own: int  # This node's requests in the window, as reported
+    minute_total: int  # All nodes' requests in the window, as reported
+    hour_own: int
+    hour_total: int
+
+    def caps(self, minute_limit: int, hour_limit: int) -> Tuple[int, int]:
+        """Requests this node may have in each window before rejecting."""
+        return (
+            self.minute_own + math.ceil(self.share * max(0, minute_limit - self.minute_total)),
+            self.hour_own + math.ceil(self.share * max(0, hour_limit - self.hour_total)),
+        )
+
+
+class RateLimitSync:
+    """
+    Local shares of every user's rate limits, rebalanced from the request
+    counts all gateway nodes report through the database.
+
+    At each sync a node reports, for every user whose requests reached it
+    since the previous sync, its admitted requests in the minute and hour
+    windows and how many requests arrived (demand), then reads the other
+    nodes' reports. What is left of each limit is split between the live
+    nodes in proportion to where the user's requests arrive, with
+    ``share_floor`` of it spread evenly so that a node the traffic moves to
+    can admit requests before the next sync. Users no node has reported
+    get an even split.
+
+    Nodes working from the same reports never allot more than a limit, plus
+    one request per node from rounding up. Reports are up to one sync
+    interval old, so the overshoot is bounded by what the nodes admit for a
+    user within one sync interval; more frequent syncs trade database load
+    for accuracy. The overshoot is estimated from the reports at each sync
+    and counted in stats().
+    """
+
+    def __init__(
+        self,
+        node_id: str,
+        sync_seconds: float = 1.0,
+        share_floor: float = 0.1,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.node_id = node_id
+        self.sync_seconds = sync_seconds
+        self.share_floor = min(max(share_floor, 0.0), 1.0)
+        self.clock = clock
+        # A node's demand counts while it is this recent; nodes are live this long after a sync
+        self.demand_seconds = 3 * sync_seconds
+        self.node_timeout = max(10.0, 5 * sync_seconds)
+
+        self.demand: Dict[str, list] = {}  # user_id: [arrived, minute_limit, hour_limit] since the last sync
+        self.reports: Dict[str, Dict[str, Report]] = {}  # user_id: {node_id: report}, including this node
+        self.allotments: Dict[str, Allotment] = {}
+        self.live_nodes = 1
+        self.read_at: Optional[float] = None
+        self.pruned_at = 0.0
+        self._lock = threading.Lock()
+
+        self.syncs = 0
+        self.last_sync_ms = 0.0
+        self.overshoot_users = 0  # Users over a limit at the last sync
+        self.overshoot_events = 0  # (user, window) pairs seen over their limit, summed over syncs
+        self.overshoot_max = 0  # Largest excess over a limit seen, in requests
+
+    def count_request(self, user_id: str, minute_limit: int, hour_limit: int) -> None:
+        """Count a request arriving for a user, admitted or not."""
+        with self._lock:
+            entry = self.demand.get(user_id)
+            if entry is None:
+                self.demand[user_id] = [1, minute_limit, hour_limit]
+            else:
+                entry[0] += 1
+
+    def local_limits(self, user_id: str, minute_limit: int, hour_limit: int) -> Tuple[int, int]:
+        """The (minute, hour) request counts this node may admit a user up to."""
+        allotment = self.allotments.get(user_id)
+        if allotment is None:
+            return math.ceil(minute_limit / self.live_nodes), math.ceil(hour_limit / self.live_nodes)
+        return allotment.caps(minute_limit, hour_limit)
+
+    def sync(self, db: Session, histories: Mapping[str, Sequence[float]]) -> int:
+        """
+        Report the users counted since the last sync, read the other nodes'
+        reports and recompute the allotments of the users that changed.
+
+        If the database is unreachable the counts are kept for the next sync.
+
+        Args:
+            db: Database session
+            histories: Request timestamps per user, see RateLimiter.request_history
+
+        Returns:
+            Number of users reported
+        """
+        start = time.perf_counter()
+        now = self.clock()
+        with self._lock:
+            demand, self.demand = self.demand, {}
+
+        own = {}
+        for user_id, (arrived, minute_limit, hour_limit) in demand.items():
+            history = histories.get(user_id)
+            timestamps = list(history) if history else []  # One step, so concurrent appends are not torn
+            own[user_id] = Report(
+                minute_requests=len(timestamps) - bisect_left(timestamps, now - MINUTE),
+                hour_requests=len(timestamps) - bisect_left(timestamps, now - HOUR),
+                demand=arrived,
+                minute_limit=minute_limit,
+                hour_limit=hour_limit,
+                reported_at=now,
+            )
+
+        try:
+            rate_limit_reports.write_reports(db, self.node_id, now, own)
+            since = now - HOUR if self.read_at is None else self.read_at - READ_OVERLAP_SECONDS
+            remote = rate_limit_reports.read_reports(db, since, exclude_node=self.node_id)
+            nodes = rate_limit_reports.live_nodes(db, now - self.node_timeout)
+            prune = now - self.pruned_at >= PRUNE_SECONDS
+            if prune:
+                rate_limit_reports.prune_reports(db, self.node_id, now - HOUR)
+        except Exception:
+            with self._lock:
+                for user_id, (arrived, minute_limit, hour_limit) in demand.items():
+                    entry = self.demand.setdefault(user_id, [0, minute_limit, hour_limit])
+                    entry[0] += arrived
+            raise
+        self.read_at = now
+
+        changed = set(own)
+        for user_id, report in own.items():
+            self.reports.setdefault(user_id, {})[self.node_id] = report
+        for node_id, user_id, report in remote:
+            self.reports.setdefault(user_id, {})[node_id] = report
+            changed.add(user_id)
+        if prune:
+            self._prune(now - HOUR)
+            self.pruned_at = now
+        live = max(1, len(nodes))
+        if live != self.live_nodes:
+            self.live_nodes = live
+            changed = set(self.reports)
+
+        overshoot_users = 0
+        for user_id in changed:
+            reports = self.reports.get(user_id)
+            if reports:
+                self.allotments[user_id], excess = self._allot(reports, now)
+                if excess:
+                    overshoot_users += 1
+        self.overshoot_users = overshoot_users
+        self.syncs += 1
+        self.last_sync_ms = (time.perf_counter() - start) * 1000
+        return len(own)
+
+    def _allot(self, reports: Dict[str, Report], now: float) -> Tuple[Allotment, int]:
+        """A user's allotment on this node, and by how much the reports exceed a limit."""
+        minute_total = hour_total = demand_total = 0
+        minute_limit = hour_limit = None
+        for report in reports.values():
+            if report.reported_at >= now - MINUTE:
+                minute_total += report.minute_requests
+            hour_total += report.hour_requests
+            if report.reported_at >= now - self.demand_seconds:
+                demand_total += report.demand
+            minute_limit = report.minute_limit if minute_limit is None else min(minute_limit, report.minute_limit)
+            hour_limit = report.hour_limit if hour_limit is None else min(hour_limit, report.hour_limit)
+
+        own = reports.get(self.node_id)
+        minute_own = hour_own = own_demand = 0
+        if own is not None:
+            minute_own = own.minute_requests if own.reported_at >= now - MINUTE else 0
+            hour_own = own.hour_requests
+            own_demand = own.demand if own.reported_at >= now - self.demand_seconds else 0
+        if demand_total:
+            share = (1 - self.share_floor) * own_demand / demand_total + self.share_floor / self.live_nodes
+        else:
+            share = 1 / self.live_nodes
+
+        excess = 0
+        for total, limit in ((minute_total, minute_limit), (hour_total, hour_limit)):
+            if total > limit:
+                excess = max(excess, total - limit)
+                self.overshoot_events += 1
+        self.overshoot_max = max(self.overshoot_max, excess)
+        return Allotment(share, minute_own, minute_total, hour_own, hour_total), excess
+
+    def _prune(self, before: float) -> None:
+        """Forget reports written before ``before`` and users left without any."""
+        for user_id in list(self.reports):
+            reports = self.reports[user_id]
+            for node_id in [n for n, report in reports.items() if report.reported_at < before]:
+                del reports[node_id]
+            if not reports:
+                del self.reports[user_id]
+                self.allotments.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "node_id": self.node_id,
+            "live_nodes": self.live_nodes,
+            "users": len(self.reports),
+            "syncs": self.syncs,
+            "last_sync_ms": round(self.last_sync_ms, 2),
+            "overshoot": {
+                "last_sync_users": self.overshoot_users,
+                "events": self.overshoot_events,
+                "max_requests": self.overshoot_max,
+            },
+        }
+
+
+def default_node_id() -> str:
+    """Host name and process ID, unique for each gateway worker process."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def create_rate_limit_sync(mode: str = "") -> Optional[RateLimitSync]:
+    """Rate limit sync for RATE_LIMIT_MODE: None when local, a RateLimitSync when shared."""
+    mode = mode or settings.rate_limit_mode
+    if mode == "local":
+        return None
+    if mode == "shared":
+        return RateLimitSync(
+            node_id=settings.rate_limit_node_id or default_node_id(),
+            sync_seconds=settings.rate_limit_sync_seconds,
+            share_floor=settings.rate_limit_share_floor,
+        )
+    raise ValueError(f"Unknown rate limit mode: {mode}. Must be one of: {', '.join(MODES)}")
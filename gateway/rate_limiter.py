@@ -1,25 +1,170 @@
 """Rate limiting for Gateway."""
+import math
+import os
+import struct
 import sys
 import time
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from typing import Dict, Tuple
-from collections import defaultdict, deque
+from typing import Callable, Dict, Optional, Tuple
+from collections import OrderedDict, deque
 from fastapi import HTTPException, status
 
 from shared.config import settings
 from .auth import APIKeyInfo
+from .rate_limit_sync import RateLimitSync
+
+# Snapshot file layout (little endian): header, user IDs joined by NUL,
+# request count per user (uint32), then all timestamps (float64) in user order
+SNAPSHOT_MAGIC = b"RLSNAP01"
+SNAPSHOT_HEADER = struct.Struct("<8sdQQQ")  # magic, saved_at, users, user ID bytes, timestamps
+WINDOW_SECONDS = 3600  # Longest window; older timestamps are never needed
 
 
 class RateLimiter:
-    """In-memory rate limiter with sliding window."""
+    """
+    In-memory rate limiter with sliding window.
+
+    Histories are kept in least recently used order, so idle users are
+    found at the front: evict_idle() drops them without scanning active
+    users, and with max_principals the least recently seen user is evicted
+    (their window starts over) when a new one arrives.
+
+    With a RateLimitSync the limits are shared with the other gateway nodes,
+    and this node only admits requests up to its allotted part of them.
+    """
 
-    def __init__(self):
-        # Store request timestamps per user
+    def __init__(
+        self,
+        clock: Callable[[], float] = time.time,
+        max_principals: int = 0,
+        sync: Optional[RateLimitSync] = None,
+    ):
+        # Time source, replaceable so soak tests can compress time
+        self.clock = clock
+        self.max_principals = max_principals  # 0: no limit
+        self.sync = sync
+
+        # Store request timestamps per user, least recently seen first
         # Format: {user_id: deque([timestamp1, timestamp2, ...])}
-        self.request_history: Dict[str, deque] = defaultdict(deque)
+        self.request_history: Dict[str, deque] = OrderedDict()
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+
+        # Histories restored from a snapshot and not used since: user i's
+        # timestamps are _restored_timestamps[_restored_ends[i - 1]:_restored_ends[i]]
+        self._restored: Dict[str, int] = {}
+        self._restored_ends = array("Q")
+        self._restored_timestamps = array("d")
+        self._restored_expires = 0.0  # All restored timestamps are outside the window after this
+
+    def _restored_slice(self, index: int) -> Tuple[int, int]:
+        return (self._restored_ends[index - 1] if index else 0), self._restored_ends[index]
+
+    def _history(self, user_id: str, create: bool = True) -> Optional[deque]:
+        """
+        A user's request history, marked as most recently used.
+
+        A history restored from a snapshot is moved out of it on first use.
+        Without create, an unknown user returns None instead of being tracked.
+        """
+        history = self.request_history.get(user_id)
+        if history is not None:
+            self.request_history.move_to_end(user_id)
+            return history
+
+        index = self._restored.pop(user_id, None) if self._restored else None
+        if index is not None:
+            start, end = self._restored_slice(index)
+            timestamps = self._restored_timestamps
+            start = bisect_left(timestamps, self.clock() - WINDOW_SECONDS, start, end)
+            history = deque(timestamps[start:end])
+            if not self._restored:
+                self._clear_restored()
+        elif create:
+            history = deque()
+        else:
+            return None
+
+        self.request_history[user_id] = history
+        if self.max_principals and len(self.request_history) > self.max_principals:
+            self.request_history.popitem(last=False)
+            self.evicted_lru += 1
+        return history
+
+    def _clear_restored(self) -> None:
+        self._restored = {}
+        self._restored_ends, self._restored_timestamps = array("Q"), array("d")
+
+    def evict_idle(self, max_evictions: Optional[int] = None) -> int:
+        """
+        Stop tracking users with no requests inside the longest window.
+
+        Walks from the least recently used end and stops at the first user
+        with a recent request, so the cost is proportional to the number of
+        evicted users. Call from the thread that checks requests.
+
+        Returns:
+            Number of users evicted
+        """
+        now = self.clock()
+        cutoff = now - WINDOW_SECONDS
+        if self._restored and self._restored_expires < now:
+            self._clear_restored()
+
+        histories = self.request_history
+        evicted = 0
+        while histories and (max_evictions is None or evicted < max_evictions):
+            user_id, history = next(iter(histories.items()))
+            if history and history[-1] >= cutoff:
+                break
+            del histories[user_id]
+            evicted += 1
+        self.evicted_idle += evicted
+        return evicted
+
+    def memory_usage(self) -> dict:
+        """
+        Tracked users and an estimate of the bytes their state uses.
+
+        Walks every history, so call it from a worker thread; it only reads
+        copies of the tracking structures.
+        """
+        histories = list(self.request_history.items())
+        timestamps = sum(len(history) for _, history in histories)
+        history_bytes = (
+            sys.getsizeof(self.request_history)
+            + sum(sys.getsizeof(user_id) + sys.getsizeof(history) for user_id, history in histories)
+            + timestamps * sys.getsizeof(0.0)
+        )
+        restored = dict(self._restored)
+        restored_bytes = (
+            sys.getsizeof(restored)
+            + sum(sys.getsizeof(user_id) for user_id in restored)
+            + self._restored_ends.itemsize * len(self._restored_ends)
+            + self._restored_timestamps.itemsize * len(self._restored_timestamps)
+        )
+        return {
+            "principals": len(histories),
+            "restored_principals": len(restored),
+            "timestamps": timestamps,
+            "bytes": history_bytes + restored_bytes,
+        }
+
+    def stats(self) -> dict:
+        """Counters that are cheap to read on every health check."""
+        return {
+            "principals": len(self.request_history),
+            "restored_principals": len(self._restored),
+            "max_principals": self.max_principals,
+            "evicted_idle": self.evicted_idle,
+            "evicted_lru": self.evicted_lru,
+        }
 
     def get_tier_limits(self, tier: str) -> Tuple[int, int]:
         """Get rate limits for a tier."""
@@ -39,6 +184,12 @@ class RateLimiter:
                 settings.rate_limit_free_per_hour,
             )
 
+    def local_limits(self, user_id: str, requests_per_minute: int, requests_per_hour: int) -> Tuple[int, int]:
+        """The (minute, hour) limits this node enforces: its share of them when limits are shared."""
+        if self.sync is None:
+            return requests_per_minute, requests_per_hour
+        return self.sync.local_limits(user_id, requests_per_minute, requests_per_hour)
+
     def check_rate_limit(self, user_info: APIKeyInfo) -> None:
         """
         Check if user has exceeded rate limits.
@@ -52,10 +203,13 @@ class RateLimiter:
         requests_per_minute, requests_per_hour = self.get_tier_limits(user_info.tier)
         user_id = user_info.user_id
 
-        current_time = time.time()
+        current_time = self.clock()
+        if self.sync is not None:
+            self.sync.count_request(user_id, requests_per_minute, requests_per_hour)
+        minute_cap, hour_cap = self.local_limits(user_id, requests_per_minute, requests_per_hour)
 
         # Get user's request history
-        history = self.request_history[user_id]
+        history = self._history(user_id)
 
         # Remove old timestamps outside the hour window
         one_hour_ago = current_time - 3600
@@ -63,14 +217,19 @@ class RateLimiter:
             history.popleft()
 
         # Check hourly limit
-        if len(history) >= requests_per_hour:
+        if len(history) >= hour_cap:
+            if history:
+                retry_after = int(3600 - (current_time - history[0]))
+            else:
+                # Other nodes hold the rest of the limit; shares are rebalanced at the next sync
+                retry_after = math.ceil(self.sync.sync_seconds)
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail=f"Rate limit exceeded. Maximum {requests_per_hour} requests per hour allowed for tier '{user_info.tier}'.",
                 headers={
                     "X-RateLimit-Limit-Hour": str(requests_per_hour),
                     "X-RateLimit-Remaining-Hour": "0",
-                    "Retry-After": str(int(3600 - (current_time - history[0]))),
+                    "Retry-After": str(retry_after),
                 },
             )
 
@@ -78,10 +237,13 @@ class RateLimiter:
         one_minute_ago = current_time - 60
         recent_requests = sum(1 for ts in history if ts >= one_minute_ago)
 
-        if recent_requests >= requests_per_minute:
+        if recent_requests >= minute_cap:
             # Find when the oldest request in the current minute will expire
-            oldest_in_window = next(ts for ts in history if ts >= one_minute_ago)
-            retry_after = int(60 - (current_time - oldest_in_window)) + 1
+            oldest_in_window = next((ts for ts in history if ts >= one_minute_ago), None)
+            if oldest_in_window is not None:
+                retry_after = int(60 - (current_time - oldest_in_window)) + 1
+            else:
+                retry_after = math.ceil(self.sync.sync_seconds)
 
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
@@ -106,8 +268,10 @@ class RateLimiter:
         requests_per_minute, requests_per_hour = self.get_tier_limits(user_info.tier)
         user_id = user_info.user_id
 
-        current_time = time.time()
-        history = self.request_history[user_id]
+        minute_cap, hour_cap = self.local_limits(user_id, requests_per_minute, requests_per_hour)
+
+        current_time = self.clock()
+        history = self._history(user_id, create=False) or ()
 
         # Count requests in last minute
         one_minute_ago = current_time - 60
@@ -119,7 +283,94 @@ class RateLimiter:
 
         return (
             requests_per_minute,
-            max(0, requests_per_minute - recent_requests),
+            max(0, minute_cap - recent_requests),
             requests_per_hour,
-            max(0, requests_per_hour - hourly_requests),
+            max(0, hour_cap - hourly_requests),
         )
+
+    def snapshot(self, path: str) -> int:
+        """
+        Write the request history to ``path``, skipping expired timestamps.
+
+        Safe to call from a worker thread while requests are being checked:
+        each user's history is copied in one step, and the file is written
+        to a temporary name and renamed into place.
+
+        Returns:
+            Number of users written
+        """
+        saved_at = self.clock()
+        cutoff = saved_at - WINDOW_SECONDS
+        users, counts, timestamps = [], array("I"), array("d")
+
+        # Restored histories first: one moved to request_history in between
+        # is written twice, and the later copy wins on restore
+        restored_ends, restored_timestamps = self._restored_ends, self._restored_timestamps
+        for user_id, index in list(self._restored.items()):
+            start, end = (restored_ends[index - 1] if index else 0), restored_ends[index]
+            if restored_timestamps[end - 1] < cutoff:
+                continue
+            start = bisect_left(restored_timestamps, cutoff, start, end)
+            users.append(user_id)
+            counts.append(end - start)
+            timestamps.extend(restored_timestamps[start:end])
+
+        for user_id, history in list(self.request_history.items()):
+            if not history or history[-1] < cutoff:
+                continue
+            size = len(timestamps)
+            timestamps.extend(history)  # One step, so concurrent appends are not torn
+            if timestamps[size] < cutoff:
+                del timestamps[size:bisect_left(timestamps, cutoff, size)]
+            users.append(user_id)
+            counts.append(len(timestamps) - size)
+
+        user_blob = "\0".join(users).encode()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, saved_at, len(users), len(user_blob), len(timestamps)))
+            f.write(user_blob)
+            f.write(counts.tobytes())
+            f.write(timestamps.tobytes())
+        os.replace(tmp_path, path)
+        return len(users)
+
+    def restore(self, path: str) -> int:
+        """
+        Load a snapshot written by snapshot().
+
+        Only the file is read here; a user's history is rebuilt (and its
+        expired timestamps dropped) when the user is next seen, so restoring
+        hundreds of thousands of users takes milliseconds.
+
+        Returns:
+            Number of users in the snapshot (0 if there is none or it has expired)
+        """
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        magic, saved_at, user_count, blob_size, timestamp_count = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a rate limiter snapshot")
+        if saved_at < self.clock() - WINDOW_SECONDS or not user_count:
+            return 0
+
+        offset = SNAPSHOT_HEADER.size
+        users = data[offset:offset + blob_size].decode().split("\0")
+        offset += blob_size
+        counts = array("I")
+        counts.frombytes(data[offset:offset + 4 * user_count])
+        offset += 4 * user_count
+        timestamps = array("d")
+        timestamps.frombytes(data[offset:offset + 8 * timestamp_count])
+        ends = array("Q", accumulate(counts))
+        if len(users) != user_count or len(counts) != user_count or ends[-1] != timestamp_count:
+            raise ValueError(f"{path} is truncated or corrupt")
+
+        self._restored = dict(zip(users, range(user_count)))
+        self._restored_ends = ends
+        self._restored_timestamps = timestamps
+        self._restored_expires = saved_at + WINDOW_SECONDS
+        return user_count
@@ -0,0 +1,299 @@
+"""Semantic response cache for Gateway."""
+import hashlib
+import json
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Only needed with SEMANTIC_CACHE_ENABLED=true
+    np = None
+
+from shared.config import settings
+from shared.sketches import DDSketch
+from .idempotency import StoredResponse
+
+CACHEABLE_PATHS = ("v1/chat/completions", "v1/completions")
+# Compared by similarity; every other request field must match exactly
+PROMPT_FIELDS = ("messages", "prompt", "stream", "user")
+MESSAGE_FIELDS = {"role", "content", "name"}
+
+# (tenant, path, model, digest of the other request fields)
+Namespace = Tuple[str, str, str, str]
+
+
+class CacheQuery(NamedTuple):
+    namespace: Namespace
+    text: str
+    lookup: bool  # False with Cache-Control: no-cache
+    store: bool  # False with Cache-Control: no-store
+
+
+class CacheLookup(NamedTuple):
+    response: Optional[StoredResponse]  # Cached response, None on a miss
+    similarity: float  # Of the closest cached prompt, 0 if there is none
+    vector: Optional["np.ndarray"]  # Unit embedding of the prompt, None if embedding failed
+
+
+class CacheEntry:
+    __slots__ = ("namespace", "row", "response", "expires_at")
+
+    def __init__(self, namespace: Namespace, row: int, response: StoredResponse, expires_at: float):
+        self.namespace = namespace
+        self.row = row
+        self.response = response
+        self.expires_at = expires_at
+
+
+def prompt_text(body: dict) -> Optional[str]:
+    """
+    The text of a request's prompt, None if it is not plain text (images,
+    tool calls, token IDs or several prompts).
+    """
+    messages = body.get("messages")
+    if messages is not None:
+        if not isinstance(messages, list):
+            return None
+        lines = []
+        for message in messages:
+            if not isinstance(message, dict) or not message.keys() <= MESSAGE_FIELDS:
+                return None
+            content = message.get("content")
+            if isinstance(content, list):
+                if not all(isinstance(part, dict) and part.get("type") == "text" for part in content):
+                    return None
+                content = "\n".join(str(part.get("text", "")) for part in content)
+            elif not isinstance(content, str):
+                return None
+            lines.append(f"{message.get('role')}: {content}")
+        return "\n".join(lines)
+    prompt = body.get("prompt")
+    return prompt if isinstance(prompt, str) else None
+
+
+class VectorIndex:
+    """Unit vectors of one namespace, in the rows of a matrix grown as needed."""
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.keys: List[int] = []  # Entry ID of each row
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, vector: "np.ndarray", key: int) -> int:
+        """Append a vector, returning its row."""
+        row = len(self.keys)
+        if row == len(self.vectors):
+            grown = np.empty((2 * row, self.vectors.shape[1]), dtype=np.float32)
+            grown[:row] = self.vectors
+            self.vectors = grown
+        self.vectors[row] = vector
+        self.keys.append(key)
+        return row
+
+    def remove(self, row: int) -> Optional[int]:
+        """Remove a row by moving the last one into it, returning the moved entry's ID."""
+        last = len(self.keys) - 1
+        moved = None
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            moved = self.keys[row] = self.keys[last]
+        self.keys.pop()
+        if len(self.vectors) > 16 and 4 * len(self.keys) <= len(self.vectors):
+            self.vectors = self.vectors[: len(self.vectors) // 2].copy()
+        return moved
+
+    def search(self, vector: "np.ndarray") -> Tuple[int, float]:
+        """(row, cosine similarity) of the closest vector."""
+        similarities = self.vectors[: len(self.keys)] @ vector
+        row = int(np.argmax(similarities))
+        return row, float(similarities[row])
+
+
+class SemanticCache:
+    """
+    Responses to completion requests, returned for later requests whose
+    prompt is close enough in meaning.
+
+    Prompts are embedded with ``embed`` (the backend's /v1/embeddings) and
+    compared by cosine similarity with the cached prompts of the same
+    namespace: the same tenant, endpoint and model, with every request field
+    other than the prompt equal. The closest one at or above ``threshold``
+    is a hit. Each namespace is an exact search over a NumPy matrix, which
+    takes well under a millisecond for thousands of entries.
+
+    Responses are kept for ``ttl_seconds``, within ``max_entries`` and
+    ``max_bytes``; the least recently used are evicted first. Only
+    successful non-streaming responses are cached, and a request that
+    cannot be embedded is passed through. Entries are per gateway process.
+
+    Call from the event loop only.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[str], Awaitable[Sequence[float]]],
+        threshold: float = 0.95,
+        ttl_seconds: float = 3600,
+        max_entries: int = 10000,
+        max_bytes: int = 67108864,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.dim: Optional[int] = None  # Set by the first embedding
+        self.indexes: Dict[Namespace, VectorIndex] = {}
+        self.entries: Dict[int, CacheEntry] = OrderedDict()  # Least recently used first
+        self.next_id = 0
+        self.bytes = 0
+        self.embed_ms = DDSketch()
+        self.search_ms = DDSketch()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.expired = 0
+        self.embed_errors = 0
+
+    def query(self, tenant: str, path: str, body: bytes, cache_control: Optional[str] = None) -> Optional[CacheQuery]:
+        """The cache query for a request, None if it is not cacheable."""
+        if path not in CACHEABLE_PATHS:
+            return None
+        directives = {d.strip().lower() for d in (cache_control or "").split(",")}
+        if "no-cache" in directives and "no-store" in directives:
+            return None
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(request, dict) or request.get("stream"):
+            return None
+        text = prompt_text(request)
+        if not text:
+            return None
+        others = {k: v for k, v in request.items() if k not in PROMPT_FIELDS}
+        digest = hashlib.sha256(json.dumps(others, sort_keys=True).encode()).hexdigest()[:16]
+        namespace = (tenant, path, str(request.get("model", "")), digest)
+        return CacheQuery(namespace, text, "no-cache" not in directives, "no-store" not in directives)
+
+    async def lookup(self, query: CacheQuery) -> CacheLookup:
+        """Embed a query's prompt and find the closest cached response above the threshold."""
+        start = time.perf_counter()
+        try:
+            vector = np.asarray(await self.embed(query.text), dtype=np.float32)
+            norm = float(np.linalg.norm(vector))
+            if vector.ndim != 1 or not norm or (self.dim is not None and len(vector) != self.dim):
+                raise ValueError(f"Unusable embedding of shape {vector.shape}")
+        except Exception as e:
+            self.embed_errors += 1
+            print(f"Semantic cache embedding failed: {e}")
+            return CacheLookup(None, 0.0, None)
+        vector /= norm
+        self.dim = len(vector)
+        self.embed_ms.add((time.perf_counter() - start) * 1000)
+
+        if not query.lookup:
+            return CacheLookup(None, 0.0, vector)
+        index = self.indexes.get(query.namespace)
+        if index is None:
+            self.misses += 1
+            return CacheLookup(None, 0.0, vector)
+        start = time.perf_counter()
+        row, similarity = index.search(vector)
+        self.search_ms.add((time.perf_counter() - start) * 1000)
+
+        key = index.keys[row]
+        entry = self.entries[key]
+        if entry.expires_at <= self.clock():
+            self.expired += 1
+            self._remove(key)
+        elif similarity >= self.threshold:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return CacheLookup(entry.response, similarity, vector)
+        self.misses += 1
+        return CacheLookup(None, similarity, vector)
+
+    def store(self, query: CacheQuery, vector: "np.ndarray", response: StoredResponse) -> bool:
+        """Cache a response to a query that missed, returning whether it was kept."""
+        size = len(response.content)
+        if not query.store or response.status_code != 200 or size > self.max_bytes:
+            return False
+        index = self.indexes.get(query.namespace)
+        if index is None:
+            index = self.indexes[query.namespace] = VectorIndex(len(vector))
+        key = self.next_id
+        self.next_id += 1
+        self.entries[key] = CacheEntry(query.namespace, index.add(vector, key), response, self.clock() + self.ttl_seconds)
+        self.bytes += size
+        self.stored += 1
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            if self.entries[oldest].expires_at <= self.clock():
+                self.expired += 1
+            else:
+                self.evicted += 1
+            self._remove(oldest)
+        return True
+
+    def _remove(self, key: int) -> None:
+        entry = self.entries.pop(key)
+        self.bytes -= len(entry.response.content)
+        index = self.indexes[entry.namespace]
+        moved = index.remove(entry.row)
+        if moved is not None:
+            self.entries[moved].row = entry.row
+        if not index:
+            del self.indexes[entry.namespace]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+
+        def quantiles(sketch: DDSketch) -> dict:
+            return {
+                f"p{q}": round(sketch.quantile(q / 100), 3) if sketch.count else None
+                for q in (50, 99)
+            }
+
+        return {
+            "entries": len(self.entries),
+            "namespaces": len(self.indexes),
+            "bytes": self.bytes,
+            "vector_bytes": sum(index.vectors.nbytes for index in self.indexes.values()),
+            "lookups": lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "stored": self.stored,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "embed_errors": self.embed_errors,
+            "embed_ms": quantiles(self.embed_ms),
+            "search_ms": quantiles(self.search_ms),
+            "threshold": self.threshold,
+        }
+
+
+def create_semantic_cache(embed: Callable[[str], Awaitable[Sequence[float]]]) -> Optional[SemanticCache]:
+    """Semantic cache for SEMANTIC_CACHE_ENABLED: None when disabled."""
+    if not settings.semantic_cache_enabled:
+        return None
+    if np is None:
+        raise RuntimeError("The semantic cache requires numpy (pip install numpy)")
+    return SemanticCache(
+        embed,
+        threshold=settings.semantic_cache_threshold,
+        ttl_seconds=settings.semantic_cache_ttl_seconds,
+        max_entries=settings.semantic_cache_max_entries,
+        max_bytes=settings.semantic_cache_max_bytes,
+    )
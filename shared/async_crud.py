@@ -0,0 +1,82 @@
+"""Async versions of the CRUD operations on the gateway hot path.
+
+Mirrors the corresponding functions in shared.crud, for use with the
+sessions of shared.async_database.
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .crud import new_request_log, partition_log_values
+from .models import APIKey, ConfigChange, RequestLog
+from . import log_partitions
+
+
+async def get_api_key_by_hash(db: AsyncSession, key_hash: bytes) -> Optional[APIKey]:
+    """Get active API key by key digest, see crud.hash_api_key."""
+    result = await db.execute(
+        select(APIKey).where(APIKey.key_hash == key_hash, APIKey.is_active == True).limit(1)
+    )
+    return result.scalars().first()
+
+
+async def get_api_key_by_id(db: AsyncSession, key_id: int) -> Optional[APIKey]:
+    """Get API key by ID, active or not."""
+    return (await db.execute(select(APIKey).where(APIKey.id == key_id))).scalars().first()
+
+
+async def create_request_log(
+    db: AsyncSession,
+    user_id: str,
+    api_key_id: Optional[int],
+    endpoint: str,
+    method: str,
+    status_code: int,
+    duration_ms: float,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+    model: Optional[str] = None,
+    error: Optional[str] = None,
+) -> RequestLog:
+    """Create a request log entry, in the current partition when logs are partitioned."""
+    log = new_request_log(
+        user_id=user_id,
+        api_key_id=api_key_id,
+        endpoint=endpoint,
+        method=method,
+        status_code=status_code,
+        duration_ms=duration_ms,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        model=model,
+        error=error,
+    )
+    if log_partitions.partitioning_enabled():
+        log.id = await log_partitions.insert_log_async(db, partition_log_values(log))
+        await db.commit()
+        return log
+
+    db.add(log)
+    await db.commit()
+    return log
+
+
+async def latest_config_version(db: AsyncSession) -> int:
+    """Version of the most recent config change, 0 if there are none."""
+    return (await db.execute(select(func.max(ConfigChange.id)))).scalar() or 0
+
+
+async def get_config_changes(
+    db: AsyncSession,
+    after_version: int,
+    since: Optional[datetime] = None,
+    limit: int = 10000,
+) -> List[ConfigChange]:
+    """Config changes after a version, oldest first, see crud.get_config_changes."""
+    condition = ConfigChange.id > after_version
+    if since is not None:
+        condition = condition | (ConfigChange.created_at >= since)
+    result = await db.execute(select(ConfigChange).where(condition).order_by(ConfigChange.id).limit(limit))
+    return list(result.scalars())
@@ -0,0 +1,61 @@
+"""Async database engine and sessions for the gateway hot path.
+
+Uses the same DATABASE_URL and engine profile as shared.database, with the
+async driver for the dialect (aiosqlite for SQLite, asyncpg for PostgreSQL),
+so API key lookups and request log writes never block the event loop.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from .config import settings
+from .database import DATABASE_URL, _apply_sqlite_pragmas, _is_memory_sqlite, engine_profile
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_url(url: str) -> str:
+    """The URL with its dialect's async driver, e.g. sqlite:// -> sqlite+aiosqlite://."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend} databases")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def make_async_engine(url: str, profile: str = "auto") -> AsyncEngine:
+    """Create an async engine tuned like shared.database.make_engine."""
+    profile = engine_profile(url, profile)
+    options = {"echo": False}
+    if (profile == "sqlite" and not _is_memory_sqlite(url)) or profile == "postgresql":
+        options.update(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+        )
+    if profile == "sqlite" and not _is_memory_sqlite(url):
+        # aiosqlite defaults to NullPool, which opens a connection (and runs
+        # the pragmas) for every session
+        options["poolclass"] = AsyncAdaptedQueuePool
+    if profile == "postgresql":
+        options.update(pool_recycle=settings.db_pool_recycle, pool_pre_ping=True)
+
+    new_engine = create_async_engine(async_url(url), **options)
+    if profile == "sqlite":
+        event.listen(new_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    return new_engine
+
+
+async_engine = make_async_engine(DATABASE_URL, settings.database_profile)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db():
+    """Dependency for getting an async database session."""
+    async with AsyncSessionLocal() as db:
+        yield db
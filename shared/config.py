@@ -9,6 +9,15 @@ class Settings(BaseSettings):
 
     # Database
     database_url: str = "sqlite:///./llm_api.db"
+    database_replica_url: str = ""  # Read replica for analytics queries
+    database_profile: str = "auto"  # auto, sqlite, postgresql or none (SQLAlchemy defaults)
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800  # PostgreSQL only
+    sqlite_synchronous: str = "NORMAL"  # OFF, NORMAL, FULL or EXTRA
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size: int = 268435456  # 256 MB
 
     # Services
     gateway_host: str = "0.0.0.0"
@@ -29,6 +38,8 @@ class Settings(BaseSettings):
     admin_secret_key: str = "change-this-secret-key-in-production"
     admin_algorithm: str = "HS256"
     admin_token_expire_minutes: int = 60
+    admin_token_cache_ttl_seconds: int = 30  # Cache admin users per token, 0 disables the cache
+    password_hash_workers: int = 2  # Threads for bcrypt password checks
 
     # Rate Limits (default tiers)
     rate_limit_free_per_minute: int = 10
@@ -40,18 +51,88 @@ class Settings(BaseSettings):
     rate_limit_premium_per_minute: int = 100
     rate_limit_premium_per_hour: int = 1000
 
+    # Rate limiter state is saved here periodically and restored on startup ("" disables)
+    rate_limit_snapshot_path: str = "./rate_limiter.snapshot"
+    rate_limit_snapshot_seconds: float = 10.0
+    rate_limit_sweep_seconds: float = 60.0  # Idle users (nothing in the last hour) are evicted this often
+    rate_limit_max_principals: int = 0  # Track at most this many users, evicting the least recent; 0 = no limit
+    # Multiple gateways: "shared" enforces approximate global limits, synced through the database
+    rate_limit_mode: str = "local"  # local or shared
+    rate_limit_node_id: str = ""  # Defaults to <hostname>-<pid>
+    rate_limit_sync_seconds: float = 1.0  # Shorter is more accurate, at more database writes
+    rate_limit_share_floor: float = 0.1  # Part of each limit spread evenly over the nodes regardless of traffic
+
+    # Request log storage
+    log_partitioning: str = "none"  # none, daily or monthly
+    log_retention_days: int = 0  # Drop partitions older than this, 0 keeps everything
+    log_archive_dir: str = ""  # Archive dropped partitions to Parquet here (requires pyarrow)
+
+    # Usage rollups
+    usage_rollup_interval_seconds: int = 30
+    usage_rollup_batch_size: int = 10000
+    usage_rollup_settle_seconds: float = 30.0  # Logs are counted once this old, so late commits are not skipped
+    usage_rollup_minute_retention_days: int = 2
+    usage_rollup_hour_retention_days: int = 90
+
+    # Latency sketches
+    latency_sketch_flush_seconds: int = 30
+    latency_sketch_relative_accuracy: float = 0.01
+
+    # Organization / team / user / key quotas
+    quota_flush_seconds: float = 5.0  # Gateways share quota usage through the database this often
+
+    # Idempotency-Key: retries of a POST reuse the original upstream call (per gateway process)
+    idempotency_ttl_seconds: float = 600.0  # Completed responses are kept this long, 0 disables
+    idempotency_max_entries: int = 10000
+    idempotency_max_bytes: int = 67108864  # 64 MB of stored responses
+
+    # Batch API (/v1/files, /v1/batches)
+    batch_dir: str = "./batches"  # Input and result files, local to the gateway
+    batch_max_requests: int = 50000
+    batch_max_file_bytes: int = 104857600  # 100 MB
+    batch_concurrency: int = 4  # Batch requests sent to the backend at once
+    batch_peak_concurrency: int = 1  # ... during batch_peak_hours
+    batch_peak_hours: str = ""  # e.g. "9-18", in the gateway's local time
+    batch_interactive_threshold: int = 8  # Interactive requests in flight at which batches back off, 0 = never
+
+    # Semantic response cache: near-duplicate prompts get a cached response (per gateway process, needs numpy)
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.95  # Cosine similarity of the prompt embeddings for a hit
+    semantic_cache_embedding_model: str = ""  # Model for the backend's /v1/embeddings, empty = backend default
+    semantic_cache_embedding_timeout_seconds: float = 2.0  # Slower embeddings are passed through uncached
+    semantic_cache_ttl_seconds: float = 3600.0
+    semantic_cache_max_entries: int = 10000
+    semantic_cache_max_bytes: int = 67108864  # 64 MB of cached responses
+
+    # Gateway API key cache and invalidation
+    key_cache_ttl_seconds: int = 60  # Upper bound on staleness if invalidations are missed, 0 disables the cache
+    key_cache_max_entries: int = 100000
+    config_poll_seconds: float = 1.0  # Gateways poll the config change feed this often
+    config_change_retention_hours: int = 24
+    gateway_internal_urls: List[str] = []  # Gateways the admin service pushes invalidations to
+    internal_api_token: str = ""  # Shared secret for gateway /internal endpoints
+
     # CORS
     cors_origins: List[str] = ["*"]
 
     # Email Verification
     allowed_email_domains: List[str] = ["company.com", "company.co.kr"]  # Whitelist
     verification_code_expire_minutes: int = 5
+    verification_store: str = "memory"  # memory or database (shared by all admin processes)
+    verification_sweep_seconds: int = 60  # Expired codes are dropped this often
     smtp_host: str = "localhost"
     smtp_port: int = 587
     smtp_user: str = ""
     smtp_password: str = ""
     smtp_from_email: str = "noreply@company.com"
     use_mock_email: bool = True  # Set to False in production with real SMTP
+    smtp_use_tls: bool = True
+    smtp_pool_size: int = 2  # Reused SMTP connections
+    smtp_timeout_seconds: float = 10.0
+    email_queue_workers: int = 2
+    email_queue_max_size: int = 1000
+    email_max_retries: int = 3
+    email_retry_backoff_seconds: float = 1.0
 
     class Config:
         env_file = ".env"
@@ -1,16 +1,46 @@
 """CRUD operations for database models."""
+import hashlib
+import secrets
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, func
+from sqlalchemy import desc, func, update
+from sqlalchemy.exc import IntegrityError
 from passlib.context import CryptContext
 
-from .models import APIKey, User, RequestLog, AdminUser, VerificationCode
+from .models import (
+    APIKey, User, RequestLog, AdminUser, VerificationCode, LatencySketch, ConfigChange, Quota, Team, TeamMember,
+)
+from .sketches import DDSketch
+from . import log_partitions, usage_rollups
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 # API Key CRUD
+KEY_PREFIX_LENGTH = 16  # "sk-internal-" plus 4 random characters
+
+
+def generate_api_key() -> str:
+    """Generate a new random API key string."""
+    return f"sk-internal-{secrets.token_urlsafe(32)}"
+
+
+def hash_api_key(key: str) -> bytes:
+    """
+    SHA-256 digest of an API key, as stored in APIKey.key_hash.
+
+    Keys are 256-bit random tokens, so a fast unsalted hash is enough to
+    make the stored digests useless to someone reading the database.
+    """
+    return hashlib.sha256(key.encode()).digest()
+
+
+def api_key_columns(key: str) -> dict:
+    """APIKey column values identifying a raw key (the key itself is never stored)."""
+    return {"key_hash": hash_api_key(key), "key_prefix": key[:KEY_PREFIX_LENGTH]}
+
+
 def create_api_key(
     db: Session,
     key: str,
@@ -20,9 +50,9 @@ def create_api_key(
     created_by: Optional[str] = None,
     expires_at: Optional[datetime] = None,
 ) -> APIKey:
-    """Create a new API key."""
+    """Create a new API key. Only its hash and display prefix are stored."""
     db_key = APIKey(
-        key=key,
+        **api_key_columns(key),
         user_id=user_id,
         tier=tier,
         description=description,
@@ -36,8 +66,13 @@ def create_api_key(
 
 
 def get_api_key(db: Session, key: str) -> Optional[APIKey]:
-    """Get API key by key string."""
-    return db.query(APIKey).filter(APIKey.key == key, APIKey.is_active == True).first()
+    """Get API key by key string (looked up by its hash)."""
+    return get_api_key_by_hash(db, hash_api_key(key))
+
+
+def get_api_key_by_hash(db: Session, key_hash: bytes) -> Optional[APIKey]:
+    """Get active API key by key digest, see hash_api_key."""
+    return db.query(APIKey).filter(APIKey.key_hash == key_hash, APIKey.is_active == True).first()
 
 
 def get_api_key_by_id(db: Session, key_id: int) -> Optional[APIKey]:
@@ -45,9 +80,61 @@ def get_api_key_by_id(db: Session, key_id: int) -> Optional[APIKey]:
     return db.query(APIKey).filter(APIKey.id == key_id).first()
 
 
-def list_api_keys(db: Session, skip: int = 0, limit: int = 100) -> List[APIKey]:
-    """List all API keys."""
-    return db.query(APIKey).order_by(desc(APIKey.created_at)).offset(skip).limit(limit).all()
+def _filter_api_keys(
+    query,
+    tier: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    created_by: Optional[str] = None,
+    expires_before: Optional[datetime] = None,
+    user_prefix: Optional[str] = None,
+):
+    """Apply the admin listing filters to an API key query."""
+    if tier is not None:
+        query = query.filter(APIKey.tier == tier)
+    if is_active is not None:
+        query = query.filter(APIKey.is_active == is_active)
+    if created_by is not None:
+        query = query.filter(APIKey.created_by == created_by)
+    if expires_before is not None:
+        query = query.filter(APIKey.expires_at < expires_before)
+    if user_prefix:
+        # Range instead of LIKE so the user_id index is used on every backend
+        query = query.filter(APIKey.user_id >= user_prefix, APIKey.user_id < user_prefix + "\U0010ffff")
+    return query
+
+
+def list_api_keys(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[int] = None,
+    **filters,
+) -> List[APIKey]:
+    """
+    List API keys, newest first.
+
+    Args:
+        db: Database session
+        skip: Offset (kept for compatibility, prefer cursor)
+        limit: Page size
+        cursor: Only keys with an id below this, i.e. the last id of the previous page
+        **filters: tier, is_active, created_by, expires_before, user_prefix
+
+    Returns:
+        One page of API keys
+    """
+    query = _filter_api_keys(db.query(APIKey), **filters)
+    if cursor is not None:
+        query = query.filter(APIKey.id < cursor)
+    query = query.order_by(desc(APIKey.id))
+    if skip:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+
+def count_api_keys(db: Session, **filters) -> int:
+    """Count API keys matching the admin listing filters."""
+    return _filter_api_keys(db.query(func.count(APIKey.id)), **filters).scalar()
 
 
 def update_api_key(
@@ -70,6 +157,7 @@ def update_api_key(
         db_key.description = description
 
     db_key.updated_at = datetime.utcnow()
+    record_config_changes(db, "api_key", [key_id], "update")
     db.commit()
     db.refresh(db_key)
     return db_key
@@ -83,11 +171,166 @@ def delete_api_key(db: Session, key_id: int) -> bool:
 
     db_key.is_active = False
     db_key.updated_at = datetime.utcnow()
+    record_config_changes(db, "api_key", [key_id], "deactivate")
     db.commit()
     return True
 
 
+# Bulk API Key operations (one transaction per call)
+def find_existing_keys(db: Session, keys: List[str]) -> set:
+    """Which of the given key strings already exist."""
+    by_hash = {hash_api_key(key): key for key in keys}
+    return {by_hash[h] for (h,) in db.query(APIKey.key_hash).filter(APIKey.key_hash.in_(list(by_hash)))}
+
+
+def get_api_keys_by_ids(db: Session, key_ids: List[int]) -> Dict[int, APIKey]:
+    """API keys by ID, for the IDs that exist."""
+    return {k.id: k for k in db.query(APIKey).filter(APIKey.id.in_(key_ids))}
+
+
+def bulk_create_api_keys(db: Session, rows: List[dict]) -> List[int]:
+    """
+    Create many API keys in a single transaction.
+
+    Args:
+        db: Database session
+        rows: APIKey column values per key, with the raw key under "key"
+
+    Returns:
+        IDs of the created keys, in the order of rows
+    """
+    now = datetime.utcnow()
+    db_keys = [
+        APIKey(created_at=now, updated_at=now, **api_key_columns(row["key"]),
+               **{k: v for k, v in row.items() if k != "key"})
+        for row in rows
+    ]
+    db.add_all(db_keys)
+    db.flush()
+    ids = [k.id for k in db_keys]
+    db.commit()
+    return ids
+
+
+def bulk_update_api_keys(db: Session, updates: Dict[int, dict]) -> None:
+    """Update many API keys by ID in a single transaction."""
+    if not updates:
+        return
+    now = datetime.utcnow()
+    db.execute(
+        update(APIKey),
+        [{"id": key_id, "updated_at": now, **values} for key_id, values in updates.items()],
+    )
+    record_config_changes(db, "api_key", list(updates), "update")
+    db.commit()
+
+
+def bulk_rotate_api_keys(
+    db: Session,
+    old_keys: List[APIKey],
+    new_keys: List[str],
+    created_by: Optional[str],
+    old_expires_at: Optional[datetime] = None,
+) -> List[int]:
+    """
+    Replace keys with new ones for the same users in a single transaction.
+
+    Each new key copies the user, tier, expiry and description of the key it
+    replaces. The old key is deactivated, or kept until old_expires_at when
+    a grace period is given.
+
+    Returns:
+        IDs of the new keys, in the order of old_keys
+    """
+    now = datetime.utcnow()
+    replacements = [
+        APIKey(
+            **api_key_columns(new_key),
+            user_id=old.user_id,
+            tier=old.tier,
+            expires_at=old.expires_at,
+            description=old.description,
+            created_by=created_by,
+            created_at=now,
+            updated_at=now,
+        )
+        for old, new_key in zip(old_keys, new_keys)
+    ]
+    db.add_all(replacements)
+    for old in old_keys:
+        if old_expires_at is None:
+            old.is_active = False
+        else:
+            old.expires_at = min(old.expires_at, old_expires_at) if old.expires_at else old_expires_at
+        old.updated_at = now
+    record_config_changes(db, "api_key", [old.id for old in old_keys], "rotate")
+    db.flush()
+    ids = [k.id for k in replacements]
+    db.commit()
+    return ids
+
+
+# Config change feed (gateway cache invalidation)
+def record_config_changes(db: Session, entity: str, entity_ids: List[int], action: str) -> None:
+    """Add change events to the session; they are committed with the change itself."""
+    db.add_all([ConfigChange(entity=entity, entity_id=entity_id, action=action) for entity_id in entity_ids])
+
+
+def latest_config_version(db: Session) -> int:
+    """Version of the most recent config change, 0 if there are none."""
+    return db.query(func.max(ConfigChange.id)).scalar() or 0
+
+
+def get_config_changes(
+    db: Session,
+    after_version: int,
+    since: Optional[datetime] = None,
+    limit: int = 10000,
+) -> List[ConfigChange]:
+    """
+    Config changes after a version, oldest first.
+
+    Args:
+        db: Database session
+        after_version: Last version the caller has applied
+        since: Also return changes created after this time. Versions are
+            assigned at insert but may commit out of order, so pollers
+            re-read a short window to pick up late commits.
+        limit: Maximum number of changes
+    """
+    condition = ConfigChange.id > after_version
+    if since is not None:
+        condition = condition | (ConfigChange.created_at >= since)
+    return db.query(ConfigChange).filter(condition).order_by(ConfigChange.id).limit(limit).all()
+
+
+def prune_config_changes(db: Session, older_than: datetime) -> int:
+    """Delete config changes older than a time, always keeping the latest one."""
+    latest = latest_config_version(db)
+    count = db.query(ConfigChange).filter(
+        ConfigChange.created_at < older_than, ConfigChange.id < latest
+    ).delete(synchronize_session=False)
+    db.commit()
+    return count
+
+
 # Request Log CRUD
+def new_request_log(prompt_tokens: int = 0, completion_tokens: int = 0, **fields) -> RequestLog:
+    """Unsaved request log with its total token count."""
+    return RequestLog(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+        **fields,
+    )
+
+
+def partition_log_values(log: RequestLog) -> dict:
+    """Column values for inserting a log into its time partition (stamps it now)."""
+    log.timestamp = datetime.utcnow()
+    return {c.name: getattr(log, c.name) for c in RequestLog.__table__.columns if c.name != "id"}
+
+
 def create_request_log(
     db: Session,
     user_id: str,
@@ -101,8 +344,8 @@ def create_request_log(
     model: Optional[str] = None,
     error: Optional[str] = None,
 ) -> RequestLog:
-    """Create a request log entry."""
-    log = RequestLog(
+    """Create a request log entry, in the current partition when logs are partitioned."""
+    log = new_request_log(
         user_id=user_id,
         api_key_id=api_key_id,
         endpoint=endpoint,
@@ -111,33 +354,137 @@ def create_request_log(
         duration_ms=duration_ms,
         prompt_tokens=prompt_tokens,
         completion_tokens=completion_tokens,
-        total_tokens=prompt_tokens + completion_tokens,
         model=model,
         error=error,
     )
+    if log_partitions.partitioning_enabled():
+        log.id = log_partitions.insert_log(db, partition_log_values(log))
+        db.commit()
+        return log
+
     db.add(log)
     db.commit()
     return log
 
 
-def get_usage_stats(db: Session, user_id: Optional[str] = None, days: int = 7):
-    """Get usage statistics."""
-    query = db.query(
-        func.date(RequestLog.timestamp).label("date"),
-        func.count(RequestLog.id).label("requests"),
-        func.sum(RequestLog.total_tokens).label("total_tokens"),
-        func.sum(RequestLog.prompt_tokens).label("prompt_tokens"),
-        func.sum(RequestLog.completion_tokens).label("completion_tokens"),
+def get_usage_stats(
+    db: Session,
+    user_id: Optional[str] = None,
+    days: int = 7,
+    granularity: str = "day",
+    by_model: bool = False,
+    model: Optional[str] = None,
+    api_key_id: Optional[int] = None,
+):
+    """Get usage statistics from the usage rollups."""
+    return usage_rollups.query_usage(
+        db,
+        granularity=granularity,
+        days=days,
+        user_id=user_id,
+        api_key_id=api_key_id,
+        model=model,
+        by_model=by_model,
     )
 
-    if user_id:
-        query = query.filter(RequestLog.user_id == user_id)
 
-    query = query.filter(
-        RequestLog.timestamp >= datetime.utcnow() - func.timedelta(days=days)
-    )
+# Latency Sketch CRUD
+# Sketch key: (metric, bucket_start, user_id, model)
+SketchKey = Tuple[str, datetime, str, str]
+
+
+def _merge_sketches(db: Session, sketches: Dict[SketchKey, DDSketch]) -> Dict[SketchKey, DDSketch]:
+    """Merge sketches into their stored rows; returns the ones that lost an update race."""
+    conflicts = {}
+    for key, sketch in sketches.items():
+        metric, bucket_start, user_id, model = key
+        row = (
+            db.query(LatencySketch)
+            .filter(
+                LatencySketch.metric == metric,
+                LatencySketch.bucket_start == bucket_start,
+                LatencySketch.user_id == user_id,
+                LatencySketch.model == model,
+            )
+            .first()
+        )
+        if row is None:
+            db.add(LatencySketch(
+                metric=metric,
+                bucket_start=bucket_start,
+                user_id=user_id,
+                model=model,
+                count=sketch.count,
+                sketch=sketch.to_bytes(),
+            ))
+            continue
+
+        merged = DDSketch.from_bytes(row.sketch)
+        merged.merge(sketch)
+        updated = (
+            db.query(LatencySketch)
+            .filter(LatencySketch.id == row.id, LatencySketch.version == row.version)
+            .update(
+                {
+                    LatencySketch.sketch: merged.to_bytes(),
+                    LatencySketch.count: merged.count,
+                    LatencySketch.version: row.version + 1,
+                },
+                synchronize_session=False,
+            )
+        )
+        if not updated:
+            conflicts[key] = sketch
+    db.flush()
+    return conflicts
 
-    return query.group_by(func.date(RequestLog.timestamp)).all()
+
+def merge_latency_sketches(db: Session, sketches: Dict[SketchKey, DDSketch], retries: int = 5) -> None:
+    """
+    Merge in-memory sketches into the stored per-bucket sketches.
+
+    Everything is merged in one transaction; sketches that raced with
+    another gateway process are retried one at a time.
+    """
+    try:
+        pending = _merge_sketches(db, sketches)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        pending = sketches
+
+    for key, sketch in pending.items():
+        for _ in range(retries):
+            try:
+                if not _merge_sketches(db, {key: sketch}):
+                    db.commit()
+                    break
+            except IntegrityError:
+                pass
+            db.rollback()
+        else:
+            raise RuntimeError(f"Could not merge latency sketch for {key} after {retries} attempts")
+
+
+def get_latency_sketches(
+    db: Session,
+    metric: str,
+    since: datetime,
+    until: datetime,
+    user_id: Optional[str] = None,
+    model: Optional[str] = None,
+) -> Iterable[LatencySketch]:
+    """Stored sketches of a metric for buckets in [since, until)."""
+    query = db.query(LatencySketch).filter(
+        LatencySketch.metric == metric,
+        LatencySketch.bucket_start >= since,
+        LatencySketch.bucket_start < until,
+    )
+    if user_id:
+        query = query.filter(LatencySketch.user_id == user_id)
+    if model is not None:
+        query = query.filter(LatencySketch.model == model)
+    return query.yield_per(1000)
 
 
 # Admin User CRUD
@@ -194,10 +541,15 @@ def create_verification_code(
     return verification
 
 
-def get_valid_verification_code(db: Session, email: str, code: str) -> Optional[VerificationCode]:
-    """Get a valid (not expired, not used) verification code."""
+def consume_verification_code(db: Session, email: str, code: str) -> bool:
+    """
+    Mark a valid (not expired, not used) verification code as used.
+
+    A single conditional UPDATE, so a code can only be consumed once even
+    by concurrent requests. Returns whether a code was consumed.
+    """
     now = datetime.utcnow()
-    return (
+    count = (
         db.query(VerificationCode)
         .filter(
             VerificationCode.email == email,
@@ -205,16 +557,10 @@ def get_valid_verification_code(db: Session, email: str, code: str) -> Optional[
             VerificationCode.is_used == False,
             VerificationCode.expires_at > now,
         )
-        .first()
+        .update({VerificationCode.is_used: True}, synchronize_session=False)
     )
-
-
-def mark_verification_code_used(db: Session, verification_id: int):
-    """Mark verification code as used."""
-    verification = db.query(VerificationCode).filter(VerificationCode.id == verification_id).first()
-    if verification:
-        verification.is_used = True
-        db.commit()
+    db.commit()
+    return count > 0
 
 
 def cleanup_expired_codes(db: Session) -> int:
@@ -237,3 +583,83 @@ def get_api_keys_by_user(db: Session, user_id: str) -> List[APIKey]:
         .order_by(desc(APIKey.created_at))
         .all()
     )
+
+
+# Team / Quota CRUD
+def list_teams(db: Session) -> List[Tuple[Team, List[str]]]:
+    """All teams with the user IDs of their members."""
+    members: Dict[int, List[str]] = {}
+    for member in db.query(TeamMember).order_by(TeamMember.user_id):
+        members.setdefault(member.team_id, []).append(member.user_id)
+    return [(team, members.get(team.id, [])) for team in db.query(Team).order_by(Team.name)]
+
+
+def get_team(db: Session, name: str) -> Optional[Team]:
+    """Get team by name."""
+    return db.query(Team).filter(Team.name == name).first()
+
+
+def create_team(db: Session, name: str, organization: Optional[str] = None) -> Team:
+    """Create a team."""
+    team = Team(name=name, organization=organization)
+    db.add(team)
+    db.commit()
+    db.refresh(team)
+    return team
+
+
+def set_team_members(db: Session, team: Team, user_ids: List[str]) -> None:
+    """Replace a team's members; users move here from any other team."""
+    db.query(TeamMember).filter(TeamMember.team_id == team.id).delete(synchronize_session=False)
+    if user_ids:
+        db.query(TeamMember).filter(TeamMember.user_id.in_(user_ids)).delete(synchronize_session=False)
+        db.add_all([TeamMember(user_id=user_id, team_id=team.id) for user_id in dict.fromkeys(user_ids)])
+    db.commit()
+
+
+def delete_team(db: Session, team: Team) -> None:
+    """Delete a team and its memberships (quotas on the team are kept)."""
+    db.query(TeamMember).filter(TeamMember.team_id == team.id).delete(synchronize_session=False)
+    db.delete(team)
+    db.commit()
+
+
+def list_quotas(db: Session, scope: Optional[str] = None, subject: Optional[str] = None) -> List[Quota]:
+    """Quotas, optionally of one scope and/or subject."""
+    query = db.query(Quota)
+    if scope:
+        query = query.filter(Quota.scope == scope)
+    if subject:
+        query = query.filter(Quota.subject == subject)
+    return query.order_by(Quota.scope, Quota.subject, Quota.window).all()
+
+
+def set_quota(
+    db: Session,
+    scope: str,
+    subject: str,
+    window: str,
+    max_requests: Optional[int],
+    max_tokens: Optional[int],
+) -> Quota:
+    """Create or replace the quota of a subject and window."""
+    quota = (
+        db.query(Quota)
+        .filter(Quota.scope == scope, Quota.subject == subject, Quota.window == window)
+        .first()
+    )
+    if quota is None:
+        quota = Quota(scope=scope, subject=subject, window=window)
+        db.add(quota)
+    quota.max_requests = max_requests
+    quota.max_tokens = max_tokens
+    db.commit()
+    db.refresh(quota)
+    return quota
+
+
+def delete_quota(db: Session, quota_id: int) -> bool:
+    """Delete a quota. Returns whether it existed."""
+    count = db.query(Quota).filter(Quota.id == quota_id).delete(synchronize_session=False)
+    db.commit()
+    return count > 0
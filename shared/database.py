@@ -1,21 +1,98 @@
 """Shared database configuration and session management."""
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from .config import settings
+from .migrations import upgrade
+
 # Database URL - use SQLite for simplicity, can be changed to PostgreSQL
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./llm_api.db")
 
-# Create engine
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
-    echo=False,
-)
+# Optional read replica for read-only analytics queries (usage, latency, log export)
+DATABASE_REPLICA_URL = settings.database_replica_url
+
+PROFILES = ("auto", "sqlite", "postgresql", "none")
+
+
+def engine_profile(url: str, profile: str = "auto") -> str:
+    """
+    Engine tuning profile for a database URL.
+
+    "auto" picks "sqlite" or "postgresql" from the URL; "none" creates a
+    bare engine with SQLAlchemy defaults.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile: {profile}. Must be one of: {', '.join(PROFILES)}")
+    if profile != "auto":
+        return profile
+    backend = make_url(url).get_backend_name()
+    return backend if backend in ("sqlite", "postgresql") else "none"
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    database = make_url(url).database
+    return not database or database == ":memory:"
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Per-connection SQLite tuning.
+
+    WAL lets readers run alongside a writer (the gateway and admin service
+    share one file), synchronous=NORMAL is durable across application
+    crashes in WAL mode, and busy_timeout makes a connection wait for a
+    lock instead of failing with "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def make_engine(url: str, profile: str = "auto") -> Engine:
+    """Create an engine tuned for its database (see engine_profile)."""
+    profile = engine_profile(url, profile)
+    if settings.sqlite_synchronous.upper() not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+        raise ValueError(f"Invalid SQLITE_SYNCHRONOUS: {settings.sqlite_synchronous}")
+    options = {"echo": False}
+    if url.startswith("sqlite"):
+        options["connect_args"] = {"check_same_thread": False}
+
+    if profile == "sqlite" and not _is_memory_sqlite(url):
+        options.update(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+        )
+    elif profile == "postgresql":
+        options.update(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+            pool_pre_ping=True,
+        )
 
-# Create session factory
+    new_engine = create_engine(url, **options)
+    if profile == "sqlite":
+        event.listen(new_engine, "connect", _apply_sqlite_pragmas)
+    return new_engine
+
+
+# Create engines
+engine = make_engine(DATABASE_URL, settings.database_profile)
+read_engine = make_engine(DATABASE_REPLICA_URL, settings.database_profile) if DATABASE_REPLICA_URL else engine
+
+# Create session factories
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 # Base class for models
 Base = declarative_base()
@@ -30,6 +107,36 @@ def get_db():
         db.close()
 
 
+def get_read_db():
+    """Dependency for a read-only session, served by the replica if one is configured."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _pool_stats(bind: Engine) -> dict:
+    pool = bind.pool
+    profile = engine_profile(bind.url.render_as_string(hide_password=False), settings.database_profile)
+    stats = {"profile": profile, "pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        value = getattr(pool, name, None)
+        if callable(value):
+            stats[name] = value()
+    return stats
+
+
+def pool_stats() -> dict:
+    """Connection pool statistics of the primary (and replica) engine."""
+    stats = {"primary": _pool_stats(engine)}
+    if read_engine is not engine:
+        stats["replica"] = _pool_stats(read_engine)
+    return stats
+
+
 def init_db():
-    """Initialize database tables."""
+    """Initialize database tables and upgrade existing ones."""
+    from . import models  # noqa: F401  Registers the models on Base.metadata
     Base.metadata.create_all(bind=engine)
+    upgrade(engine, Base.metadata)
@@ -1,9 +1,133 @@
-"""Email service for sending verification codes."""
-import os
+"""Email service for sending verification codes.
+
+Emails are queued by the request handlers and sent by background workers
+(EmailQueue) over a small pool of authenticated SMTP connections that are
+reused across messages (SMTPConnectionPool), so a slow or unreachable SMTP
+server never blocks the event loop.
+"""
+import asyncio
+import queue
 import smtplib
+import threading
+import time
+from dataclasses import dataclass
+from email.message import Message
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from .config import settings
+
+
+class EmailRejected(Exception):
+    """The SMTP server permanently refused a message's sender or recipients; retrying cannot help."""
+
+
+def _permanent_refusal(e: smtplib.SMTPException) -> bool:
+    """Whether a refused sender or recipients is final (5xx) rather than temporary (4xx)."""
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in e.recipients.values())
+    return getattr(e, "smtp_code", 0) >= 500
+
+
+class SMTPConnectionPool:
+    """
+    Reusable authenticated SMTP connections.
+
+    Connecting, STARTTLS and login happen once per connection instead of
+    once per message. Connections idle for longer than max_idle_seconds are
+    replaced (servers drop idle clients), and a send on a connection the
+    server has closed is retried once on a fresh connection.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        use_tls: bool = True,
+        size: int = 2,
+        timeout: float = 10.0,
+        max_idle_seconds: float = 60.0,
+    ):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.max_idle_seconds = max_idle_seconds
+        self._idle: "queue.LifoQueue[tuple]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.connects = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                conn.starttls()
+            if self.user and self.password:
+                conn.login(self.user, self.password)
+        except Exception:
+            self._close(conn)
+            raise
+        self.connects += 1
+        return conn
+
+    @staticmethod
+    def _close(conn: smtplib.SMTP) -> None:
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def _checkout(self) -> smtplib.SMTP:
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < self.max_idle_seconds:
+                return conn
+            self._close(conn)
+
+    def send(self, message: Message) -> None:
+        """
+        Send a message on a pooled connection; raises on failure.
+
+        Raises:
+            EmailRejected: If the sender or all recipients were refused for good
+        """
+        with self._slots:
+            conn = self._checkout()
+            try:
+                try:
+                    conn.send_message(message)
+                except smtplib.SMTPServerDisconnected:
+                    self._close(conn)
+                    conn = self._connect()
+                    conn.send_message(message)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                # Rejected message, the connection itself is fine
+                self._idle.put((conn, time.monotonic()))
+                if not isinstance(e, smtplib.SMTPDataError) and _permanent_refusal(e):
+                    raise EmailRejected(str(e)) from e
+                raise
+            except Exception:
+                self._close(conn)
+                raise
+            self._idle.put((conn, time.monotonic()))
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(conn)
 
 
 class EmailService:
@@ -17,6 +141,8 @@ class EmailService:
         smtp_password: Optional[str] = None,
         from_email: str = "noreply@company.com",
         use_tls: bool = True,
+        pool_size: int = 2,
+        timeout: float = 10.0,
     ):
         self.smtp_host = smtp_host
         self.smtp_port = smtp_port
@@ -24,17 +150,18 @@ class EmailService:
         self.smtp_password = smtp_password
         self.from_email = from_email
         self.use_tls = use_tls
+        self.pool = SMTPConnectionPool(
+            smtp_host, smtp_port, smtp_user, smtp_password,
+            use_tls=use_tls, size=pool_size, timeout=timeout,
+        )
 
-    def send_verification_code(self, to_email: str, code: str) -> bool:
+    def build_verification_message(self, to_email: str, code: str) -> MIMEMultipart:
         """
-        Send verification code email.
+        Build the verification code email.
 
         Args:
             to_email: Recipient email address
             code: 6-digit verification code
-
-        Returns:
-            True if sent successfully, False otherwise
         """
         subject = "Your LLM API Verification Code"
 
@@ -71,71 +198,176 @@ If you didn't request this code, please ignore this email.
 This is an automated message from the Internal LLM API Service.
         """
 
-        try:
-            # Create message
-            msg = MIMEMultipart("alternative")
-            msg["Subject"] = subject
-            msg["From"] = self.from_email
-            msg["To"] = to_email
+        msg = MIMEMultipart("alternative")
+        msg["Subject"] = subject
+        msg["From"] = self.from_email
+        msg["To"] = to_email
 
-            # Attach both plain text and HTML versions
-            part1 = MIMEText(text_body, "plain")
-            part2 = MIMEText(html_body, "html")
-            msg.attach(part1)
-            msg.attach(part2)
+        # Attach both plain text and HTML versions
+        msg.attach(MIMEText(text_body, "plain"))
+        msg.attach(MIMEText(html_body, "html"))
+        return msg
 
-            # Send email
-            with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                if self.use_tls:
-                    server.starttls()
+    def deliver_verification_code(self, to_email: str, code: str) -> None:
+        """Send the verification code email; raises on failure."""
+        self.pool.send(self.build_verification_message(to_email, code))
+        print(f"Verification code email sent to {to_email}")
 
-                if self.smtp_user and self.smtp_password:
-                    server.login(self.smtp_user, self.smtp_password)
+    def send_verification_code(self, to_email: str, code: str) -> bool:
+        """
+        Send verification code email.
 
-                server.send_message(msg)
+        Args:
+            to_email: Recipient email address
+            code: 6-digit verification code
 
-            print(f"Verification code email sent to {to_email}")
+        Returns:
+            True if sent successfully, False otherwise
+        """
+        try:
+            self.deliver_verification_code(to_email, code)
             return True
-
         except Exception as e:
             print(f"Failed to send email to {to_email}: {str(e)}")
             return False
 
+    def close(self) -> None:
+        """Close pooled SMTP connections."""
+        self.pool.close()
+
 
 # For development/testing: print to console instead of sending email
 class MockEmailService(EmailService):
     """Mock email service that prints to console instead of sending."""
 
-    def send_verification_code(self, to_email: str, code: str) -> bool:
+    def deliver_verification_code(self, to_email: str, code: str) -> None:
         """Print verification code to console."""
         print("=" * 60)
         print(f"📧 MOCK EMAIL TO: {to_email}")
         print(f"🔑 VERIFICATION CODE: {code}")
         print("⏰ Expires in 5 minutes")
         print("=" * 60)
-        return True
 
 
 # Get email service based on environment
+@lru_cache(maxsize=1)
 def get_email_service() -> EmailService:
-    """Get email service instance based on environment configuration."""
-
-    # Check if SMTP is configured
-    smtp_host = os.getenv("SMTP_HOST", "localhost")
-    smtp_port = int(os.getenv("SMTP_PORT", "587"))
-    smtp_user = os.getenv("SMTP_USER")
-    smtp_password = os.getenv("SMTP_PASSWORD")
-    from_email = os.getenv("SMTP_FROM_EMAIL", "noreply@company.com")
-    use_mock = os.getenv("USE_MOCK_EMAIL", "true").lower() == "true"
-
-    if use_mock or not smtp_user:
+    """Email service for the configured SMTP server, created once per process."""
+    if settings.use_mock_email or not settings.smtp_user:
         print("Using MockEmailService (emails will be printed to console)")
         return MockEmailService()
 
     return EmailService(
-        smtp_host=smtp_host,
-        smtp_port=smtp_port,
-        smtp_user=smtp_user,
-        smtp_password=smtp_password,
-        from_email=from_email,
+        smtp_host=settings.smtp_host,
+        smtp_port=settings.smtp_port,
+        smtp_user=settings.smtp_user,
+        smtp_password=settings.smtp_password,
+        from_email=settings.smtp_from_email,
+        use_tls=settings.smtp_use_tls,
+        pool_size=settings.smtp_pool_size,
+        timeout=settings.smtp_timeout_seconds,
     )
+
+
+class EmailQueueFull(Exception):
+    """The email queue is at EMAIL_QUEUE_MAX_SIZE."""
+
+
+@dataclass
+class EmailJob:
+    to_email: str
+    code: str
+    attempts: int = 0
+
+
+class EmailQueue:
+    """
+    Background verification email delivery.
+
+    enqueue() returns immediately; worker tasks send the emails in threads
+    over the service's connection pool and retry failures with exponential
+    backoff (retry_backoff_seconds * 2 ** attempt) up to max_retries times.
+    Emails the server refuses for good (EmailRejected) fail at once, and
+    emails still waiting to be sent or retried when the queue stops are
+    counted as failed.
+    """
+
+    def __init__(
+        self,
+        service: EmailService,
+        workers: int = 2,
+        max_size: int = 1000,
+        max_retries: int = 3,
+        retry_backoff_seconds: float = 1.0,
+    ):
+        self.service = service
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.queue: "asyncio.Queue[EmailJob]" = asyncio.Queue(maxsize=max_size)
+        self._tasks: List[asyncio.Task] = []
+        self._retries: Dict[int, Tuple[asyncio.TimerHandle, EmailJob]] = {}  # id(job): pending retry
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        """Start the worker tasks (call from the running event loop)."""
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Send what is queued (up to timeout seconds), then stop the workers; pending retries are dropped."""
+        for handle, job in self._retries.values():
+            handle.cancel()
+            self.failed += 1
+            print(f"Dropped email to {job.to_email}: queue stopped before its retry")
+        self._retries = {}
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            self.failed += self.queue.qsize()
+            print(f"Email queue stopped with {self.queue.qsize()} unsent emails")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.to_thread(self.service.close)
+
+    def enqueue(self, to_email: str, code: str) -> None:
+        """Queue a verification code email; raises EmailQueueFull."""
+        try:
+            self.queue.put_nowait(EmailJob(to_email, code))
+        except asyncio.QueueFull:
+            raise EmailQueueFull("Email queue is full")
+
+    def _requeue(self, job: EmailJob) -> None:
+        self._retries.pop(id(job), None)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.failed += 1
+            print(f"Dropped email to {job.to_email}: queue is full")
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                await asyncio.to_thread(self.service.deliver_verification_code, job.to_email, job.code)
+                self.sent += 1
+            except EmailRejected as e:
+                self.failed += 1
+                print(f"Failed to send email to {job.to_email}, rejected by the server: {e}")
+            except Exception as e:
+                if job.attempts < self.max_retries:
+                    delay = self.retry_backoff_seconds * 2 ** job.attempts
+                    job.attempts += 1
+                    self.retried += 1
+                    print(f"Failed to send email to {job.to_email} ({e}), retrying in {delay:.1f}s")
+                    self._retries[id(job)] = (loop.call_later(delay, self._requeue, job), job)
+                else:
+                    self.failed += 1
+                    print(f"Failed to send email to {job.to_email} after {job.attempts + 1} attempts: {e}")
+            finally:
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "sent": self.sent, "retried": self.retried, "failed": self.failed}
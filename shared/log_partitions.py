@@ -0,0 +1,402 @@
+"""Time-partitioned request log storage.
+
+With ``LOG_PARTITIONING=daily`` (or ``monthly``) request logs are written to
+one table per period, ``request_logs_YYYYMMDD`` (or ``request_logs_YYYYMM``),
+instead of the single ``request_logs`` table. Partitions only carry the
+indexes the read paths need, so inserts stay cheap, and retention drops whole
+partitions instead of running large DELETEs. Before a partition is dropped it
+can be archived to a zstd-compressed Parquet file, which readers of the logs
+can still scan.
+
+The legacy ``request_logs`` table is always read as well, so switching
+partitioning on does not hide existing logs.
+"""
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Column, Index, MetaData, Table, func, inspect, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from .config import settings
+from .models import RequestLog, RollupState
+
+PARTITION_PREFIX = "request_logs_"
+
+_PARTITION_RE = re.compile(r"^request_logs_(\d{8}|\d{6})$")
+_metadata = MetaData()
+_tables: Dict[str, Table] = {}
+_existing: set = set()
+_lock = threading.Lock()
+
+
+def partitioning_enabled() -> bool:
+    """Whether new request logs go to time partitions."""
+    return settings.log_partitioning in ("daily", "monthly")
+
+
+def partition_name(timestamp: datetime, scheme: Optional[str] = None) -> str:
+    """Name of the partition holding logs written at ``timestamp``."""
+    scheme = scheme or settings.log_partitioning
+    if scheme == "daily":
+        return f"{PARTITION_PREFIX}{timestamp:%Y%m%d}"
+    if scheme == "monthly":
+        return f"{PARTITION_PREFIX}{timestamp:%Y%m}"
+    raise ValueError(f"Unknown log partitioning scheme: {scheme}")
+
+
+def partition_bounds(name: str) -> Tuple[datetime, datetime]:
+    """[start, end) time range covered by a partition."""
+    suffix = _PARTITION_RE.match(name).group(1)
+    if len(suffix) == 8:
+        start = datetime.strptime(suffix, "%Y%m%d")
+        return start, start + timedelta(days=1)
+    start = datetime.strptime(suffix, "%Y%m")
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def partition_table(name: str) -> Table:
+    """Table object of a partition, with the same columns as request_logs."""
+    table = _tables.get(name)
+    if table is None:
+        with _lock:
+            table = _tables.get(name)
+            if table is None:
+                columns = [
+                    Column(
+                        c.name,
+                        c.type,
+                        primary_key=c.primary_key,
+                        nullable=c.nullable,
+                        default=c.default.arg if c.default is not None else None,
+                    )
+                    for c in RequestLog.__table__.columns
+                ]
+                table = Table(name, _metadata, *columns)
+                # Only what the read paths need: per-user time ranges and time scans
+                Index(f"idx_{name}_user_timestamp", table.c.user_id, table.c.timestamp)
+                Index(f"idx_{name}_timestamp", table.c.timestamp)
+                _tables[name] = table
+    return table
+
+
+def ensure_partition(bind: Engine, timestamp: datetime) -> Table:
+    """Partition for ``timestamp``, created if it does not exist yet."""
+    name = partition_name(timestamp)
+    table = partition_table(name)
+    if name not in _existing:
+        try:
+            with bind.begin() as conn:
+                table.create(conn, checkfirst=True)
+        except (OperationalError, ProgrammingError):
+            # Another process created it between the check and the CREATE
+            if not inspect(bind).has_table(name):
+                raise
+        _existing.add(name)
+    return table
+
+
+async def ensure_partition_async(bind: AsyncEngine, timestamp: datetime) -> Table:
+    """Async version of ensure_partition."""
+    name = partition_name(timestamp)
+    table = partition_table(name)
+    if name not in _existing:
+        try:
+            async with bind.begin() as conn:
+                await conn.run_sync(table.create, checkfirst=True)
+        except (OperationalError, ProgrammingError):
+            async with bind.connect() as conn:
+                exists = await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table(name))
+            if not exists:
+                raise
+        _existing.add(name)
+    return table
+
+
+def list_partitions(bind: Engine) -> List[str]:
+    """Names of existing partitions, oldest first."""
+    names = [n for n in inspect(bind).get_table_names() if _PARTITION_RE.match(n)]
+    return sorted(names, key=lambda n: partition_bounds(n)[0])
+
+
+def log_tables(bind: Engine, since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[Table]:
+    """
+    Tables holding logs in [since, until), oldest first.
+
+    The legacy request_logs table is always included since it is not
+    partitioned by time.
+    """
+    tables = [RequestLog.__table__]
+    for name in list_partitions(bind):
+        start, end = partition_bounds(name)
+        if (since is None or end > since) and (until is None or start < until):
+            tables.append(partition_table(name))
+    return tables
+
+
+def insert_log(db, values: Dict) -> int:
+    """Insert one request log into its partition and return its id (within the partition)."""
+    table = ensure_partition(db.get_bind(), values["timestamp"])
+    result = db.execute(table.insert().values(**values))
+    return result.inserted_primary_key[0]
+
+
+async def insert_log_async(db: AsyncSession, values: Dict) -> int:
+    """Async version of insert_log."""
+    table = await ensure_partition_async(db.bind, values["timestamp"])
+    result = await db.execute(table.insert().values(**values))
+    return result.inserted_primary_key[0]
+
+
+def _log_filters(columns, since: Optional[datetime], until: Optional[datetime], filters: Optional[Dict]) -> List:
+    conditions = []
+    if since:
+        conditions.append(columns.timestamp >= since)
+    if until:
+        conditions.append(columns.timestamp < until)
+    for name, value in (filters or {}).items():
+        conditions.append(columns[name] == value)
+    return conditions
+
+
+def iter_log_batches(
+    bind: Engine,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    filters: Optional[Dict] = None,
+    batch_size: int = 10_000,
+    archive_dir: Optional[str] = None,
+) -> Iterator[List[Dict]]:
+    """
+    Request logs in [since, until) as batches of dicts, table by table.
+
+    Batches are fetched by keyset (``id > last id``) with a short-lived
+    connection each, so memory stays constant and no transaction is held
+    open however long the caller takes to consume the logs. Archived
+    partitions are read first when ``archive_dir`` is given, then the legacy
+    table, then live partitions, each in id order.
+
+    Args:
+        bind: Database engine
+        since: Only logs at or after this time
+        until: Only logs before this time
+        filters: Column name to value equality filters, e.g. {"user_id": ...}
+        batch_size: Rows per batch
+        archive_dir: Also read Parquet archives of dropped partitions from here
+    """
+    if archive_dir:
+        yield from read_archived_batches(archive_dir, since, until, filters, batch_size=batch_size)
+
+    for table in log_tables(bind, since, until):
+        conditions = _log_filters(table.c, since, until, filters)
+        last_id = 0
+        while True:
+            with bind.connect() as conn:
+                rows = conn.execute(
+                    select(table)
+                    .where(table.c.id > last_id, *conditions)
+                    .order_by(table.c.id)
+                    .limit(batch_size)
+                ).mappings().all()
+            if not rows:
+                break
+            yield [dict(row) for row in rows]
+            last_id = rows[-1]["id"]
+            if len(rows) < batch_size:
+                break
+
+
+def iter_logs(
+    bind: Engine,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: int = 10_000,
+    archive_dir: Optional[str] = None,
+) -> Iterator[Dict]:
+    """Request logs in [since, until) as dicts, see iter_log_batches."""
+    for batch in iter_log_batches(bind, since, until, batch_size=batch_size, archive_dir=archive_dir):
+        yield from batch
+
+
+# Archival
+def arrow_schema():
+    """Arrow schema of request log rows, used for archives and Parquet exports."""
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.int64()),
+        ("user_id", pa.string()),
+        ("api_key_id", pa.int64()),
+        ("endpoint", pa.string()),
+        ("method", pa.string()),
+        ("status_code", pa.int32()),
+        ("duration_ms", pa.float64()),
+        ("prompt_tokens", pa.int64()),
+        ("completion_tokens", pa.int64()),
+        ("total_tokens", pa.int64()),
+        ("model", pa.string()),
+        ("error", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+    ])
+
+
+def require_pyarrow():
+    """Raise a helpful error when the optional pyarrow dependency is missing."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Parquet support requires pyarrow (pip install pyarrow)")
+
+
+def arrow_table(rows: List[Dict], schema):
+    """Arrow table of request log rows (dicts)."""
+    import pyarrow as pa
+
+    columns = {field.name: [row[field.name] for row in rows] for field in schema}
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def archive_partition(bind: Engine, name: str, archive_dir: str, batch_size: int = 50_000) -> Path:
+    """
+    Write a partition to ``<archive_dir>/<name>.parquet`` (zstd compressed).
+
+    The file is written under a temporary name and renamed when complete, so
+    a crash never leaves a truncated archive behind.
+    """
+    require_pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema()
+    table = partition_table(name)
+    path = Path(archive_dir) / f"{name}.parquet"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".parquet.tmp")
+
+    with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer, bind.connect() as conn:
+        result = conn.execution_options(yield_per=batch_size).execute(select(table).order_by(table.c.id))
+        for rows in result.mappings().partitions():
+            writer.write_table(arrow_table(rows, schema))
+    os.replace(tmp_path, path)
+    return path
+
+
+def archived_partitions(archive_dir: str) -> List[Path]:
+    """Archive files in ``archive_dir``, oldest first."""
+    directory = Path(archive_dir)
+    if not directory.is_dir():
+        return []
+    paths = [p for p in directory.glob(f"{PARTITION_PREFIX}*.parquet") if _PARTITION_RE.match(p.stem)]
+    return sorted(paths, key=lambda p: partition_bounds(p.stem)[0])
+
+
+def read_archived_batches(
+    archive_dir: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    filters: Optional[Dict] = None,
+    batch_size: int = 50_000,
+) -> Iterator[List[Dict]]:
+    """Request logs in [since, until) from archived partitions, as batches of dicts."""
+    paths = []
+    for path in archived_partitions(archive_dir):
+        start, end = partition_bounds(path.stem)
+        if (since is None or end > since) and (until is None or start < until):
+            paths.append(path)
+    if not paths:
+        return
+
+    require_pyarrow()
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    conditions = []
+    if since:
+        conditions.append(lambda batch: pc.greater_equal(batch["timestamp"], since))
+    if until:
+        conditions.append(lambda batch: pc.less(batch["timestamp"], until))
+    for name, value in (filters or {}).items():
+        conditions.append(lambda batch, name=name, value=value: pc.equal(batch[name], value))
+
+    for path in paths:
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            for condition in conditions:
+                batch = batch.filter(condition(batch))
+            if batch.num_rows:
+                yield batch.to_pylist()
+
+
+def read_archived_logs(
+    archive_dir: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: int = 50_000,
+) -> Iterator[Dict]:
+    """Request logs in [since, until) from archived partitions, as dicts."""
+    for batch in read_archived_batches(archive_dir, since, until, batch_size=batch_size):
+        yield from batch
+
+
+# Retention
+def _fully_rolled_up(conn, table: Table) -> bool:
+    """Whether every log of the partition has been folded into the usage rollups."""
+    max_id = conn.execute(select(func.max(table.c.id))).scalar()
+    if max_id is None:
+        return True
+    watermark = conn.execute(
+        select(RollupState.last_log_id).where(RollupState.source == table.name)
+    ).scalar()
+    return watermark is not None and watermark >= max_id
+
+
+def drop_partition(bind: Engine, name: str) -> None:
+    """Drop a partition and its rollup watermark."""
+    table = partition_table(name)
+    with bind.begin() as conn:
+        table.drop(conn, checkfirst=True)
+        conn.execute(RollupState.__table__.delete().where(RollupState.source == name))
+    _existing.discard(name)
+
+
+def apply_retention(
+    bind: Engine,
+    retention_days: int,
+    archive_dir: Optional[str] = None,
+    now: Optional[datetime] = None,
+) -> List[str]:
+    """
+    Drop partitions that ended more than ``retention_days`` ago.
+
+    Partitions whose logs are not all in the usage rollups yet are kept
+    until the compactor has caught up, so dropping never loses usage data.
+
+    Args:
+        bind: Database engine
+        retention_days: Days of logs to keep, 0 to keep everything
+        archive_dir: Archive partitions to Parquet here before dropping them
+        now: Current time (for tests and tools)
+
+    Returns:
+        Names of the dropped partitions
+    """
+    if retention_days <= 0:
+        return []
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    dropped = []
+    for name in list_partitions(bind):
+        _, end = partition_bounds(name)
+        if end > cutoff:
+            break
+        with bind.connect() as conn:
+            if not _fully_rolled_up(conn, partition_table(name)):
+                continue
+        if archive_dir:
+            archive_partition(bind, name, archive_dir)
+        drop_partition(bind, name)
+        dropped.append(name)
+    return dropped
@@ -0,0 +1,108 @@
+"""Lightweight schema upgrades for existing databases.
+
+``create_all`` only creates missing tables, so columns and indexes added to
+existing tables in later versions, and the data migrations that go with
+them, are applied here.
+"""
+from sqlalchemy import MetaData, bindparam, inspect, select, text, update
+from sqlalchemy.engine import Engine
+
+
+def ensure_columns(engine: Engine, metadata: MetaData) -> list:
+    """
+    Add columns declared in the models that are missing from existing tables.
+
+    Columns are added as nullable, since existing rows have no value yet;
+    data migrations fill them in.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def ensure_indexes(engine: Engine, metadata: MetaData) -> list:
+    """Create indexes declared in the models that are missing from existing tables."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+    return created
+
+
+def hash_api_keys(engine: Engine, batch_size: int = 10000) -> int:
+    """
+    Replace the raw ``api_keys.key`` column with key_hash and key_prefix.
+
+    Existing keys keep working: their hashes are computed from the raw
+    values, after which the raw column and its index are dropped.
+
+    Returns:
+        Number of keys hashed
+    """
+    from .crud import api_key_columns
+    from .models import APIKey
+
+    inspector = inspect(engine)
+    if "api_keys" not in inspector.get_table_names():
+        return 0
+    if "key" not in {column["name"] for column in inspector.get_columns("api_keys")}:
+        return 0
+
+    legacy_key = text("key")
+    hashed = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(APIKey.id, legacy_key)
+                .select_from(APIKey.__table__)
+                .where(APIKey.id > last_id, APIKey.key_hash.is_(None))
+                .order_by(APIKey.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            conn.execute(
+                update(APIKey.__table__).where(APIKey.id == bindparam("key_id")),
+                [{"key_id": key_id, **api_key_columns(key)} for key_id, key in rows],
+            )
+        hashed += len(rows)
+        last_id = rows[-1][0]
+
+    with engine.begin() as conn:
+        for index in inspector.get_indexes("api_keys"):
+            if index["column_names"] == ["key"]:
+                conn.execute(text(f"DROP INDEX {index['name']}"))
+        conn.execute(text("ALTER TABLE api_keys DROP COLUMN key"))
+    return hashed
+
+
+def upgrade(engine: Engine, metadata: MetaData) -> None:
+    """Bring an existing database up to date with the models."""
+    added = ensure_columns(engine, metadata)
+    if added:
+        print(f"Added missing columns: {', '.join(added)}")
+    hashed = hash_api_keys(engine)
+    if hashed:
+        print(f"Hashed {hashed} stored API keys and dropped the raw key column")
+    created = ensure_indexes(engine, metadata)
+    if created:
+        print(f"Created missing indexes: {', '.join(created)}")
@@ -1,6 +1,6 @@
 """Shared database models."""
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, Text, Index
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, Text, Index, BigInteger, LargeBinary
 from .database import Base
 
 
@@ -9,7 +9,8 @@ class APIKey(Base):
     __tablename__ = "api_keys"
 
     id = Column(Integer, primary_key=True, index=True)
-    key = Column(String(100), unique=True, index=True, nullable=False)
+    key_hash = Column(LargeBinary(32), unique=True, index=True, nullable=False)  # SHA-256 of the key
+    key_prefix = Column(String(32), nullable=False)  # Leading characters, for display only
     user_id = Column(String(100), index=True, nullable=False)
     tier = Column(String(50), default="standard", nullable=False)  # free, standard, premium
     is_active = Column(Boolean, default=True, nullable=False)
@@ -19,6 +20,14 @@ class APIKey(Base):
     description = Column(Text, nullable=True)
     created_by = Column(String(100), nullable=True)  # Admin who created the key
 
+    # Indexes for admin listing: keyset pagination by id within each filter
+    __table_args__ = (
+        Index("idx_api_keys_tier_id", "tier", "id"),
+        Index("idx_api_keys_active_id", "is_active", "id"),
+        Index("idx_api_keys_created_by_id", "created_by", "id"),
+        Index("idx_api_keys_expires_at", "expires_at"),
+    )
+
 
 class User(Base):
     """User model."""
@@ -87,3 +96,202 @@ class VerificationCode(Base):
         Index("idx_email_code", "email", "code"),
         Index("idx_expires_at", "expires_at"),
     )
+
+
+class UsageRollup(Base):
+    """Request log counters pre-aggregated per time bucket, for usage analytics."""
+    __tablename__ = "usage_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String(10), nullable=False)  # minute, hour, day
+    bucket_start = Column(DateTime, nullable=False)
+    user_id = Column(String(100), nullable=False)
+    api_key_id = Column(Integer, default=0, nullable=False)  # 0 when the log had no key
+    model = Column(String(255), default="", nullable=False)  # "" when the log had no model
+    endpoint = Column(String(255), nullable=False)
+    requests = Column(Integer, default=0, nullable=False)
+    errors = Column(Integer, default=0, nullable=False)
+    prompt_tokens = Column(BigInteger, default=0, nullable=False)
+    completion_tokens = Column(BigInteger, default=0, nullable=False)
+    total_tokens = Column(BigInteger, default=0, nullable=False)
+    duration_ms_sum = Column(Float, default=0.0, nullable=False)
+
+    __table_args__ = (
+        Index(
+            "idx_rollup_bucket_key",
+            "granularity", "bucket_start", "user_id", "api_key_id", "model", "endpoint",
+            unique=True,
+        ),
+        Index("idx_rollup_user_bucket", "granularity", "user_id", "bucket_start"),
+    )
+
+
+class RollupState(Base):
+    """How far each request log table has been folded into the usage rollups."""
+    __tablename__ = "rollup_state"
+
+    source = Column(String(100), primary_key=True)  # Request log table name
+    last_log_id = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class LatencySketch(Base):
+    """Mergeable latency / TTFT quantile sketch per user, model and hour."""
+    __tablename__ = "latency_sketches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    metric = Column(String(20), nullable=False)  # latency, ttft
+    bucket_start = Column(DateTime, nullable=False)
+    user_id = Column(String(100), nullable=False)
+    model = Column(String(255), default="", nullable=False)  # "" when the log had no model
+    count = Column(BigInteger, default=0, nullable=False)
+    sketch = Column(LargeBinary, nullable=False)  # DDSketch.to_bytes()
+    version = Column(Integer, default=0, nullable=False)  # Optimistic concurrency for merges
+
+    __table_args__ = (
+        Index("idx_sketch_bucket_key", "metric", "bucket_start", "user_id", "model", unique=True),
+    )
+
+
+class ConfigChange(Base):
+    """
+    Change feed of configuration cached by the gateways (currently API keys).
+
+    Rows are written in the same transaction as the change; the id is the
+    change version gateways poll from.
+    """
+    __tablename__ = "config_changes"
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String(50), nullable=False)  # api_key
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String(50), nullable=False)  # update, deactivate, rotate
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    # Versions must never be reused after pruning, or gateways would skip changes
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class Team(Base):
+    """Team of users sharing quotas, optionally part of an organization."""
+    __tablename__ = "teams"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), unique=True, index=True, nullable=False)
+    organization = Column(String(100), index=True, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class TeamMember(Base):
+    """Team membership; a user (API key owner) belongs to at most one team."""
+    __tablename__ = "team_members"
+
+    user_id = Column(String(100), primary_key=True)
+    team_id = Column(Integer, index=True, nullable=False)
+
+
+class Quota(Base):
+    """
+    Request and token budget over a daily or monthly window.
+
+    Quotas apply at organization, team, user or API key scope; a request
+    must fit every quota along its key's hierarchy.
+    """
+    __tablename__ = "quotas"
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String(20), nullable=False)  # organization, team, user, key
+    subject = Column(String(100), nullable=False)  # Organization / team name, user ID or key ID
+    window = Column(String(10), nullable=False)  # day, month
+    max_requests = Column(BigInteger, nullable=True)  # None: unlimited
+    max_tokens = Column(BigInteger, nullable=True)  # None: unlimited
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_quota_scope_subject_window", "scope", "subject", "window", unique=True),
+    )
+
+
+class QuotaUsage(Base):
+    """Consumption counted against quotas per window period, flushed by the gateways."""
+    __tablename__ = "quota_usage"
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String(20), nullable=False)
+    subject = Column(String(100), nullable=False)
+    window = Column(String(10), nullable=False)
+    period_start = Column(DateTime, nullable=False)
+    requests = Column(BigInteger, default=0, nullable=False)
+    tokens = Column(BigInteger, default=0, nullable=False)
+
+    __table_args__ = (
+        Index("idx_quota_usage_key", "window", "period_start", "scope", "subject", unique=True),
+    )
+
+
+class RateLimitNode(Base):
+    """Gateway node sharing rate limits with the others, see shared.rate_limit_reports."""
+    __tablename__ = "rate_limit_nodes"
+
+    node_id = Column(String(100), primary_key=True)
+    last_seen = Column(Float, nullable=False)  # time.time() of the node's last sync
+
+
+class RateLimitReport(Base):
+    """A gateway node's recent requests of one user, reported at its last sync."""
+    __tablename__ = "rate_limit_reports"
+
+    node_id = Column(String(100), primary_key=True)
+    user_id = Column(String(100), primary_key=True)
+    minute_requests = Column(Integer, default=0, nullable=False)  # Admitted in the last minute
+    hour_requests = Column(Integer, default=0, nullable=False)  # Admitted in the last hour
+    demand = Column(Integer, default=0, nullable=False)  # Arrived (admitted or not) since the previous sync
+    minute_limit = Column(Integer, nullable=False)
+    hour_limit = Column(Integer, nullable=False)
+    reported_at = Column(Float, nullable=False, index=True)  # time.time() of the reporting node
+
+
+class BatchFile(Base):
+    """Batch input or output file (JSONL), stored under BATCH_DIR on the gateway that received it."""
+    __tablename__ = "batch_files"
+
+    id = Column(String(64), primary_key=True)  # file-<hex>
+    user_id = Column(String(100), index=True, nullable=False)
+    filename = Column(String(255), nullable=False)
+    purpose = Column(String(20), nullable=False)  # batch, batch_output
+    requests = Column(Integer, default=0, nullable=False)  # Request lines of a batch input
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Batch(Base):
+    """
+    Batch of requests run in the background by a gateway.
+
+    The gateway running a batch holds a lease on it, renewed while it runs;
+    a batch whose lease expired (the gateway stopped) is resumed by the next
+    gateway that has its files.
+    """
+    __tablename__ = "batches"
+
+    id = Column(String(64), primary_key=True)  # batch_<hex>
+    user_id = Column(String(100), index=True, nullable=False)
+    api_key_id = Column(Integer, nullable=False)
+    tier = Column(String(50), nullable=False)
+    endpoint = Column(String(100), nullable=False)
+    completion_window = Column(String(10), nullable=False)
+    status = Column(String(20), index=True, nullable=False)  # in_progress, cancelling, completed, cancelled, expired, failed
+    input_file_id = Column(String(64), nullable=False)
+    output_file_id = Column(String(64), nullable=False)
+    error_file_id = Column(String(64), nullable=False)
+    total = Column(Integer, default=0, nullable=False)
+    completed = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    errors = Column(Text, nullable=True)
+    batch_metadata = Column(Text, nullable=True)  # JSON object given at creation
+    claimed_by = Column(String(100), nullable=True)  # Gateway running the batch
+    lease_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    in_progress_at = Column(DateTime, nullable=True)
+    cancelling_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)  # Completed, cancelled, expired or failed
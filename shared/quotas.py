@@ -0,0 +1,131 @@
+"""Hierarchical request and token quotas.
+
+Quotas are defined per organization, team, user or API key over a daily or
+monthly window (UTC). Gateways count consumption in memory and periodically
+add their counts to ``quota_usage``, one row per quota subject and window
+period, then read back the totals of all gateways. The tables here are the
+shared state; enforcement lives in the gateway.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import Quota, QuotaUsage, Team, TeamMember
+
+SCOPES = ("organization", "team", "user", "key")  # Outermost first
+WINDOWS = ("day", "month")
+
+# Usage key: (scope, subject, window, period_start)
+UsageKey = Tuple[str, str, str, datetime]
+
+
+def period_start(window: str, now: datetime) -> datetime:
+    """Start of the window period containing ``now``."""
+    if window == "day":
+        return now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == "month":
+        return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown quota window: {window}")
+
+
+def period_end(window: str, start: datetime) -> datetime:
+    """Start of the period after the one starting at ``start``."""
+    if window == "day":
+        return start + timedelta(days=1)
+    if window == "month":
+        return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    raise ValueError(f"Unknown quota window: {window}")
+
+
+def current_periods(now: datetime) -> Dict[str, datetime]:
+    """Period start of each window at ``now``."""
+    return {window: period_start(window, now) for window in WINDOWS}
+
+
+def load_quotas(db: Session) -> Dict[Tuple[str, str], List[Quota]]:
+    """All quotas by (scope, subject)."""
+    quotas: Dict[Tuple[str, str], List[Quota]] = defaultdict(list)
+    for quota in db.query(Quota).all():
+        quotas[(quota.scope, quota.subject)].append(quota)
+    return dict(quotas)
+
+
+def load_memberships(db: Session) -> Dict[str, Tuple[str, Optional[str]]]:
+    """Team and organization of every team member, by user ID."""
+    rows = db.query(TeamMember.user_id, Team.name, Team.organization).join(Team, Team.id == TeamMember.team_id)
+    return {user_id: (team, organization) for user_id, team, organization in rows}
+
+
+def add_usage(db: Session, counters: Dict[UsageKey, List[int]]) -> None:
+    """Add [requests, tokens] counters to the usage rows, inserting the missing ones."""
+    for (scope, subject, window, start), (requests, tokens) in counters.items():
+        updated = (
+            db.query(QuotaUsage)
+            .filter(
+                QuotaUsage.window == window,
+                QuotaUsage.period_start == start,
+                QuotaUsage.scope == scope,
+                QuotaUsage.subject == subject,
+            )
+            .update(
+                {
+                    QuotaUsage.requests: QuotaUsage.requests + requests,
+                    QuotaUsage.tokens: QuotaUsage.tokens + tokens,
+                },
+                synchronize_session=False,
+            )
+        )
+        if not updated:
+            db.add(QuotaUsage(
+                scope=scope, subject=subject, window=window, period_start=start,
+                requests=requests, tokens=tokens,
+            ))
+
+
+def merge_usage(db: Session, counters: Dict[UsageKey, List[int]], retries: int = 5) -> None:
+    """
+    Add counters to the stored usage in one transaction.
+
+    Retried as a whole when another gateway inserted one of the rows first.
+    """
+    for _ in range(retries):
+        try:
+            add_usage(db, counters)
+            db.commit()
+            return
+        except IntegrityError:
+            db.rollback()
+    raise RuntimeError(f"Could not merge quota usage after {retries} attempts")
+
+
+def get_usage(
+    db: Session,
+    periods: Dict[str, datetime],
+    subjects: Optional[Iterable[Tuple[str, str]]] = None,
+) -> Dict[UsageKey, Tuple[int, int]]:
+    """
+    Stored (requests, tokens) of the given window periods.
+
+    Args:
+        db: Database session
+        periods: Period start per window, see current_periods
+        subjects: Only these (scope, subject) pairs; all if None
+    """
+    wanted = set(subjects) if subjects is not None else None
+    usage = {}
+    for window, start in periods.items():
+        rows = db.query(QuotaUsage).filter(QuotaUsage.window == window, QuotaUsage.period_start == start)
+        for row in rows:
+            if wanted is None or (row.scope, row.subject) in wanted:
+                usage[(row.scope, row.subject, window, start)] = (row.requests, row.tokens)
+    return usage
+
+
+def prune_usage(db: Session, before: datetime) -> int:
+    """Delete usage rows of periods that started before ``before``."""
+    count = db.query(QuotaUsage).filter(QuotaUsage.period_start < before).delete(synchronize_session=False)
+    db.commit()
+    return count
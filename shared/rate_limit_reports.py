@@ -0,0 +1,95 @@
+"""Shared state of approximate global rate limits across gateway nodes.
+
+Without a central counter store, each gateway enforces a local share of
+every user's limits. At each sync a node writes its recent request counts
+to ``rate_limit_reports``, one row per node and user, and reads the rows
+the other nodes wrote since its previous sync; ``rate_limit_nodes`` records
+when each node last synced, so the nodes know how many peers share the
+limits. Times are ``time.time()`` of the writing node, so node clocks are
+assumed to be synchronised (NTP). Enforcement lives in the gateway.
+"""
+from typing import Dict, List, NamedTuple, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from .models import RateLimitNode, RateLimitReport
+
+WRITE_BATCH_SIZE = 500  # Users per DELETE ... IN / INSERT pair
+
+
+class Report(NamedTuple):
+    """One node's counts for one user, in RateLimitReport column order."""
+    minute_requests: int
+    hour_requests: int
+    demand: int
+    minute_limit: int
+    hour_limit: int
+    reported_at: float
+
+
+def write_reports(db: Session, node_id: str, now: float, reports: Dict[str, Report]) -> None:
+    """
+    Replace the node's reports of the given users and record that it synced,
+    in one transaction.
+
+    Only the node itself writes its rows, so replacing them cannot conflict
+    with other nodes.
+    """
+    updated = db.query(RateLimitNode).filter(RateLimitNode.node_id == node_id).update(
+        {RateLimitNode.last_seen: now}, synchronize_session=False
+    )
+    if not updated:
+        db.add(RateLimitNode(node_id=node_id, last_seen=now))
+
+    users = list(reports)
+    for i in range(0, len(users), WRITE_BATCH_SIZE):
+        batch = users[i:i + WRITE_BATCH_SIZE]
+        db.query(RateLimitReport).filter(
+            RateLimitReport.node_id == node_id, RateLimitReport.user_id.in_(batch)
+        ).delete(synchronize_session=False)
+        db.execute(
+            insert(RateLimitReport),
+            [{"node_id": node_id, "user_id": user_id, **reports[user_id]._asdict()} for user_id in batch],
+        )
+    db.commit()
+
+
+def read_reports(db: Session, since: float, exclude_node: str) -> List[Tuple[str, str, Report]]:
+    """(node_id, user_id, report) of the other nodes' reports written since ``since``."""
+    rows = db.query(
+        RateLimitReport.node_id,
+        RateLimitReport.user_id,
+        RateLimitReport.minute_requests,
+        RateLimitReport.hour_requests,
+        RateLimitReport.demand,
+        RateLimitReport.minute_limit,
+        RateLimitReport.hour_limit,
+        RateLimitReport.reported_at,
+    ).filter(RateLimitReport.reported_at >= since, RateLimitReport.node_id != exclude_node)
+    return [(row[0], row[1], Report(*row[2:])) for row in rows]
+
+
+def live_nodes(db: Session, since: float) -> Dict[str, float]:
+    """Last sync time of every node that synced since ``since``."""
+    rows = db.query(RateLimitNode.node_id, RateLimitNode.last_seen).filter(RateLimitNode.last_seen >= since)
+    return {node_id: last_seen for node_id, last_seen in rows}
+
+
+def prune_reports(db: Session, node_id: str, before: float) -> int:
+    """
+    Delete the node's reports written before ``before``, and the nodes that
+    have not synced since then along with their reports.
+
+    Each node prunes its own rows by its own clock, so a node never loses a
+    row it still considers current to another node's clock skew.
+    """
+    count = db.query(RateLimitReport).filter(
+        RateLimitReport.node_id == node_id, RateLimitReport.reported_at < before
+    ).delete(synchronize_session=False)
+    dead = [row.node_id for row in db.query(RateLimitNode.node_id).filter(RateLimitNode.last_seen < before)]
+    if dead:
+        count += db.query(RateLimitReport).filter(RateLimitReport.node_id.in_(dead)).delete(synchronize_session=False)
+        db.query(RateLimitNode).filter(RateLimitNode.node_id.in_(dead)).delete(synchronize_session=False)
+    db.commit()
+    return count
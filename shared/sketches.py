@@ -0,0 +1,125 @@
+"""Mergeable quantile sketches for latency analytics."""
+import math
+import struct
+from array import array
+from typing import Dict, Optional
+
+
+class DDSketch:
+    """
+    Quantile sketch with relative-error guarantees (DDSketch).
+
+    Values are counted in logarithmic buckets, so any quantile is returned
+    within ``relative_accuracy`` of the true value, and two sketches merge by
+    adding bucket counts. Memory is bounded by ``max_bins``; past that the
+    lowest buckets are collapsed, which only affects the lowest quantiles.
+    """
+
+    _HEADER = struct.Struct("<BdQQdddI")
+    _VERSION = 1
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048, min_value: float = 1e-3):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0  # Values below min_value
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value: float, count: int = 1) -> None:
+        """Add a non-negative value."""
+        if value < self.min_value:
+            self.zero_count += count
+        else:
+            key = self._key(value)
+            self.bins[key] = self.bins.get(key, 0) + count
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _collapse(self) -> None:
+        """Fold the lowest buckets into one to stay within max_bins."""
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_bins + 1
+        target = keys[excess]
+        self.bins[target] += sum(self.bins.pop(k) for k in keys[:excess])
+
+    def merge(self, other: "DDSketch") -> None:
+        """Add another sketch with the same relative accuracy into this one."""
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimated q-quantile (0 <= q <= 1), None for an empty sketch."""
+        if self.count == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return self.min
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return min(max(self._value(key), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def to_bytes(self) -> bytes:
+        """Compact binary encoding, see from_bytes."""
+        keys = array("i", sorted(self.bins))
+        counts = array("Q", (self.bins[k] for k in keys))
+        header = self._HEADER.pack(
+            self._VERSION, self.relative_accuracy, self.count, self.zero_count,
+            self.sum, self.min, self.max, len(keys),
+        )
+        return header + keys.tobytes() + counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, max_bins: int = 2048) -> "DDSketch":
+        """Decode a sketch written by to_bytes."""
+        version, accuracy, count, zero_count, total, minimum, maximum, n = cls._HEADER.unpack_from(data)
+        if version != cls._VERSION:
+            raise ValueError(f"Unsupported sketch version: {version}")
+        sketch = cls(relative_accuracy=accuracy, max_bins=max_bins)
+        offset = cls._HEADER.size
+        keys = array("i")
+        keys.frombytes(data[offset:offset + 4 * n])
+        counts = array("Q")
+        counts.frombytes(data[offset + 4 * n:offset + 12 * n])
+        sketch.bins = dict(zip(keys, counts))
+        sketch.count = count
+        sketch.zero_count = zero_count
+        sketch.sum = total
+        sketch.min = minimum
+        sketch.max = maximum
+        return sketch
@@ -0,0 +1,273 @@
+"""Incrementally maintained usage rollups over request logs.
+
+Request logs are folded into ``usage_rollups`` at minute, hour and day
+granularity, keyed by user, API key, model and endpoint. A watermark per log
+table (``rollup_state``) records the last log id already counted, so each
+compaction pass only reads logs written since the previous one. Usage queries
+then read a few thousand rollup rows instead of scanning the log table.
+
+Log ids can become visible out of order (on PostgreSQL a sequence hands out
+ids before the inserts commit), so the watermark only moves over logs older
+than a settle delay: a log with a lower id still being committed is counted
+on a later pass instead of being skipped for good.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Table, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import log_partitions
+from .models import RollupState, UsageRollup
+
+GRANULARITIES = ("minute", "hour", "day")
+
+# Rollup key: (granularity, bucket_start, user_id, api_key_id, model, endpoint)
+RollupKey = Tuple[str, datetime, str, int, str, str]
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    """Start of the bucket of the given granularity containing ``timestamp``."""
+    if granularity == "minute":
+        return timestamp.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def _aggregate(rows) -> Dict[RollupKey, List[float]]:
+    """Sum a batch of log rows into per-bucket counters."""
+    counters: Dict[RollupKey, List[float]] = defaultdict(lambda: [0, 0, 0, 0, 0, 0.0])
+    for row in rows:
+        for granularity in GRANULARITIES:
+            key = (
+                granularity,
+                bucket_start(row.timestamp, granularity),
+                row.user_id,
+                row.api_key_id or 0,
+                row.model or "",
+                row.endpoint,
+            )
+            c = counters[key]
+            c[0] += 1
+            c[1] += 1 if row.status_code >= 400 else 0
+            c[2] += row.prompt_tokens or 0
+            c[3] += row.completion_tokens or 0
+            c[4] += row.total_tokens or 0
+            c[5] += row.duration_ms or 0.0
+    return counters
+
+
+def _apply(db: Session, counters: Dict[RollupKey, List[float]]) -> None:
+    """Add counters to existing rollup rows, inserting the missing ones."""
+    for (granularity, bucket, user_id, api_key_id, model, endpoint), c in counters.items():
+        updated = (
+            db.query(UsageRollup)
+            .filter(
+                UsageRollup.granularity == granularity,
+                UsageRollup.bucket_start == bucket,
+                UsageRollup.user_id == user_id,
+                UsageRollup.api_key_id == api_key_id,
+                UsageRollup.model == model,
+                UsageRollup.endpoint == endpoint,
+            )
+            .update(
+                {
+                    UsageRollup.requests: UsageRollup.requests + c[0],
+                    UsageRollup.errors: UsageRollup.errors + c[1],
+                    UsageRollup.prompt_tokens: UsageRollup.prompt_tokens + c[2],
+                    UsageRollup.completion_tokens: UsageRollup.completion_tokens + c[3],
+                    UsageRollup.total_tokens: UsageRollup.total_tokens + c[4],
+                    UsageRollup.duration_ms_sum: UsageRollup.duration_ms_sum + c[5],
+                },
+                synchronize_session=False,
+            )
+        )
+        if not updated:
+            db.add(UsageRollup(
+                granularity=granularity,
+                bucket_start=bucket,
+                user_id=user_id,
+                api_key_id=api_key_id,
+                model=model,
+                endpoint=endpoint,
+                requests=c[0],
+                errors=c[1],
+                prompt_tokens=c[2],
+                completion_tokens=c[3],
+                total_tokens=c[4],
+                duration_ms_sum=c[5],
+            ))
+
+
+def compact_table(
+    db: Session,
+    table: Table,
+    batch_size: int = 10_000,
+    max_batches: Optional[int] = None,
+    settle_seconds: float = 30.0,
+) -> int:
+    """
+    Fold logs of one request log table written since its watermark into the rollups.
+
+    Each batch and its watermark move are committed together, and the
+    watermark is only moved if nobody else moved it meanwhile, so concurrent
+    compactors (e.g. several admin workers) never count a log twice.
+
+    Args:
+        db: Database session
+        table: Request log table (``request_logs`` or a partition of it)
+        batch_size: Logs read and committed per batch
+        max_batches: Stop after this many batches, None to catch up fully
+        settle_seconds: Logs are folded in once they are this old, in id
+            order, so none written earlier is still uncommitted
+
+    Returns:
+        Number of logs folded in
+    """
+    source = table.name
+    if db.get(RollupState, source) is None:
+        try:
+            db.add(RollupState(source=source, last_log_id=0))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+
+    columns = table.c
+    total = 0
+    batches = 0
+    settled_before = datetime.utcnow() - timedelta(seconds=settle_seconds)
+    while max_batches is None or batches < max_batches:
+        state = db.get(RollupState, source, populate_existing=True)
+        last_id = state.last_log_id
+        rows = db.execute(
+            select(
+                columns.id, columns.timestamp, columns.user_id, columns.api_key_id, columns.model,
+                columns.endpoint, columns.status_code, columns.prompt_tokens, columns.completion_tokens,
+                columns.total_tokens, columns.duration_ms,
+            )
+            .where(columns.id > last_id)
+            .order_by(columns.id)
+            .limit(batch_size)
+        ).all()
+        # Stop at the first log that has not settled, even if later ones have
+        full = len(rows) == batch_size
+        for i, row in enumerate(rows):
+            if row.timestamp >= settled_before:
+                rows, full = rows[:i], False
+                break
+        if not rows:
+            break
+
+        _apply(db, _aggregate(rows))
+        moved = (
+            db.query(RollupState)
+            .filter(RollupState.source == source, RollupState.last_log_id == last_id)
+            .update(
+                {RollupState.last_log_id: rows[-1].id, RollupState.updated_at: datetime.utcnow()},
+                synchronize_session=False,
+            )
+        )
+        if not moved:
+            # Another compactor got to this batch first
+            db.rollback()
+            continue
+        db.commit()
+        total += len(rows)
+        batches += 1
+        if not full:
+            break
+    return total
+
+
+def prune_rollups(db: Session, retention: Dict[str, Optional[int]]) -> int:
+    """
+    Delete fine-grained rollups older than their retention.
+
+    Args:
+        db: Database session
+        retention: Days to keep per granularity, None to keep forever
+
+    Returns:
+        Number of deleted rollup rows
+    """
+    now = datetime.utcnow()
+    deleted = 0
+    for granularity, days in retention.items():
+        if days is None:
+            continue
+        deleted += (
+            db.query(UsageRollup)
+            .filter(UsageRollup.granularity == granularity, UsageRollup.bucket_start < now - timedelta(days=days))
+            .delete(synchronize_session=False)
+        )
+    db.commit()
+    return deleted
+
+
+def compact_usage(db: Session, batch_size: int = 10_000, settle_seconds: float = 30.0) -> int:
+    """Bring the rollups up to date with ``request_logs`` and all its partitions, up to the settle delay."""
+    return sum(
+        compact_table(db, table, batch_size=batch_size, settle_seconds=settle_seconds)
+        for table in log_partitions.log_tables(db.get_bind())
+    )
+
+
+def query_usage(
+    db: Session,
+    granularity: str = "day",
+    days: int = 7,
+    user_id: Optional[str] = None,
+    api_key_id: Optional[int] = None,
+    model: Optional[str] = None,
+    by_model: bool = False,
+):
+    """
+    Usage per bucket read from the rollups.
+
+    Args:
+        db: Database session
+        granularity: minute, hour or day
+        days: How many days back to include (whole days for day granularity)
+        user_id: Only count this user
+        api_key_id: Only count this API key
+        model: Only count this model
+        by_model: Return one row per bucket and model instead of per bucket
+
+    Returns:
+        Rows with bucket_start, model (when by_model), requests, errors,
+        prompt_tokens, completion_tokens, total_tokens and duration_ms_sum
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+
+    since = bucket_start(datetime.utcnow() - timedelta(days=days), granularity)
+    group_by = [UsageRollup.bucket_start]
+    if by_model:
+        group_by.append(UsageRollup.model)
+
+    query = db.query(
+        *group_by,
+        func.sum(UsageRollup.requests).label("requests"),
+        func.sum(UsageRollup.errors).label("errors"),
+        func.sum(UsageRollup.prompt_tokens).label("prompt_tokens"),
+        func.sum(UsageRollup.completion_tokens).label("completion_tokens"),
+        func.sum(UsageRollup.total_tokens).label("total_tokens"),
+        func.sum(UsageRollup.duration_ms_sum).label("duration_ms_sum"),
+    ).filter(
+        UsageRollup.granularity == granularity,
+        UsageRollup.bucket_start >= since,
+    )
+
+    if user_id:
+        query = query.filter(UsageRollup.user_id == user_id)
+    if api_key_id is not None:
+        query = query.filter(UsageRollup.api_key_id == api_key_id)
+    if model is not None:
+        query = query.filter(UsageRollup.model == model)
+
+    return query.group_by(*group_by).order_by(*group_by).all()
@@ -0,0 +1,139 @@
+"""Storage for self-service email verification codes.
+
+Codes live for a few minutes and are read at most once, so by default they
+are kept in memory: issuing a code takes no database write, and expired
+codes are dropped by a periodic sweep instead of a DELETE on every request.
+The memory store is per process, so codes are lost on restart and are not
+shared between admin service replicas; VERIFICATION_STORE=database keeps
+them in the verification_codes table instead.
+"""
+import heapq
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from .config import settings
+from .database import SessionLocal
+from . import crud
+
+STORES = ("memory", "database")
+
+
+class VerificationStore(ABC):
+    """Interface of the verification code stores."""
+
+    @abstractmethod
+    def save(self, email: str, code: str, ttl_seconds: float) -> None:
+        """Store a code for an email, valid for ttl_seconds."""
+
+    @abstractmethod
+    def consume(self, email: str, code: str) -> bool:
+        """Atomically check a code and mark it used. Returns whether it was valid."""
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """Drop expired codes. Returns the number dropped."""
+
+    def stats(self) -> dict:
+        return {"store": type(self).__name__}
+
+
+class MemoryVerificationStore(VerificationStore):
+    """
+    Codes in a dict, with a min-heap of expiry times for the sweep.
+
+    Re-issuing a code leaves its old heap entry behind; the sweep skips
+    entries whose expiry no longer matches the dict. A consumed code is
+    removed immediately, so it cannot be used twice.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._codes: Dict[Tuple[str, str], float] = {}
+        self._expiries: List[Tuple[float, str, str]] = []
+        self.consumed = 0
+        self.expired = 0
+
+    def save(self, email: str, code: str, ttl_seconds: float) -> None:
+        expires = self._clock() + ttl_seconds
+        with self._lock:
+            self._codes[(email, code)] = expires
+            heapq.heappush(self._expiries, (expires, email, code))
+
+    def consume(self, email: str, code: str) -> bool:
+        with self._lock:
+            expires = self._codes.pop((email, code), None)
+        if expires is None or expires <= self._clock():
+            return False
+        self.consumed += 1
+        return True
+
+    def sweep(self) -> int:
+        now = self._clock()
+        dropped = 0
+        with self._lock:
+            while self._expiries and self._expiries[0][0] <= now:
+                expires, email, code = heapq.heappop(self._expiries)
+                if self._codes.get((email, code)) == expires:
+                    del self._codes[(email, code)]
+                    dropped += 1
+            # Drop heap entries left behind by consumed or re-issued codes
+            if len(self._expiries) > 2 * len(self._codes) + 1024:
+                self._expiries = [(e, m, c) for e, m, c in self._expiries if self._codes.get((m, c)) == e]
+                heapq.heapify(self._expiries)
+        self.expired += dropped
+        return dropped
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def stats(self) -> dict:
+        return {
+            "store": "memory",
+            "codes": len(self._codes),
+            "consumed": self.consumed,
+            "expired": self.expired,
+        }
+
+
+class DatabaseVerificationStore(VerificationStore):
+    """Codes in the verification_codes table, shared by all admin service processes."""
+
+    def save(self, email: str, code: str, ttl_seconds: float) -> None:
+        db = SessionLocal()
+        try:
+            crud.create_verification_code(
+                db, email=email, code=code, expires_at=datetime.utcnow() + timedelta(seconds=ttl_seconds)
+            )
+        finally:
+            db.close()
+
+    def consume(self, email: str, code: str) -> bool:
+        db = SessionLocal()
+        try:
+            return crud.consume_verification_code(db, email, code)
+        finally:
+            db.close()
+
+    def sweep(self) -> int:
+        db = SessionLocal()
+        try:
+            return crud.cleanup_expired_codes(db)
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        return {"store": "database"}
+
+
+def create_verification_store(kind: str = "") -> VerificationStore:
+    """Verification code store for VERIFICATION_STORE (memory or database)."""
+    kind = kind or settings.verification_store
+    if kind == "memory":
+        return MemoryVerificationStore()
+    if kind == "database":
+        return DatabaseVerificationStore()
+    raise ValueError(f"Unknown verification store: {kind}. Must be one of: {', '.join(STORES)}")
@@ -0,0 +1,79 @@
+"""Batch input validation and resumable result files."""
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from gateway.batches import (
+    RETRY_SECONDS,
+    BatchValidationError,
+    in_hours,
+    parse_hours,
+    read_progress,
+    retry_after,
+    validate_input_file,
+)
+
+
+def request_line(custom_id: str, url: str = "/v1/chat/completions") -> str:
+    return json.dumps({"custom_id": custom_id, "method": "POST", "url": url, "body": {"model": "llama"}})
+
+
+def result_line(custom_id: str) -> bytes:
+    return (json.dumps({"custom_id": custom_id, "response": {"status_code": 200}}) + "\n").encode()
+
+
+def test_read_progress_truncates_a_partial_line(tmp_path):
+    output, errors, missing = tmp_path / "output.jsonl", tmp_path / "errors.jsonl", tmp_path / "missing.jsonl"
+    output.write_bytes(result_line("r1") + result_line("r2") + b'{"custom_id": "r3", "resp')
+    errors.write_bytes(result_line("r4"))
+
+    done, lines = read_progress([str(output), str(errors), str(missing)])
+    assert done == {"r1", "r2", "r4"}
+    assert lines == [2, 1, 0]
+    assert output.read_bytes() == result_line("r1") + result_line("r2")
+
+    # Appending resumes on a line boundary
+    with open(output, "ab") as f:
+        f.write(result_line("r3"))
+    done, lines = read_progress([str(output), str(errors)])
+    assert done == {"r1", "r2", "r3", "r4"}
+    assert lines == [3, 1]
+
+
+def test_validate_input_file(tmp_path):
+    path = tmp_path / "input.jsonl"
+    path.write_text("\n".join([request_line("a"), "", request_line("b", "/v1/embeddings")]) + "\n")
+    assert validate_input_file(str(path), max_requests=2) == (2, {"/v1/chat/completions", "/v1/embeddings"})
+
+    with pytest.raises(BatchValidationError, match="at most 1"):
+        validate_input_file(str(path), max_requests=1)
+    path.write_text(request_line("a") + "\n" + request_line("a") + "\n")
+    with pytest.raises(BatchValidationError, match="Line 2: duplicate"):
+        validate_input_file(str(path), max_requests=10)
+    path.write_text(request_line("a", "/v1/models") + "\n")
+    with pytest.raises(BatchValidationError, match="Line 1: url"):
+        validate_input_file(str(path), max_requests=10)
+    path.write_text("\n")
+    with pytest.raises(BatchValidationError, match="no requests"):
+        validate_input_file(str(path), max_requests=10)
+
+
+def test_peak_hours():
+    assert parse_hours("") is None
+    assert not in_hours(None, 12)
+
+    day = parse_hours("9-18")
+    assert day == (9, 18)
+    assert in_hours(day, 9) and in_hours(day, 17)
+    assert not in_hours(day, 18) and not in_hours(day, 3)
+
+    night = parse_hours("22-6")
+    assert in_hours(night, 23) and in_hours(night, 0) and in_hours(night, 5)
+    assert not in_hours(night, 6) and not in_hours(night, 12)
+
+
+def test_retry_after():
+    assert retry_after(HTTPException(429, headers={"Retry-After": "42"})) == 42.0
+    assert retry_after(HTTPException(429, headers={"Retry-After": "soon"})) == RETRY_SECONDS
+    assert retry_after(HTTPException(429)) == RETRY_SECONDS
@@ -0,0 +1,101 @@
+"""Idempotency-Key store."""
+import asyncio
+
+import pytest
+
+from gateway.idempotency import IdempotencyConflict, IdempotencyStore, StoredResponse, request_fingerprint
+
+FINGERPRINT = request_fingerprint("POST", "v1/chat/completions", b'{"model": "llama"}')
+
+
+def response(content: bytes = b"{}", status_code: int = 200) -> StoredResponse:
+    return StoredResponse(status_code, content, "application/json")
+
+
+async def complete(store: IdempotencyStore, key: str, result: StoredResponse) -> StoredResponse:
+    async def call() -> StoredResponse:
+        return result
+
+    task = store.start((1, key), FINGERPRINT, call())
+    await task
+    await asyncio.sleep(0)  # Let the done callback run
+    return task.result()
+
+
+def test_completed_response_is_replayed_until_it_expires(clock):
+    store = IdempotencyStore(ttl_seconds=60, clock=clock)
+    asyncio.run(complete(store, "a", response(b"first")))
+
+    clock.now += 59
+    assert store.lookup((1, "a"), FINGERPRINT).content == b"first"
+    assert store.lookup((2, "a"), FINGERPRINT) is None  # Keys are per API key
+    clock.now += 1
+    assert store.lookup((1, "a"), FINGERPRINT) is None
+    assert store.stats()["bytes"] == 0
+    assert store.stats()["replayed"] == 1
+
+
+def test_retry_attaches_to_the_running_call():
+    async def main():
+        store = IdempotencyStore()
+        release = asyncio.Event()
+
+        async def call() -> StoredResponse:
+            await release.wait()
+            return response(b"done")
+
+        task = store.start((1, "a"), FINGERPRINT, call())
+        assert store.lookup((1, "a"), FINGERPRINT) is task
+        release.set()
+        await task
+        await asyncio.sleep(0)
+        assert store.lookup((1, "a"), FINGERPRINT).content == b"done"
+        return store.stats()
+
+    stats = asyncio.run(main())
+    assert stats["attached"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_key_reused_for_another_request_conflicts():
+    store = IdempotencyStore()
+    asyncio.run(complete(store, "a", response()))
+    other = request_fingerprint("POST", "v1/chat/completions", b'{"model": "other"}')
+    with pytest.raises(IdempotencyConflict):
+        store.lookup((1, "a"), other)
+
+
+def test_server_errors_and_failures_are_not_kept():
+    async def fail() -> StoredResponse:
+        raise RuntimeError("backend unreachable")
+
+    async def main(store: IdempotencyStore):
+        await complete(store, "error", response(status_code=503))
+        task = store.start((1, "failed"), FINGERPRINT, fail())
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    store = IdempotencyStore()
+    asyncio.run(main(store))
+    assert store.lookup((1, "error"), FINGERPRINT) is None
+    assert store.lookup((1, "failed"), FINGERPRINT) is None
+    assert store.stats()["in_flight"] == 0
+
+
+def test_oldest_responses_are_evicted_over_the_bounds():
+    store = IdempotencyStore(max_entries=3, max_bytes=10)
+
+    async def main():
+        for key in "abc":
+            await complete(store, key, response(b"1234"))  # 12 bytes: "a" is evicted
+        await complete(store, "d", response(b"1"))
+        await complete(store, "large", response(b"x" * 11))  # Larger than max_bytes, not kept
+
+    asyncio.run(main())
+    assert list(key for _, key in store.completed) == ["b", "c", "d"]
+    assert store.stats()["bytes"] == 9
+    assert store.stats()["evicted"] == 1
+
+    store.max_entries = 2
+    store.lookup((1, "d"), FINGERPRINT)
+    assert list(key for _, key in store.completed) == ["c", "d"]
@@ -0,0 +1,69 @@
+"""Schema upgrades of existing databases."""
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from shared import crud
+from shared.database import Base
+from shared.migrations import ensure_columns, hash_api_keys, upgrade
+
+LEGACY_KEYS = [f"sk-internal-legacy{i:04d}" for i in range(5)]
+
+
+@pytest.fixture
+def legacy_engine():
+    """Database created before keys were hashed: api_keys stores the raw key."""
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE api_keys ("
+            "id INTEGER PRIMARY KEY, key VARCHAR(100) NOT NULL, user_id VARCHAR(100) NOT NULL, "
+            "tier VARCHAR(50) NOT NULL, is_active BOOLEAN NOT NULL, created_at DATETIME NOT NULL, "
+            "updated_at DATETIME, expires_at DATETIME, description TEXT, created_by VARCHAR(100))"
+        ))
+        conn.execute(text("CREATE UNIQUE INDEX ix_api_keys_key ON api_keys (key)"))
+        for i, key in enumerate(LEGACY_KEYS, 1):
+            conn.execute(
+                text("INSERT INTO api_keys (id, key, user_id, tier, is_active, created_at) "
+                     "VALUES (:id, :key, :user_id, 'standard', 1, CURRENT_TIMESTAMP)"),
+                {"id": i, "key": key, "user_id": f"user{i}"},
+            )
+    yield engine
+    engine.dispose()
+
+
+def test_legacy_keys_are_hashed_and_still_work(legacy_engine):
+    Base.metadata.create_all(legacy_engine)
+    upgrade(legacy_engine, Base.metadata)
+
+    columns = {column["name"] for column in inspect(legacy_engine).get_columns("api_keys")}
+    assert "key" not in columns
+    assert {"key_hash", "key_prefix"} <= columns
+
+    db = sessionmaker(bind=legacy_engine)()
+    try:
+        for i, key in enumerate(LEGACY_KEYS, 1):
+            db_key = crud.get_api_key(db, key)
+            assert db_key.id == i
+            assert db_key.user_id == f"user{i}"
+            assert db_key.key_prefix == key[: crud.KEY_PREFIX_LENGTH]
+        assert crud.get_api_key(db, "sk-internal-unknown") is None
+    finally:
+        db.close()
+
+
+def test_hashing_in_batches_runs_once(legacy_engine):
+    Base.metadata.create_all(legacy_engine)
+    ensure_columns(legacy_engine, Base.metadata)
+
+    assert hash_api_keys(legacy_engine, batch_size=2) == len(LEGACY_KEYS)
+    assert hash_api_keys(legacy_engine, batch_size=2) == 0
+    upgrade(legacy_engine, Base.metadata)  # Nothing left to do
+
+    with legacy_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM api_keys WHERE key_hash IS NULL")).scalar() == 0
+
+
+def test_new_database_needs_no_hashing(engine):
+    assert hash_api_keys(engine) == 0
@@ -0,0 +1,125 @@
+"""Hierarchical quota enforcement."""
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from gateway.auth import APIKeyInfo
+from gateway.quota_tracker import QuotaTracker
+from shared import quotas
+from shared.models import Quota, QuotaUsage, Team, TeamMember
+
+NOW = datetime(2026, 3, 14, 12, 0).timestamp()
+ALICE = APIKeyInfo(key_id=1, key_prefix="sk-internal-abcd", user_id="alice", tier="standard")
+BOB = APIKeyInfo(key_id=2, key_prefix="sk-internal-efgh", user_id="bob", tier="standard")
+
+
+@pytest.fixture
+def tracker(db):
+    team = Team(name="research", organization="acme")
+    db.add(team)
+    db.flush()
+    db.add_all([
+        TeamMember(user_id="alice", team_id=team.id),
+        TeamMember(user_id="bob", team_id=team.id),
+        Quota(scope="team", subject="research", window="day", max_requests=3),
+        Quota(scope="user", subject="alice", window="month", max_tokens=100),
+    ])
+    db.commit()
+    tracker = QuotaTracker(clock=lambda: NOW)
+    tracker.load(db)
+    return tracker
+
+
+def test_team_quota_is_shared_by_its_members(tracker):
+    tracker.check(ALICE)
+    tracker.check(BOB)
+    tracker.check(ALICE)
+    with pytest.raises(HTTPException) as exc:
+        tracker.check(BOB)
+
+    assert exc.value.status_code == 429
+    assert exc.value.headers["X-Quota-Scope"] == "team"
+    assert exc.value.headers["X-Quota-Window"] == "day"
+    assert int(exc.value.headers["Retry-After"]) == 12 * 3600 + 1
+    assert tracker.rejected == 1
+
+
+def test_token_quota_rejects_once_used_up(tracker):
+    keys = tracker.check(ALICE)
+    tracker.add_tokens(keys, 100)
+    with pytest.raises(HTTPException) as exc:
+        tracker.check(ALICE)
+    assert exc.value.headers["X-Quota-Scope"] == "user"
+    tracker.check(BOB)  # Only alice has a token quota
+
+
+def test_flush_writes_usage_and_reloads_totals(db, tracker):
+    keys = tracker.check(ALICE)
+    tracker.add_tokens(keys, 40)
+    tracker.check(BOB)
+
+    assert tracker.flush(db) == 2
+    assert not tracker.pending and not tracker.flushing
+    periods = quotas.current_periods(datetime.utcfromtimestamp(NOW))
+    assert tracker.totals[("team", "research", "day", periods["day"])] == (2, 40)
+    assert tracker.totals[("user", "alice", "month", periods["month"])] == (1, 40)
+
+    # Another gateway sees the same stored usage
+    other = QuotaTracker(clock=lambda: NOW)
+    other.load(db)
+    other.check(BOB)
+    with pytest.raises(HTTPException):
+        other.check(BOB)
+
+
+def test_failed_flush_keeps_the_counts(db, tracker, monkeypatch):
+    tracker.check(ALICE)
+
+    def fail(db, counters):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(quotas, "merge_usage", fail)
+    with pytest.raises(RuntimeError):
+        tracker.flush(db)
+    assert not tracker.flushing
+    assert sum(requests for requests, _ in tracker.pending.values()) == 2  # Team and user periods
+    tracker.check(BOB)
+    tracker.check(BOB)
+    with pytest.raises(HTTPException):
+        tracker.check(ALICE)  # The unwritten request still counts
+
+    monkeypatch.undo()
+    tracker.flush(db)
+    assert db.query(QuotaUsage).filter_by(scope="team").one().requests == 3
+
+
+def test_no_quotas_admits_everything(db):
+    tracker = QuotaTracker(clock=lambda: NOW)
+    tracker.load(db)
+    assert tracker.check(ALICE) == []
+    assert tracker.flush(db) == 0
+
+
+def test_failed_reload_keeps_the_written_counts(db, tracker, monkeypatch):
+    tracker.check(ALICE)
+
+    def fail(db):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(quotas, "load_quotas", fail)
+    with pytest.raises(RuntimeError):
+        tracker.flush(db)  # Written, but not reloaded
+    tracker.check(BOB)
+    with pytest.raises(RuntimeError):
+        tracker.flush(db)
+    assert db.query(QuotaUsage).filter_by(scope="team").one().requests == 2
+    tracker.check(ALICE)
+    with pytest.raises(HTTPException):
+        tracker.check(BOB)  # Both written requests still count
+
+    monkeypatch.undo()
+    tracker.flush(db)
+    assert not tracker.flushing
+    periods = quotas.current_periods(datetime.utcfromtimestamp(NOW))
+    assert tracker.used(("team", "research", "day", periods["day"])) == (3, 0)
@@ -0,0 +1,136 @@
+"""Rate limits shared across gateway nodes."""
+import pytest
+from fastapi import HTTPException
+
+from gateway.auth import APIKeyInfo
+from gateway.rate_limit_sync import RateLimitSync
+from gateway.rate_limiter import RateLimiter
+from shared import rate_limit_reports
+from shared.config import settings
+from shared.models import RateLimitReport
+
+ALICE = APIKeyInfo(key_id=1, key_prefix="sk-internal-abcd", user_id="alice", tier="standard")
+MINUTE_LIMIT = settings.rate_limit_standard_per_minute
+HOUR_LIMIT = settings.rate_limit_standard_per_hour
+
+
+class Node:
+    """A gateway node: its limiter and the sync sharing its limits."""
+
+    def __init__(self, node_id: str, clock):
+        self.sync = RateLimitSync(node_id, sync_seconds=1.0, share_floor=0.1, clock=clock)
+        self.limiter = RateLimiter(clock=clock, sync=self.sync)
+        self.admitted = 0
+
+    def send(self, count: int) -> None:
+        for _ in range(count):
+            try:
+                self.limiter.check_rate_limit(ALICE)
+                self.admitted += 1
+            except HTTPException:
+                pass
+
+    def run_sync(self, db) -> int:
+        return self.sync.sync(db, self.limiter.request_history)
+
+    def caps(self):
+        return self.sync.local_limits("alice", MINUTE_LIMIT, HOUR_LIMIT)
+
+
+@pytest.fixture
+def nodes(db, clock):
+    a, b = Node("a", clock), Node("b", clock)
+    a.run_sync(db)
+    b.run_sync(db)
+    a.run_sync(db)  # Both nodes now know of each other
+    return a, b
+
+
+def sync_all(db, a: Node, b: Node) -> None:
+    """Sync both nodes, then a again so they work from the same reports."""
+    a.run_sync(db)
+    b.run_sync(db)
+    a.run_sync(db)
+
+
+def test_limits_are_split_between_live_nodes(nodes):
+    a, b = nodes
+    assert a.sync.live_nodes == b.sync.live_nodes == 2
+    assert a.caps()[0] + b.caps()[0] <= MINUTE_LIMIT + 2
+
+
+def test_allotments_stay_within_the_limit(db, clock, nodes):
+    a, b = nodes
+    for second in range(120):
+        a.send(3)
+        b.send(1)
+        clock.now += 0.5
+        sync_all(db, a, b)
+        clock.now += 0.5
+
+        minute_caps = a.caps()[0] + b.caps()[0]
+        hour_caps = a.caps()[1] + b.caps()[1]
+        assert minute_caps <= MINUTE_LIMIT + 2, second
+        assert hour_caps <= HOUR_LIMIT + 2, second
+
+    assert a.admitted + b.admitted <= 2 * (MINUTE_LIMIT + 2)
+    # Rounding up is the only excess the reports show
+    for node in (a, b):
+        assert node.sync.stats()["overshoot"]["max_requests"] <= 2
+
+
+def test_share_follows_demand(db, clock, nodes):
+    a, b = nodes
+    a.send(6)
+    b.send(2)
+    clock.now += 0.5
+    sync_all(db, a, b)
+
+    # Three quarters of the demand reaches a: 0.9 of the remainder by demand, 0.1 evenly
+    assert a.sync.allotments["alice"].share == pytest.approx(0.9 * 0.75 + 0.05)
+    assert b.sync.allotments["alice"].share == pytest.approx(0.9 * 0.25 + 0.05)
+    assert a.caps()[0] > b.caps()[0]
+
+    # Traffic moving to b moves the share with it once a's demand is stale
+    clock.now += a.sync.demand_seconds + 0.5
+    b.send(4)
+    sync_all(db, a, b)
+    assert b.sync.allotments["alice"].share > 0.9
+    assert a.sync.allotments["alice"].share == pytest.approx(0.05)
+
+
+def test_overshoot_is_measured(db, clock):
+    # Before their first sync each node admits the whole limit
+    a, b = Node("a", clock), Node("b", clock)
+    a.send(MINUTE_LIMIT)
+    b.send(MINUTE_LIMIT)
+    clock.now += 0.5
+    sync_all(db, a, b)
+
+    overshoot = a.sync.stats()["overshoot"]
+    assert overshoot["last_sync_users"] == 1
+    assert overshoot["max_requests"] == MINUTE_LIMIT
+    assert a.caps()[0] == MINUTE_LIMIT  # Nothing more until the window moves on
+    a.send(1)
+    assert a.admitted == MINUTE_LIMIT
+
+
+def test_demand_is_kept_when_the_write_fails(db, monkeypatch, nodes):
+    a, _ = nodes
+
+    def fail(*args):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(rate_limit_reports, "write_reports", fail)
+    a.send(3)
+    with pytest.raises(RuntimeError):
+        a.run_sync(db)
+    assert a.sync.demand["alice"][0] == 3
+
+    a.send(2)
+    monkeypatch.undo()
+    assert a.run_sync(db) == 1
+    report = db.query(RateLimitReport).filter_by(node_id="a", user_id="alice").one()
+    assert report.demand == 5
+    assert report.minute_requests == 5
+    assert not a.sync.demand
@@ -0,0 +1,131 @@
+"""Sliding window rate limiter."""
+import pytest
+from fastapi import HTTPException
+
+from gateway.auth import APIKeyInfo
+from gateway.rate_limiter import WINDOW_SECONDS, RateLimiter
+from shared.config import settings
+
+
+def user(user_id: str) -> APIKeyInfo:
+    return APIKeyInfo(key_id=1, key_prefix="sk-internal-abcd", user_id=user_id, tier="free")
+
+
+def send(limiter: RateLimiter, clock, user_id: str, count: int, interval: float = 1.0) -> None:
+    for _ in range(count):
+        limiter.check_rate_limit(user(user_id))
+        clock.now += interval
+
+
+def remaining_hour(limiter: RateLimiter, user_id: str) -> int:
+    return limiter.get_rate_limit_status(user(user_id))[3]
+
+
+def test_snapshot_round_trip(tmp_path, clock):
+    path = str(tmp_path / "limiter.snapshot")
+    limiter = RateLimiter(clock=clock)
+    send(limiter, clock, "alice", 5)
+    send(limiter, clock, "bob", 3)
+    clock.now += WINDOW_SECONDS - 4  # alice's first request leaves the window
+    assert limiter.snapshot(path) == 2
+
+    restored = RateLimiter(clock=clock)
+    assert restored.restore(path) == 2
+    assert restored.stats()["restored_principals"] == 2
+    assert remaining_hour(restored, "alice") == remaining_hour(limiter, "alice")
+    assert restored.stats()["restored_principals"] == 1  # Rebuilt on first use
+    assert remaining_hour(restored, "bob") == settings.rate_limit_free_per_hour - 3
+
+    # A restored history keeps counting where it left off
+    send(restored, clock, "bob", 1)
+    assert remaining_hour(restored, "bob") == settings.rate_limit_free_per_hour - 4
+
+
+def test_snapshot_of_restored_histories(tmp_path, clock):
+    first, second = str(tmp_path / "first"), str(tmp_path / "second")
+    limiter = RateLimiter(clock=clock)
+    send(limiter, clock, "alice", 2)
+    send(limiter, clock, "bob", 2)
+    limiter.snapshot(first)
+
+    restored = RateLimiter(clock=clock)
+    restored.restore(first)
+    send(restored, clock, "alice", 1)  # Moved out of the restored histories; bob is not
+    assert restored.snapshot(second) == 2
+
+    again = RateLimiter(clock=clock)
+    assert again.restore(second) == 2
+    assert remaining_hour(again, "alice") == settings.rate_limit_free_per_hour - 3
+    assert remaining_hour(again, "bob") == settings.rate_limit_free_per_hour - 2
+
+
+def test_restore_skips_missing_and_expired_snapshots(tmp_path, clock):
+    path = str(tmp_path / "limiter.snapshot")
+    limiter = RateLimiter(clock=clock)
+    assert limiter.restore(path) == 0
+
+    send(limiter, clock, "alice", 1)
+    limiter.snapshot(path)
+    clock.now += WINDOW_SECONDS + 1
+    assert RateLimiter(clock=clock).restore(path) == 0
+
+
+def test_restore_rejects_other_files(tmp_path):
+    path = tmp_path / "limiter.snapshot"
+    path.write_bytes(b"not a snapshot" + bytes(64))
+    with pytest.raises(ValueError):
+        RateLimiter().restore(str(path))
+
+
+def test_restored_limits_are_enforced(tmp_path, clock):
+    path = str(tmp_path / "limiter.snapshot")
+    limiter = RateLimiter(clock=clock)
+    send(limiter, clock, "alice", settings.rate_limit_free_per_minute, interval=0.1)
+    limiter.snapshot(path)
+
+    restored = RateLimiter(clock=clock)
+    restored.restore(path)
+    with pytest.raises(HTTPException) as exc:
+        restored.check_rate_limit(user("alice"))
+    assert exc.value.status_code == 429
+
+
+def test_evict_idle_drops_only_idle_users(clock):
+    limiter = RateLimiter(clock=clock)
+    send(limiter, clock, "idle1", 1)
+    send(limiter, clock, "idle2", 1)
+    send(limiter, clock, "active", 1)
+    clock.now += WINDOW_SECONDS - 3  # idle1's request is at the edge of the window
+
+    assert limiter.evict_idle() == 0
+    clock.now += 2
+    send(limiter, clock, "active", 1)
+    assert limiter.evict_idle(max_evictions=1) == 1
+    assert limiter.evict_idle() == 1
+    assert list(limiter.request_history) == ["active"]
+    assert limiter.stats()["evicted_idle"] == 2
+
+
+def test_lru_cap_evicts_least_recently_seen_user(clock):
+    limiter = RateLimiter(clock=clock, max_principals=2)
+    send(limiter, clock, "alice", 1)
+    send(limiter, clock, "bob", 1)
+    send(limiter, clock, "alice", 1)
+    send(limiter, clock, "carol", 1)
+
+    assert list(limiter.request_history) == ["alice", "carol"]
+    assert limiter.stats()["evicted_lru"] == 1
+    assert remaining_hour(limiter, "bob") == settings.rate_limit_free_per_hour  # Starts over
+
+
+def test_evict_idle_drops_expired_restored_histories(tmp_path, clock):
+    path = str(tmp_path / "limiter.snapshot")
+    limiter = RateLimiter(clock=clock)
+    send(limiter, clock, "alice", 1)
+    limiter.snapshot(path)
+
+    restored = RateLimiter(clock=clock)
+    restored.restore(path)
+    clock.now += WINDOW_SECONDS + 1
+    restored.evict_idle()
+    assert restored.stats()["restored_principals"] == 0
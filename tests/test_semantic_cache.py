@@ -0,0 +1,216 @@
+"""Semantic response cache, with the mock backend's deterministic embeddings."""
+import asyncio
+import json
+
+import pytest
+
+from starlette.requests import Request
+
+import gateway.main as gateway
+from benchmarks.mock_vllm import mock_embedding
+from gateway.auth import APIKeyInfo
+from gateway.idempotency import IdempotencyStore, StoredResponse
+from gateway.quota_tracker import QuotaTracker
+from gateway.rate_limiter import RateLimiter
+from gateway.semantic_cache import SemanticCache, prompt_text
+
+PATH = "v1/chat/completions"
+QUESTION = "What is the capital of France?"
+NEAR_DUPLICATE = "what is the capital of France"  # Similarity 0.96
+UNRELATED = "Write a poem about the sea"
+
+
+async def embed(text: str):
+    return mock_embedding(text, 256)
+
+
+def body(content: str, model: str = "llama", **params) -> bytes:
+    return json.dumps({"model": model, "messages": [{"role": "user", "content": content}], **params}).encode()
+
+
+def response(content: bytes = b'{"choices": []}', status_code: int = 200) -> StoredResponse:
+    return StoredResponse(status_code, content, "application/json")
+
+
+def lookup(cache: SemanticCache, content: str, tenant: str = "alice", cache_control=None, **kwargs):
+    query = cache.query(tenant, PATH, body(content, **kwargs), cache_control)
+    return query, asyncio.run(cache.lookup(query))
+
+
+def cached(cache: SemanticCache, content: str, result: StoredResponse = None, **kwargs) -> None:
+    query, miss = lookup(cache, content, **kwargs)
+    assert miss.response is None
+    assert cache.store(query, miss.vector, result or response())
+
+
+@pytest.fixture
+def cache(clock):
+    return SemanticCache(embed, threshold=0.9, clock=clock)
+
+
+def test_near_duplicate_prompt_hits(cache):
+    cached(cache, QUESTION, response(b"Paris"))
+
+    _, hit = lookup(cache, NEAR_DUPLICATE)
+    assert hit.response.content == b"Paris"
+    assert hit.similarity > 0.95
+    _, miss = lookup(cache, UNRELATED)
+    assert miss.response is None
+    assert miss.similarity < 0.5
+    assert cache.stats()["hits"] == 1
+
+
+def test_threshold(cache):
+    cached(cache, QUESTION)
+    cache.threshold = 0.99
+    _, miss = lookup(cache, NEAR_DUPLICATE)
+    assert miss.response is None
+    assert miss.similarity < 0.99
+
+
+def test_namespaces_never_share_responses(cache):
+    cached(cache, QUESTION)
+
+    for kwargs in ({"tenant": "bob"}, {"model": "other"}, {"temperature": 0.2}):
+        _, miss = lookup(cache, QUESTION, **kwargs)
+        assert miss.response is None, kwargs
+    assert cache.query("alice", "v1/embeddings", body(QUESTION)) is None
+    assert cache.query("alice", PATH, body(QUESTION, stream=True)) is None
+    assert lookup(cache, QUESTION)[1].response is not None
+
+
+def test_cache_control(cache):
+    query, _ = lookup(cache, QUESTION, cache_control="no-store")
+    assert not query.store
+    cached(cache, QUESTION)
+    _, refreshed = lookup(cache, QUESTION, cache_control="no-cache")
+    assert refreshed.response is None
+    assert cache.query("alice", PATH, body(QUESTION), "no-cache, no-store") is None
+
+
+def test_only_successful_responses_are_stored(cache):
+    query, miss = lookup(cache, QUESTION)
+    assert not cache.store(query, miss.vector, response(status_code=500))
+    assert cache.stats()["entries"] == 0
+
+
+def test_entries_expire(cache):
+    cache.ttl_seconds = 60
+    cached(cache, QUESTION)
+    cache.clock.now += 60
+    _, miss = lookup(cache, QUESTION)
+    assert miss.response is None
+    assert cache.stats()["expired"] == 1
+    assert cache.stats()["namespaces"] == 0
+
+
+def test_least_recently_used_are_evicted(cache):
+    cache.max_entries = 2
+    cached(cache, QUESTION)
+    cached(cache, UNRELATED)
+    assert lookup(cache, QUESTION)[1].response is not None  # Now the most recently used
+    cached(cache, "How do I sort a list in Python?")
+
+    assert lookup(cache, UNRELATED)[1].response is None
+    assert lookup(cache, QUESTION)[1].response is not None
+    assert cache.stats()["evicted"] == 1
+
+
+def test_byte_bound(cache):
+    cache.max_bytes = 10
+    cached(cache, QUESTION, response(b"x" * 6))
+    cached(cache, UNRELATED, response(b"y" * 6))
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == 6
+
+
+def test_embedding_failure_passes_through():
+    async def broken(text: str):
+        raise ConnectionError("backend unreachable")
+
+    cache = SemanticCache(broken)
+    _, result = lookup(cache, QUESTION)
+    assert result.response is None
+    assert result.vector is None
+    assert cache.stats()["embed_errors"] == 1
+
+
+def test_prompt_text():
+    assert prompt_text({"messages": [{"role": "user", "content": [{"type": "text", "text": "hi"}]}]}) == "user: hi"
+    assert prompt_text({"prompt": "hi"}) == "hi"
+    assert prompt_text({"prompt": [1, 2, 3]}) is None
+    assert prompt_text({"messages": [{"role": "user", "content": [{"type": "image_url"}]}]}) is None
+    assert prompt_text({"messages": [{"role": "assistant", "tool_calls": []}]}) is None
+
+
+def test_mock_embedding_is_deterministic():
+    vector = mock_embedding(QUESTION, 64)
+    assert vector == mock_embedding(QUESTION, 64)
+    assert len(vector) == 64
+    assert sum(v * v for v in vector) == pytest.approx(1.0)
+
+
+ALICE = APIKeyInfo(key_id=1, key_prefix="sk-internal-abcd", user_id="alice", tier="standard")
+
+
+@pytest.fixture
+def proxy(monkeypatch):
+    """The gateway's proxy with the semantic cache on, a slow embedding and a fake backend."""
+    calls = []
+
+    async def slow_embed(text: str):
+        await asyncio.sleep(0.01)  # Long enough for a concurrent retry to arrive
+        return mock_embedding(text, 256)
+
+    async def backend(method, path, body, content_type, api_key_info, quota_keys, start_time):
+        calls.append(body)
+        await asyncio.sleep(0.01)
+        return response(f"answer {len(calls)}".encode())
+
+    async def log_request(**fields):
+        pass
+
+    monkeypatch.setattr(gateway, "semantic_cache", SemanticCache(slow_embed))
+    monkeypatch.setattr(gateway, "idempotency_store", IdempotencyStore())
+    monkeypatch.setattr(gateway, "rate_limiter", RateLimiter())
+    monkeypatch.setattr(gateway, "quota_tracker", QuotaTracker())
+    monkeypatch.setattr(gateway, "call_llm_backend", backend)
+    monkeypatch.setattr(gateway, "log_request", log_request)
+    return calls
+
+
+def proxy_request(content: str, idempotency_key: str = None):
+    headers = [(b"content-type", b"application/json")]
+    if idempotency_key:
+        headers.append((b"idempotency-key", idempotency_key.encode()))
+    data = body(content)
+
+    async def receive():
+        return {"type": "http.request", "body": data, "more_body": False}
+
+    request = Request({"type": "http", "method": "POST", "path": f"/{PATH}", "headers": headers, "query_string": b""}, receive)
+    return gateway.proxy_to_llm_backend(request, PATH, ALICE)
+
+
+def test_concurrent_retries_make_one_backend_call(proxy):
+    async def main():
+        return await asyncio.gather(proxy_request(QUESTION, "retry"), proxy_request(QUESTION, "retry"))
+
+    first, retry = asyncio.run(main())
+    assert len(proxy) == 1
+    assert first.body == retry.body == b"answer 1"
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+
+def test_semantic_cache_hit_is_kept_for_retries(proxy, monkeypatch):
+    asyncio.run(proxy_request(QUESTION))
+    hit = asyncio.run(proxy_request(NEAR_DUPLICATE, "retry"))
+    assert hit.headers["X-Semantic-Cache"] == "hit"
+    assert len(proxy) == 1
+
+    # A retry is answered with the same response even once the cache lost it
+    monkeypatch.setattr(gateway, "semantic_cache", SemanticCache(embed))
+    retry = asyncio.run(proxy_request(NEAR_DUPLICATE, "retry"))
+    assert retry.body == hit.body
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert len(proxy) == 1
@@ -0,0 +1,70 @@
+"""Usage rollup compaction."""
+from datetime import datetime, timedelta
+
+from shared import usage_rollups
+from shared.models import RequestLog, RollupState, UsageRollup
+
+TABLE = RequestLog.__table__
+
+
+def add_log(db, log_id, age_seconds=120, user_id="alice", tokens=(10, 5), status_code=200):
+    db.add(RequestLog(
+        id=log_id,
+        user_id=user_id,
+        api_key_id=1,
+        endpoint="v1/chat/completions",
+        method="POST",
+        status_code=status_code,
+        duration_ms=100.0,
+        prompt_tokens=tokens[0],
+        completion_tokens=tokens[1],
+        total_tokens=sum(tokens),
+        model="llama",
+        timestamp=datetime.utcnow() - timedelta(seconds=age_seconds),
+    ))
+    db.commit()
+
+
+def day_requests(db):
+    return sum(row.requests for row in db.query(UsageRollup).filter_by(granularity="day"))
+
+
+def test_compaction_counts_each_log_once(db):
+    for log_id in range(1, 6):
+        add_log(db, log_id, status_code=500 if log_id == 5 else 200)
+
+    assert usage_rollups.compact_table(db, TABLE) == 5
+    assert usage_rollups.compact_table(db, TABLE) == 0
+    add_log(db, 6)
+    assert usage_rollups.compact_table(db, TABLE) == 1
+
+    assert db.get(RollupState, "request_logs").last_log_id == 6
+    for granularity in usage_rollups.GRANULARITIES:
+        (row,) = usage_rollups.query_usage(db, granularity=granularity, days=1)
+        assert row.requests == 6
+        assert row.errors == 1
+        assert row.total_tokens == 90
+
+
+def test_small_batches_reach_the_same_totals(db):
+    for log_id in range(1, 8):
+        add_log(db, log_id, user_id=f"user{log_id % 3}")
+
+    assert usage_rollups.compact_table(db, TABLE, batch_size=2, max_batches=1) == 2
+    assert usage_rollups.compact_table(db, TABLE, batch_size=2) == 5
+    assert day_requests(db) == 7
+    (row,) = usage_rollups.query_usage(db, days=1, user_id="user1")
+    assert row.requests == 3
+
+
+def test_watermark_stops_at_the_first_unsettled_log(db):
+    add_log(db, 1)
+    add_log(db, 3, age_seconds=1)  # Committed, but id 2 is still being written
+    add_log(db, 4)  # Settled, yet behind an unsettled id
+
+    assert usage_rollups.compact_table(db, TABLE, settle_seconds=30) == 1
+    assert db.get(RollupState, "request_logs").last_log_id == 1
+
+    add_log(db, 2, age_seconds=1)  # The late commit
+    assert usage_rollups.compact_table(db, TABLE, settle_seconds=0) == 3
+    assert day_requests(db) == 4
@@ -0,0 +1,70 @@
+"""Email verification code stores."""
+import pytest
+
+from shared.verification_store import MemoryVerificationStore, VerificationStore, create_verification_store
+
+EMAIL = "alice@example.com"
+
+
+@pytest.fixture
+def store(clock):
+    return MemoryVerificationStore(clock=clock)
+
+
+def test_code_is_single_use(store):
+    store.save(EMAIL, "123456", 300)
+    assert not store.consume(EMAIL, "654321")
+    assert not store.consume("bob@example.com", "123456")
+    assert store.consume(EMAIL, "123456")
+    assert not store.consume(EMAIL, "123456")
+    assert store.stats()["consumed"] == 1
+    assert len(store) == 0
+
+
+def test_expired_code_is_refused(store, clock):
+    store.save(EMAIL, "123456", 300)
+    clock.now += 300
+    assert not store.consume(EMAIL, "123456")
+
+
+def test_sweep_drops_expired_codes_in_expiry_order(store, clock):
+    store.save(EMAIL, "111111", 60)
+    store.save(EMAIL, "222222", 300)
+    store.save("bob@example.com", "333333", 120)
+
+    assert store.sweep() == 0
+    clock.now += 120
+    assert store.sweep() == 2
+    assert len(store) == 1
+    assert store.consume(EMAIL, "222222")
+    assert store.stats()["expired"] == 2
+
+
+def test_sweep_skips_stale_entries_of_reissued_codes(store, clock):
+    store.save(EMAIL, "123456", 60)
+    store.save(EMAIL, "123456", 300)  # Re-issued: the first heap entry is stale
+
+    clock.now += 60
+    assert store.sweep() == 0
+    assert store.consume(EMAIL, "123456")
+    clock.now += 240
+    assert store.sweep() == 0  # Consumed, nothing left to drop
+
+
+def test_sweep_compacts_stale_heap_entries(store):
+    for i in range(2000):
+        store.save(EMAIL, f"{i:06d}", 300)
+        store.consume(EMAIL, f"{i:06d}")
+    store.save(EMAIL, "999999", 300)
+
+    assert store.sweep() == 0
+    assert len(store._expiries) == 1
+    assert store.consume(EMAIL, "999999")
+
+
+def test_stores():
+    with pytest.raises(TypeError):
+        VerificationStore()
+    assert isinstance(create_verification_store("memory"), MemoryVerificationStore)
+    with pytest.raises(ValueError):
+        create_verification_store("redis")